@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+'''
+Benchmarks for the card renderer, run from the root of the repository with ImageMagick installed.
+
+    benchmark.py save BINDS [REPEATS]
+        Draw the cards for a bindings file, then compare saving each by re-encoding it in full with saving it by
+        patching only the tiles that were drawn on. Reports time, file size and PSNR against the drawn image.
+'''
+
+import os
+import sys
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from wand.drawing import Drawing
+from wand.image import Image
+
+from www.scripts import bindings
+
+
+def timeCall(function, repeats):
+    best = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def psnr(img, path):
+    with Image(filename=str(path)) as saved:
+        (difference, distortion) = img.compare(saved, metric='peak_signal_to_noise_ratio')
+        difference.close()
+        return distortion
+
+
+def benchmarkSave(bindsPath, repeats, outputPath):
+    (physicalKeys, modifiers, devices) = bindings.parseBindings('000000', bindsPath.read_bytes(), bindings.groupStyles.keys(), bindings.Errors())
+    config = bindings.Config('000000')
+    print('%-28s %10s %10s %10s %10s %8s %8s %6s' % ('Template', 'Full (ms)', 'Patch (ms)', 'Full (KB)', 'Patch (KB)', 'Full dB', 'Patch dB', 'Tiles'))
+    for supportedDeviceKey, supportedDevice in bindings.supportedDevices.items():
+        if supportedDeviceKey == 'Keyboard':
+            continue
+        if not any(devices.get('%s::0' % device) is not None for device in supportedDevice.get('KeyDevices', supportedDevice['HandledDevices'])):
+            continue
+        templateName = supportedDevice['Template']
+        if bindings.patchableTemplate(templateName) is None:
+            try:
+                bindings.buildPatchableTemplate(Path('../res/%s.jpg' % templateName))
+            except bindings.jpegPatch.UnsupportedJpeg as e:
+                print('%-28s not patchable (%s)' % (templateName, e))
+                continue
+        patchable = bindings.patchableTemplate(templateName)
+
+        with bindings.openTemplate(templateName) as img:
+            with Drawing() as context:
+                urlBox = bindings.writeUrlToDrawing(config, context, False, img)
+                boxes = bindings.drawHOTASImage(context, img, physicalKeys, modifiers, supportedDevice['HandledDevices'], 40, config, 'None', 0)
+                boxes.append(urlBox)
+                context.draw(img)
+            fullPath = outputPath / ('%s-full.jpg' % templateName)
+            patchedPath = outputPath / ('%s-patched.jpg' % templateName)
+            fullTime = timeCall(lambda: img.save(filename=str(fullPath)), repeats)
+            patchTime = timeCall(lambda: bindings.saveCardImage(img, templateName, boxes, patchedPath), repeats)
+            print('%-28s %10.1f %10.1f %10.1f %10.1f %8.2f %8.2f %6d' % (templateName, fullTime * 1000, patchTime * 1000,
+                fullPath.stat().st_size / 1024, patchedPath.stat().st_size / 1024, psnr(img, fullPath), psnr(img, patchedPath),
+                len(patchable.tilesTouching(boxes))))
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] != 'save':
+        print(__doc__)
+        return 1
+    bindsPath = Path(sys.argv[2]).resolve()
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    with TemporaryDirectory() as tempDir:
+        if bindings.Config.cachePath() is None:
+            os.environ['EDREFCARD_CACHE_DIR'] = tempDir
+        # Template paths are relative to the scripts directory, as for the CGI script itself
+        os.chdir(str(Path(__file__).resolve().parent / 'www' / 'scripts'))
+        benchmarkSave(bindsPath, repeats, Path(tempDir))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+
+'''
+Rebuild the index of public configurations in EDREFCARD_CACHE_DIR from their replay files, run from the root of the
+repository. The list page rebuilds the index itself if it is missing or out of date, so this is for doing that ahead of
+time, or for picking up replay files that have been added or removed by hand.
+'''
+
+import os
+import sys
+from pathlib import Path
+
+from www.scripts import bindings
+
+
+def main():
+    if bindings.Config.cachePath() is None:
+        print('EDREFCARD_CACHE_DIR must be set to the cache directory the web server uses')
+        return 1
+    # The configurations are found relative to the scripts directory, as for the CGI script itself
+    os.chdir(str(Path(__file__).resolve().parent / 'www' / 'scripts'))
+    configIndex = bindings.openConfigIndex()
+    indexed = bindings.updateConfigIndex(configIndex, force=True)
+    configIndex.close()
+    print('%d configurations indexed' % indexed)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+'''
+Turn the pickled replay info of configurations published by earlier versions into replay records, run from the root of
+the repository. Replays are migrated in parallel, and each is replaced whole, so this can be run while the site is up.
+Replays that are already records are left alone, so it can be run again to pick up any that failed.
+'''
+
+import os
+import sys
+from multiprocessing import Pool
+from pathlib import Path
+
+from www.scripts import bindings
+
+
+def migrate(replayPath):
+    try:
+        with replayPath.open('rb') as replayFile:
+            if replayFile.read(1) == b'{':
+                return (replayPath, False, None)
+        bindings.writeReplayRecord(replayPath, bindings.replayRecord(bindings.Config.unpickle(replayPath)))
+        return (replayPath, True, None)
+    except Exception as e:
+        return (replayPath, False, str(e))
+
+
+def main():
+    # The configurations are found relative to the scripts directory, as for the CGI script itself
+    os.chdir(str(Path(__file__).resolve().parent / 'www' / 'scripts'))
+    replayPaths = list(bindings.Config.configsPath().glob('**/*.replay'))
+    migrated = 0
+    failed = 0
+    with Pool() as pool:
+        for (replayPath, wasMigrated, error) in pool.imap_unordered(migrate, replayPaths, chunksize=64):
+            if error is not None:
+                print('%s: not migrated (%s)' % (replayPath, error))
+                failed = failed + 1
+            elif wasMigrated:
+                migrated = migrated + 1
+    print('%d replays migrated, %d already records, %d failed' % (migrated, len(replayPaths) - migrated - failed, failed))
+    return 1 if failed > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
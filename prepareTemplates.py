@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+'''
+Build the template caches in EDREFCARD_CACHE_DIR ahead of time: the decoded (MPC) copy of each template, and the
+restart-coded JPEG used to save cards by patching only the tiles that were drawn on.
+Templates that can't be patched (progressive JPEGs) are reported and will be saved in full as before.
+'''
+
+import os
+import sys
+from multiprocessing import Pool
+from pathlib import Path
+
+from www.scripts import bindings
+
+
+def prepare(templateName):
+    sourcePath = Path('../res/%s.jpg' % templateName)
+    with bindings.openTemplate(templateName):
+        pass
+    if templateName == 'keyboard':
+        # The keyboard is always saved in full
+        return (templateName, None)
+    try:
+        bindings.buildPatchableTemplate(sourcePath)
+        return (templateName, None)
+    except (OSError, bindings.jpegPatch.UnsupportedJpeg) as e:
+        return (templateName, str(e))
+
+
+def main():
+    if bindings.Config.cachePath() is None:
+        print('EDREFCARD_CACHE_DIR must be set to the cache directory the web server uses')
+        return 1
+    # Template paths are relative to the scripts directory, as for the CGI script itself
+    os.chdir(str(Path(__file__).resolve().parent / 'www' / 'scripts'))
+    templateNames = sorted(set(bindings.supportedDevicesByTemplate) | {'keyboard'})
+    with Pool() as pool:
+        for (templateName, error) in pool.imap_unordered(prepare, templateNames):
+            if error is None:
+                print('%s: prepared' % templateName)
+            else:
+                print('%s: not patchable (%s)' % (templateName, error))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
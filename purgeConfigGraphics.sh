@@ -1,5 +1,12 @@
 #!/bin/sh
 DIR=`dirname "$0"`
 
-# purge all .jpg and .svg files over 1 day old
-find "$DIR/www/configs" \( -iname "*.jpg" -or -iname "*.svg" \) \! \( -newerct '1 day ago' \) -delete
+# purge all cards over 1 day old
+find "$DIR/www/configs" \( -iname "*.jpg" -or -iname "*.svg" -or -iname "*.webp" -or -iname "*.avif" \) \! \( -newerct '1 day ago' \) -delete
+
+# purge cached cards that haven't been used for a week
+if [ -n "$EDREFCARD_CACHE_DIR" ] && [ -d "$EDREFCARD_CACHE_DIR/cards" ]; then
+    find "$EDREFCARD_CACHE_DIR/cards" -name "*.info" \! -newermt '7 days ago' | while read INFO; do
+        rm -f "${INFO%.info}".*
+    done
+fi
@@ -2,7 +2,7 @@
 
 '''
 Walk the configs dir and reap all unpublished configs.
-These are configs that have no saved ".replay" pickle file.
+These are configs that have no saved ".replay" file.
 '''
 
 import sys
@@ -3,10 +3,22 @@
 from unittest import TestCase, mock, main as testmain
 from unittest.mock import MagicMock
 import os
+import sys
 import string
 from collections import OrderedDict
 from pathlib import Path
+from tempfile import TemporaryDirectory
 import contextlib
+import base64
+import io
+import pickle
+import json
+import datetime
+import shutil
+import gzip
+import html
+import re
+import urllib.parse
 from www.scripts import bindings
 
 
@@ -63,11 +75,9 @@ class ConfigTests(TestCase):
         
     def testNames(self):
         # should not raise
-        allConfigs = bindings.Config.allConfigs(sortKey=lambda obj: str(obj['description']).casefold())
         searchOpts = {}
-        with contextlib.redirect_stdout(None):
-            for obj in allConfigs:
-                bindings.printListItem(obj, searchOpts)
+        with mock.patch.dict(os.environ, {'EDREFCARD_CACHE_DIR': ''}), contextlib.redirect_stdout(io.StringIO()):
+            bindings.printList(bindings.Mode.list, searchOpts)
 
 
 class ErrorTests(TestCase):
@@ -141,10 +151,14 @@ class uploadTests(TestCase):
     
     def testUnicodeName(self):
         path = self.testCasesPath / 'eu/euymtn.replay'
-        obj = bindings.Config.unpickle(path)
-        searchOpts = {}
-        with contextlib.redirect_stdout(None):
-            bindings.printListItem(obj, searchOpts)
+        with TemporaryDirectory() as tempDir, mock.patch.dict(os.environ, {'CONTEXT_DOCUMENT_ROOT': tempDir, 'EDREFCARD_CACHE_DIR': ''}):
+            replayPath = bindings.Config('euymtn').pathWithSuffix('.replay')
+            replayPath.parent.mkdir(parents=True)
+            shutil.copyfile(str(path), str(replayPath))
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                bindings.printList(bindings.Mode.list, {})
+        self.assertIn('bient\ufffdt le X56</a>', output.getvalue())
 
 
 class FontPathTests(TestCase):
@@ -166,6 +180,184 @@ class FontPathTests(TestCase):
         self.assertEqual(path, '../fonts/Exo2.0-BoldItalic.otf')
     
 
+class FontMetricsCacheTests(TestCase):
+
+    def setUp(self):
+        self.cache = bindings.FontMetricsCache(maxEntries=2, useFontTables=False)
+        self.context = MagicMock()
+        self.context.font = '../fonts/Exo2.0-Regular.otf'
+        self.context.font_size = 40
+        self.context.get_font_metrics.side_effect = lambda img, text, multiline: bindings.FontMetrics(*([len(text)] * 13))
+
+    def testRepeatedTextIsAHit(self):
+        self.cache.metrics(self.context, None, 'Boost')
+        metrics = self.cache.metrics(self.context, None, 'Boost')
+        self.assertEqual(metrics.text_width, 5)
+        self.assertEqual(self.context.get_font_metrics.call_count, 1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def testFontSizeIsPartOfKey(self):
+        self.cache.metrics(self.context, None, 'Boost')
+        self.context.font_size = 39
+        self.cache.metrics(self.context, None, 'Boost')
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 2))
+
+    def testLeastRecentlyUsedIsEvicted(self):
+        self.cache.metrics(self.context, None, 'Boost')
+        self.cache.metrics(self.context, None, 'Fire')
+        self.cache.metrics(self.context, None, 'Boost')
+        self.cache.metrics(self.context, None, 'Jump')
+        self.assertEqual(len(self.cache.entries), 2)
+        self.assertNotIn((self.context.font, 40, 'Fire'), self.cache.entries)
+
+    def testSaveAndLoad(self):
+        self.cache.metrics(self.context, None, 'Boost')
+        with TemporaryDirectory() as tempDir:
+            path = Path(tempDir) / 'metrics.cache'
+            self.cache.save(path)
+            loadedCache = bindings.FontMetricsCache()
+            loadedCache.load(path)
+        self.assertEqual(loadedCache.entries, self.cache.entries)
+
+    def testLoadMissingFileIsEmpty(self):
+        self.cache.load(Path('/nonexistent/metrics.cache'))
+        self.assertEqual(len(self.cache.entries), 0)
+
+    def testUnusableFileIsIgnored(self):
+        with TemporaryDirectory() as tempDir:
+            path = Path(tempDir) / 'metrics.cache'
+            for data in [pickle.dumps([(('font', 40, 'Boost'), (5,) * 13)]), b'[["font", 40, "Boost", [5]]]', b'{']:
+                path.write_bytes(data)
+                with mock.patch.object(bindings, 'logError') as logError:
+                    self.cache.load(path)
+                self.assertEqual(len(self.cache.entries), 0)
+                logError.assert_called_once()
+            self.cache.metrics(self.context, None, 'Boost')
+            self.cache.save(path)
+            self.assertEqual(json.loads(path.read_text()), [['../fonts/Exo2.0-Regular.otf', 40, 'Boost', [5] * 13]])
+
+
+class FontTablesTests(TestCase):
+
+    # Expected values are as measured by FreeType with light hinting, which is what ImageMagick uses
+    def testRegularMetrics(self):
+        metrics = bindings.fontMetrics.textMetrics('../fonts/Exo2.0-Regular.otf', 40, 'Landing Gear')
+        self.assertEqual(metrics.text_width, 237)
+        self.assertEqual(metrics.text_height, 48)
+        self.assertEqual(metrics.character_width, 40)
+        self.assertEqual((metrics.ascender, metrics.descender), (40, -9))
+
+    def testBoldMetrics(self):
+        metrics = bindings.fontMetrics.textMetrics('../fonts/Exo2.0-Bold.otf', 40, 'Landing Gear')
+        self.assertEqual(metrics.text_width, 247)
+        self.assertEqual((metrics.ascender, metrics.descender), (41, -8))
+
+    def testUrlHeaderMetrics(self):
+        metrics = bindings.fontMetrics.textMetrics(bindings.getFontPath('SemiBold', 'Normal'), 72, 'https://edrefcard.info/binds/abcdef')
+        self.assertEqual(metrics.text_width, 1232)
+
+    # Everything the cards are laid out with, other than the bounds of the glyph outlines
+    def testMatchesImageMagick(self):
+        try:
+            import wand.version
+        except ImportError:
+            self.skipTest('wand is not installed')
+        fields = ['character_width', 'character_height', 'ascender', 'descender', 'text_width', 'text_height', 'maximum_horizontal_advance']
+        texts = ['Landing Gear', 'Flight Assist', 'Hardpoints', 'Yaw Left', 'Throttle Increase', 'Joy_1', 'https://edrefcard.info/binds/abcdef']
+        with bindings.Image(width=1, height=1) as img, bindings.Drawing() as context:
+            for (weight, style) in [('Regular', 'Normal'), ('Bold', 'Normal'), ('SemiBold', 'Normal'), ('Regular', 'Italic')]:
+                font = bindings.getFontPath(weight, style)
+                context.font = font
+                for fontSize in [9, 14, 22.5, 40, 72]:
+                    context.font_size = fontSize
+                    for text in texts:
+                        with self.subTest(font=font, fontSize=fontSize, text=text):
+                            expected = context.get_font_metrics(img, text, multiline=False)
+                            metrics = bindings.fontMetrics.textMetrics(font, fontSize, text)
+                            self.assertEqual([getattr(metrics, field) for field in fields], [getattr(expected, field) for field in fields])
+
+    def testMissingFont(self):
+        metrics = bindings.fontMetrics.textMetrics('../fonts/NoSuchFont.otf', 40, 'Landing Gear')
+        self.assertIsNone(metrics)
+
+    def testCacheDoesNotNeedImageMagick(self):
+        cache = bindings.FontMetricsCache(useFontTables=True)
+        context = MagicMock()
+        cache.measure(bindings.getFontPath('Regular', 'Normal'), 40, 'Landing Gear', context, None)
+        context.get_font_metrics.assert_not_called()
+
+    def testCacheFallsBackToImageMagick(self):
+        cache = bindings.FontMetricsCache(useFontTables=True)
+        context = MagicMock()
+        cache.measure('../fonts/NoSuchFont.otf', 40, 'Landing Gear', context, None)
+        context.get_font_metrics.assert_called_once()
+
+
+class FitSolverTests(TestCase):
+
+    def setUp(self):
+        self.savedCache = bindings.fontMetricsCache
+        bindings.fontMetricsCache = bindings.FontMetricsCache(useFontTables=False)
+        self.context = MagicMock()
+        self.context.font = '../fonts/Exo2.0-Regular.otf'
+        def fakeMetrics(img, text, multiline):
+            size = self.context.font_size
+            # Not quite linear, so that the estimate is sometimes off by one
+            return bindings.FontMetrics(size, size, int(size * 0.8), -int(size * 0.2), int(size * 0.53 * len(text)) + len(text) % 3, int(size * 1.21), size, 0, 0, 0, 0, 0, 0)
+        self.context.get_font_metrics.side_effect = fakeMetrics
+        self.style = bindings.groupStyles['General']
+
+    def tearDown(self):
+        bindings.fontMetricsCache = self.savedCache
+
+    def texts(self, names):
+        return [{'Text': name, 'Group': 'General', 'Style': self.style} for name in names]
+
+    def linearFitFontSize(self, texts, width, height, biggestFontSize):
+        # The original approach: step down one point at a time until everything fits
+        fontSize = biggestFontSize
+        while fontSize > 1:
+            measurements = bindings.measureTexts(self.context, None, texts, fontSize)
+            if bindings.flowTexts(measurements, width, height, fontSize)[0]:
+                break
+            fontSize = fontSize - 1
+        return fontSize
+
+    def testFitsAtBiggestSizeWithOneProbe(self):
+        texts = self.texts(['Boost'])
+        (fontSize, positions, lastLineY) = bindings.calculateBestFitLayout(self.context, None, 500, 54, texts, 40)
+        self.assertEqual(fontSize, 40)
+        self.assertEqual(positions, [(0, 32)])
+        self.assertEqual(self.context.get_font_metrics.call_count, 1)
+
+    def testMatchesLinearDescent(self):
+        names = ['Landing Gear', 'Cargo Scoop', 'Silent Running', 'Heat Sink[1]', 'Chaff', 'Modifier 2', 'Ship Lights']
+        for width in range(120, 900, 37):
+            for height in (54, 80, 120):
+                for count in range(1, len(names) + 1):
+                    texts = self.texts(names[:count])
+                    expectedFontSize = self.linearFitFontSize(texts, width, height, 40)
+                    (fontSize, positions, lastLineY) = bindings.calculateBestFitLayout(self.context, None, width, height, texts, 40)
+                    self.assertEqual(fontSize, expectedFontSize, (width, height, count))
+
+    def testFewProbes(self):
+        texts = self.texts(['Landing Gear', 'Cargo Scoop', 'Silent Running', 'Heat Sink[1]'])
+        bindings.calculateBestFitLayout(self.context, None, 300, 80, texts, 40)
+        measuredSizes = {size for (font, size, text) in bindings.fontMetricsCache.entries}
+        self.assertLessEqual(len(measuredSizes), 4)
+
+    def testLayoutTextPositionsWithinBox(self):
+        texts = self.texts(['Landing Gear', 'Cargo Scoop', 'Silent Running'])
+        box = {'x': 100, 'y': 200, 'width': 400, 'height': 80}
+        texts = bindings.layoutText(None, self.context, texts, box, 40)
+        for text in texts:
+            self.assertGreaterEqual(text['X'], 100)
+            self.assertLess(text['X'], 500)
+            self.assertGreater(text['Y'], 200)
+            self.assertLess(text['Y'], 280)
+            self.assertEqual(text['Size'], texts[0]['Size'])
+
+
 class FormTests(TestCase):
 
     def testLeadingPunctuationNotAllowed(self):
@@ -175,6 +367,22 @@ class FormTests(TestCase):
         formProxy = FormProxy()
         mode = bindings.determineMode(formProxy)
         self.assertEqual(bindings.Mode.invalid, mode)
+
+    def testCardFormat(self):
+        class FormProxy:
+            def __init__(self, values):
+                self.values = values
+            def getvalue(self, key):
+                return self.values.get(key)
+        self.assertEqual(bindings.parseCardFormat(FormProxy({})), 'jpg')
+        self.assertEqual(bindings.parseCardFormat(FormProxy({'format': 'svg'})), 'svg')
+        self.assertEqual(bindings.parseCardFormat(FormProxy({'format': 'gif'})), 'jpg')
+
+    def testRenderMode(self):
+        class FormProxy:
+            def getvalue(self, key):
+                return 'abcdef-x52.jpg' if key == 'render' else None
+        self.assertEqual(bindings.determineMode(FormProxy()), bindings.Mode.render)
     
 
 class BlocksTests(TestCase):
@@ -191,6 +399,606 @@ class BlocksTests(TestCase):
             self.createBlockImage(device)
     
 
+class TemplateCacheTests(TestCase):
+
+    def setUp(self):
+        self.tempDir = TemporaryDirectory()
+        self.environ = mock.patch.dict(os.environ, {'EDREFCARD_CACHE_DIR': self.tempDir.name})
+        self.environ.start()
+        self.templatesPath = Path(self.tempDir.name) / 'templates'
+
+    def tearDown(self):
+        self.environ.stop()
+        self.tempDir.cleanup()
+
+    def testDisabledWithoutCacheDir(self):
+        with mock.patch.dict(os.environ, {'EDREFCARD_CACHE_DIR': ''}):
+            self.assertIsNone(bindings.cachedTemplatePath(Path('../res/ds4.jpg')))
+
+    def testPathTracksSourceFile(self):
+        sourcePath = Path('../res/ds4.jpg')
+        stat = sourcePath.stat()
+        cachedPath = bindings.cachedTemplatePath(sourcePath)
+        self.assertEqual(cachedPath.name, 'ds4-%d-%d.mpc' % (stat.st_size, stat.st_mtime_ns))
+
+    def testBuildsCacheAndRemovesStaleVersions(self):
+        self.templatesPath.mkdir()
+        (self.templatesPath / 'ds4-1-2.mpc').write_bytes(b'')
+        (self.templatesPath / 'ds4-1-2.cache').write_bytes(b'')
+        (self.templatesPath / 'ds4foo-1-2.mpc').write_bytes(b'')
+        with bindings.openTemplate('ds4'):
+            pass
+        cachedPath = bindings.cachedTemplatePath(Path('../res/ds4.jpg'))
+        self.assertTrue(cachedPath.exists())
+        self.assertTrue(cachedPath.with_suffix('.cache').exists())
+        names = sorted(path.name for path in self.templatesPath.iterdir())
+        self.assertEqual(names, sorted([cachedPath.name, cachedPath.with_suffix('.cache').name, 'ds4foo-1-2.mpc']))
+
+
+# A 48x24 JPEG with 4:2:0 sampling and optimised Huffman tables
+sampleJpeg = base64.b64decode(
+    '/9j/4AAQSkZJRgABAQAAAQABAAD/2wBDAAYEBQYFBAYGBQYHBwYIChAKCgkJChQODwwQFxQYGBcUFhYaHSUfGhsjHBYWICwgIyYn'
+    'KSopGR8tMC0oMCUoKSj/2wBDAQcHBwoIChMKChMoGhYaKCgoKCgoKCgoKCgoKCgoKCgoKCgoKCgoKCgoKCgoKCgoKCgoKCgoKCgo'
+    'KCgoKCgoKCj/wAARCAAYADADASIAAhEBAxEB/8QAGQAAAwEBAQAAAAAAAAAAAAAAAAUGAgQI/8QAHBAAAQUBAQEAAAAAAAAAAAAA'
+    'AQACBAUxIgPB/8QAFwEBAQEBAAAAAAAAAAAAAAAABgUHCP/EACQRAAEEAQMDBQAAAAAAAAAAAAEAAgMEBRExYSGR8DJBUbHB/9oA'
+    'DAMBAAIRAxEAPwDz9Fp85TmLT5yq6LT5ynMWnzlWKI2UermeVIRafOU38KpvmwueAGjSq7wqm+bC54AaNKw+C6S8ckeYxv0qlkc9'
+    'Dh4QT1kPpb+nj72HCihlDId+ikHwXSXjkjzGN+lMItPnKrotPnKcxafOUFZamuTGed2rj52TWnlw0AArii0+cpv4VTfNhc8ANGlC'
+    'EjbKYK75W7tBPYarlqnZkJA1WHwXSXjkjzGN+ld8WnzlCFlzLctyYzzu1cfOycU7D2gAFOItPnKcxafOUISij7JLVtSfK//Z'
+)
+
+
+class JpegPatchTests(TestCase):
+
+    def setUp(self):
+        self.jpegPatch = bindings.jpegPatch
+
+    def testTranscodeIsLossless(self):
+        # Coefficients survive a round trip, so going via another restart interval gives the same stream
+        direct = self.jpegPatch.transcode(sampleJpeg, 3)
+        self.assertEqual(self.jpegPatch.transcode(self.jpegPatch.transcode(sampleJpeg, 1), 3), direct)
+        stream = self.jpegPatch.JpegStream(direct)
+        self.assertEqual(stream.restartInterval, 3)
+        self.assertEqual(stream.componentHuffmanTables(), self.jpegPatch.standardTables(stream.frame))
+
+    def testTileGeometry(self):
+        patchable = self.jpegPatch.PatchableJpeg(self.jpegPatch.transcode(sampleJpeg, 3))
+        self.assertEqual(patchable.samplingFactors(), '2x2,1x1,1x1')
+        self.assertEqual(len(patchable.tiles), 2)
+        self.assertEqual(patchable.tileRect(1), (0, 16, 48, 8))
+        self.assertEqual(patchable.tilesTouching([(40, 2, 4, 4)]), [0])
+        self.assertEqual(patchable.tilesTouching([(-10, 15, 20, 2)]), [0, 1])
+        self.assertEqual(patchable.tilesTouching([(60, 30, 10, 10)]), [])
+
+    def testTileMCUsDividesRow(self):
+        frame = self.jpegPatch.JpegStream(sampleJpeg).frame
+        self.assertEqual(self.jpegPatch.tileMCUs(frame, 16), 3)
+        self.assertEqual(self.jpegPatch.tileMCUs(frame, 2), 1)
+
+    def testPatching(self):
+        data = self.jpegPatch.transcode(sampleJpeg, 3)
+        patchable = self.jpegPatch.PatchableJpeg(data)
+        self.assertEqual(patchable.patched({}), data)
+        patched = self.jpegPatch.PatchableJpeg(patchable.patched({1: patchable.tiles[0]}))
+        self.assertEqual(patched.tiles, [patchable.tiles[0], patchable.tiles[0]])
+
+    def testRejectsIncompatibleTiles(self):
+        patchable = self.jpegPatch.PatchableJpeg(self.jpegPatch.transcode(sampleJpeg, 3))
+        with self.assertRaises(self.jpegPatch.UnsupportedJpeg):
+            # Optimised Huffman tables
+            patchable.tileData(sampleJpeg)
+        with self.assertRaises(self.jpegPatch.UnsupportedJpeg):
+            # Restart intervals
+            patchable.tileData(self.jpegPatch.transcode(sampleJpeg, 3))
+
+    def testRejectsProgressive(self):
+        progressive = sampleJpeg.replace(b'\xff\xc0', b'\xff\xc2', 1)
+        with self.assertRaises(self.jpegPatch.UnsupportedJpeg):
+            self.jpegPatch.transcode(progressive, 3)
+
+    def testQuantTableXml(self):
+        patchable = self.jpegPatch.PatchableJpeg(self.jpegPatch.transcode(sampleJpeg, 3))
+        xml = patchable.quantTableXml()
+        self.assertIn('<table slot="0">', xml)
+        self.assertIn('<table slot="1">', xml)
+        self.assertNotIn('<table slot="2">', xml)
+
+    def testSavesInFullWithoutPatchableTemplate(self):
+        img = MagicMock()
+        with mock.patch.dict(os.environ, {'EDREFCARD_CACHE_DIR': ''}):
+            bindings.saveCardImage(img, 'ds4', [(0, 0, 10, 10)], Path('card.jpg'))
+        img.save.assert_called_once_with(filename='card.jpg')
+
+
+def renderSquare(value):
+    return [os.getpid(), value * value]
+
+def renderMeasured(value):
+    return bindings.fontMetricsCache.measure('../fonts/Exo2.0-Regular.otf', 40, 'Text %d' % value, None, None).text_width
+
+
+class SVGTests(TestCase):
+
+    def testFontWeightAndStyle(self):
+        self.assertEqual(bindings.fontWeightAndStyle(bindings.getFontPath('Regular', 'Normal')), (400, 'normal'))
+        self.assertEqual(bindings.fontWeightAndStyle(bindings.getFontPath('SemiBold', 'Normal')), (600, 'normal'))
+        self.assertEqual(bindings.fontWeightAndStyle(bindings.getFontPath('Regular', 'Italic')), (400, 'italic'))
+        self.assertEqual(bindings.fontWeightAndStyle(bindings.getFontPath('ExtraBold', 'Italic')), (800, 'italic'))
+
+    def testPushAndPop(self):
+        drawing = bindings.SVGDrawing()
+        drawing.font_size = 40
+        drawing.push()
+        drawing.font_size = 72
+        drawing.fill_color = bindings.Color('Red')
+        drawing.pop()
+        self.assertEqual(drawing.font_size, 40)
+        self.assertEqual(bindings.svgColor(drawing.fill_color), '#000000')
+
+    def testSave(self):
+        with bindings.SVGDrawing() as drawing:
+            drawing.font = bindings.getFontPath('Bold', 'Normal')
+            drawing.font_size = 40
+            drawing.fill_color = bindings.Color('Red')
+            drawing.text(x=10, y=50, body='Fire & Forget')
+            drawing.fill_opacity = 0
+            drawing.stroke_color = bindings.Color('Black')
+            drawing.stroke_width = 2
+            drawing.rectangle(left=5, top=5, width=100, height=60, radius=30)
+            with TemporaryDirectory() as tempDir:
+                filePath = Path(tempDir) / 'card.svg'
+                drawing.save(filePath, 'ds4')
+                svg = bindings.etree.parse(str(filePath)).getroot()
+        namespace = '{http://www.w3.org/2000/svg}'
+        self.assertEqual(svg.get('viewBox'), '0 0 3840 2160')
+        self.assertEqual(svg.find(namespace + 'image').get('{http://www.w3.org/1999/xlink}href'), '../../res/ds4.jpg')
+        self.assertIn('url("../../fonts/Exo2.0-Bold.otf")', svg.find(namespace + 'style').text)
+        text = svg.find(namespace + 'text')
+        self.assertEqual(text.text, 'Fire & Forget')
+        self.assertEqual((text.get('x'), text.get('y'), text.get('font-size'), text.get('font-weight'), text.get('fill')), ('10', '50', '40', '700', '#ff0000'))
+        rect = svg.find(namespace + 'rect')
+        self.assertEqual((rect.get('fill'), rect.get('stroke'), rect.get('rx')), ('none', '#000000', '30'))
+
+
+class RenderOnDemandTests(TestCase):
+
+    def setUp(self):
+        self.tempDir = TemporaryDirectory()
+        self.environ = mock.patch.dict(os.environ, {'CONTEXT_DOCUMENT_ROOT': self.tempDir.name})
+        self.environ.start()
+        self.config = bindings.Config('abcdef')
+        self.config.makeDir()
+
+    def tearDown(self):
+        self.environ.stop()
+        self.tempDir.cleanup()
+
+    def testRenderOnDemandSetting(self):
+        for (value, expected) in [('', False), ('0', False), ('1', True)]:
+            with mock.patch.dict(os.environ, {'EDREFCARD_RENDER_ON_DEMAND': value}):
+                self.assertEqual(bindings.renderOnDemand(), expected)
+
+    def testRenderSettings(self):
+        bindings.saveRenderSettings(self.config, ['Ship', 'UI'], 'Group', False)
+        self.assertEqual(bindings.loadRenderSettings(self.config), {'displayGroups': ['Ship', 'UI'], 'styling': 'Group', 'public': False})
+        self.assertEqual(json.loads(self.config.pathWithSuffix('.render').read_text())['styling'], 'Group')
+
+    def testPickledRenderSettings(self):
+        renderSettings = {'displayGroups': ['Ship'], 'styling': 'None', 'public': True}
+        self.config.pathWithSuffix('.render').write_bytes(pickle.dumps(renderSettings))
+        self.assertEqual(bindings.loadRenderSettings(self.config), renderSettings)
+        self.config.pathWithSuffix('.render').write_bytes(pickle.dumps(dict(renderSettings, command=os.system)))
+        with self.assertRaises(pickle.UnpicklingError):
+            bindings.loadRenderSettings(self.config)
+
+    def testRenderSettingsFromReplay(self):
+        bindings.saveReplayInfo(self.config, 'Test', 'Category', ['Ship'], {}, bindings.Errors())
+        self.assertEqual(bindings.loadRenderSettings(self.config), {'displayGroups': ['Ship'], 'styling': 'Category', 'public': True})
+
+    def testNoSuchCard(self):
+        for fileName in ['../../etc/passwd', 'abcdef-x52.gif', 'abcdef-x52.jpg']:
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                bindings.serveCard(fileName)
+            self.assertTrue(output.getvalue().startswith('Status: 404 Not Found'))
+
+    def testFindMisconfiguredControls(self):
+        physicalKey = bindings.PhysicalKey('T16000M', 0, 'Joy_XAxis', 'Joy_XAxis')
+        physicalKey.binds['Unmodified'] = {
+            'RollLeftButton': {'Name': 'Roll Left', 'Type': 'Digital', 'HasAnalogue': True, 'HideIfSameAs': []},
+            'RollAxisRaw': {'Name': 'Roll', 'Type': 'Analogue', 'HideIfSameAs': []},
+        }
+        physicalKeys = {('T16000M', '0', 'Joy_XAxis'): physicalKey}
+        self.assertEqual(bindings.findMisconfiguredControls(physicalKeys, ['T16000M'], 0), ['Roll Left'])
+        self.assertEqual(bindings.findMisconfiguredControls(physicalKeys, ['T16000M'], 1), [])
+
+
+class ReplayTests(TestCase):
+
+    def setUp(self):
+        self.tempDir = TemporaryDirectory()
+        self.environ = mock.patch.dict(os.environ, {'CONTEXT_DOCUMENT_ROOT': self.tempDir.name, 'EDREFCARD_RENDER_ON_DEMAND': '',
+            'EDREFCARD_CARD_WIDTHS': '1920', 'EDREFCARD_CARD_FORMATS': 'webp'})
+        self.environ.start()
+        self.config = bindings.Config('abcdef')
+        self.config.makeDir()
+
+    def tearDown(self):
+        self.environ.stop()
+        self.tempDir.cleanup()
+
+    def testCreatedImageCard(self):
+        self.assertEqual(bindings.createdImageCard('Keyboard'), ('keyboard', 'keyboard'))
+        self.assertEqual(bindings.createdImageCard('TFlightHOTASX::1'), ('hotasx', 'hotasx-1'))
+
+    def testCardFiles(self):
+        self.assertEqual([path.name for path in bindings.cardFiles(self.config, 'Keyboard', 'jpg')], ['abcdef-keyboard.jpg', 'abcdef-keyboard-1920.jpg', 'abcdef-keyboard-1920.webp'])
+        self.assertEqual([path.name for path in bindings.cardFiles(self.config, 'Keyboard', 'svg')], ['abcdef-keyboard.svg'])
+
+    def testReplayCardsExist(self):
+        createdImages = ['TFlightHOTASX::1', 'Keyboard']
+        self.assertFalse(bindings.replayCardsExist(self.config, createdImages, 'jpg'))
+        for createdImage in createdImages:
+            for path in bindings.cardFiles(self.config, createdImage, 'jpg'):
+                path.write_bytes(b'card')
+        self.assertTrue(bindings.replayCardsExist(self.config, createdImages, 'jpg'))
+        self.assertFalse(bindings.replayCardsExist(self.config, createdImages, 'svg'))
+        self.assertFalse(bindings.replayCardsExist(self.config, createdImages + ['Unknown'], 'jpg'))
+        self.assertFalse(bindings.replayCardsExist(self.config, [], 'jpg'))
+        self.assertFalse(bindings.replayCardsExist(self.config, None, 'jpg'))
+        with mock.patch.dict(os.environ, {'EDREFCARD_RENDER_ON_DEMAND': '1'}):
+            self.assertTrue(bindings.replayCardsExist(self.config, createdImages, 'svg'))
+
+    def testReplayInfoListsCards(self):
+        bindings.saveReplayInfo(self.config, 'Test', 'None', ['Ship'], {}, bindings.Errors(), ['Keyboard'])
+        self.assertEqual(bindings.Config.loadReplay(self.config.pathWithSuffix('.replay'))['createdImages'], ['Keyboard'])
+
+    def testReplayRecord(self):
+        devices = {'T16000M::0': bindings.supportedDevices['T16000M'], 'Keyboard::0': bindings.supportedDevices['Keyboard']}
+        bindings.saveReplayInfo(self.config, 'Tést', 'Group', ['Ship'], devices, bindings.Errors(deviceWarnings='eggs'))
+        replayPath = self.config.pathWithSuffix('.replay')
+        # Only the keys of the devices are kept
+        record = json.loads(replayPath.read_text(encoding='utf-8'))
+        self.assertEqual(record['format'], bindings.replayRecordFormat)
+        self.assertEqual(record['devices'], ['T16000M::0', 'Keyboard::0'])
+        replayInfo = bindings.Config.loadReplay(replayPath)
+        self.assertEqual(replayInfo['runID'], 'abcdef')
+        self.assertEqual(replayInfo['description'], 'Tést')
+        self.assertEqual(replayInfo['styling'], 'Group')
+        self.assertEqual(replayInfo['deviceWarnings'], 'eggs')
+        self.assertIsNone(replayInfo['createdImages'])
+        self.assertEqual(replayInfo['timestamp'].tzinfo, datetime.timezone.utc)
+        self.assertEqual(bindings.controllerNames(replayInfo), {'T16000M'})
+        self.assertEqual(bindings.loadRenderSettings(self.config), {'displayGroups': ['Ship'], 'styling': 'Group', 'public': True})
+        replayPath.write_text(json.dumps(dict(record, format=bindings.replayRecordFormat + 1)))
+        with self.assertRaises(ValueError):
+            bindings.Config.loadReplay(replayPath)
+
+    def testPickledReplay(self):
+        uploadPath = Path('../../bindings/testUploads/eu/euymtn.replay').resolve(True)
+        pickled = bindings.Config.unpickle(uploadPath)
+        replayInfo = bindings.Config.loadReplay(uploadPath)
+        self.assertEqual(replayInfo['devices'], list(pickled['devices']))
+        for field in ['description', 'timestamp', 'styling', 'displayGroups', 'misconfigurationWarnings']:
+            self.assertEqual(replayInfo[field], pickled[field])
+        # Migrated, it reads the same
+        replayPath = self.config.pathWithSuffix('.replay')
+        bindings.writeReplayRecord(replayPath, bindings.replayRecord(pickled))
+        self.assertEqual(bindings.Config.loadReplay(replayPath), dict(replayInfo, runID='abcdef'))
+        self.assertLess(replayPath.stat().st_size, uploadPath.stat().st_size)
+
+    def testPickledReplayOnlyHoldsData(self):
+        replayPath = self.config.pathWithSuffix('.replay')
+        replayPath.write_bytes(pickle.dumps({'description': 'Test', 'devices': {}, 'command': os.system}))
+        with self.assertRaises(pickle.UnpicklingError):
+            bindings.Config.loadReplay(replayPath)
+        replayPath.write_bytes(pickle.dumps({'description': 'Test', 'devices': OrderedDict(), 'warnings': 'spam'}))
+        self.assertEqual(bindings.Config.loadReplay(replayPath)['misconfigurationWarnings'], 'spam')
+
+
+class ParsedBindingsTests(TestCase):
+
+    def setUp(self):
+        self.tempDir = TemporaryDirectory()
+        self.environ = mock.patch.dict(os.environ, {'CONTEXT_DOCUMENT_ROOT': self.tempDir.name})
+        self.environ.start()
+        self.config = bindings.Config('abcdef')
+        self.config.makeDir()
+        self.config.pathWithSuffix('.binds').write_bytes(Path('../../bindings/testCases/two_modifiers.binds').read_bytes())
+        self.displayGroups = list(bindings.groupStyles.keys())
+
+    def tearDown(self):
+        self.environ.stop()
+        self.tempDir.cleanup()
+
+    def testSavedParseIsUsed(self):
+        (parsedBindings, lint) = bindings.parseConfigBindings(self.config, self.displayGroups, bindings.Errors())
+        with mock.patch.object(bindings, 'parseBindings') as parseBindings, mock.patch.object(bindings, 'lintBindings') as lintBindings:
+            (loadedBindings, loadedLint) = bindings.parseConfigBindings(self.config, self.displayGroups, bindings.Errors())
+        parseBindings.assert_not_called()
+        lintBindings.assert_not_called()
+        self.assertEqual(bindings.legacyBindings(*loadedBindings), bindings.legacyBindings(*parsedBindings))
+        self.assertEqual(loadedLint, lint)
+        boundControls = loadedBindings[0][('LogitechExtreme3DPro', '0', 'Joy_4')].binds['LogitechExtreme3DPro::0::Joy_7/LogitechExtreme3DPro::0::Joy_8']
+        self.assertIs(boundControls['GalaxyMapOpen'], bindings.controls['GalaxyMapOpen'])
+
+    def testSavedParseIsReplaced(self):
+        bindings.parseConfigBindings(self.config, ['Ship'], bindings.Errors())
+        self.assertIsNone(bindings.loadParsedBindings(self.config, self.displayGroups))
+        with mock.patch.object(bindings, 'parsedBindingsFormat', 0):
+            self.assertIsNone(bindings.loadParsedBindings(self.config, ['Ship']))
+        self.config.pathWithSuffix('.parsed').write_bytes(b'not marshalled')
+        self.assertIsNone(bindings.loadParsedBindings(self.config, ['Ship']))
+        bindings.parseConfigBindings(self.config, ['Ship'], bindings.Errors())
+        self.assertIsNotNone(bindings.loadParsedBindings(self.config, ['Ship']))
+
+    def testFailedParseIsNotSaved(self):
+        self.config.pathWithSuffix('.binds').write_bytes(b'<Root>')
+        errors = bindings.Errors()
+        bindings.parseConfigBindings(self.config, self.displayGroups, errors)
+        self.assertTrue(errors.errors)
+        self.assertFalse(self.config.pathWithSuffix('.parsed').exists())
+
+
+class RenderCacheTests(TestCase):
+
+    def setUp(self):
+        self.tempDir = TemporaryDirectory()
+        self.environ = mock.patch.dict(os.environ, {'CONTEXT_DOCUMENT_ROOT': self.tempDir.name, 'EDREFCARD_CACHE_DIR': self.tempDir.name + '/cache'})
+        self.environ.start()
+        self.physicalKeys = {('T16000M', '0', 'Joy_1'): self.physicalKey(0)}
+
+    def tearDown(self):
+        self.environ.stop()
+        self.tempDir.cleanup()
+
+    def physicalKey(self, deviceIndex):
+        physicalKey = bindings.PhysicalKey('T16000M', deviceIndex, 'Joy_1', 'Joy_1')
+        physicalKey.binds['Unmodified'] = {'PrimaryFire': {'Name': 'Primary Fire', 'Group': 'Ship', 'Category': 'Combat', 'Type': 'Digital', 'HideIfSameAs': []}}
+        return physicalKey
+
+    def cardKey(self, physicalKeys, deviceIndex=0):
+        return bindings.hotasCardKey(physicalKeys, {}, 't16000m', ['T16000M'], 40, 'None', deviceIndex, '.svg')
+
+    def testNoKeyWithoutCache(self):
+        with mock.patch.dict(os.environ, {'EDREFCARD_CACHE_DIR': ''}):
+            self.assertIsNone(self.cardKey(self.physicalKeys))
+
+    def testKeyCoversOnlyTheDevice(self):
+        key = self.cardKey(self.physicalKeys)
+        self.assertEqual(key, self.cardKey(dict(self.physicalKeys)))
+        otherDevice = dict(self.physicalKeys)
+        otherDevice[('T16000M', '1', 'Joy_1')] = self.physicalKey(1)
+        self.assertEqual(key, self.cardKey(otherDevice))
+        self.assertNotEqual(key, self.cardKey(otherDevice, 1))
+        self.assertNotEqual(key, bindings.hotasCardKey(self.physicalKeys, {}, 't16000m', ['T16000M'], 40, 'Group', 0, '.svg'))
+
+    def testKeyIgnoresOtherDevicesModifiers(self):
+        def parsedCardKey(keyboardModifier, stickModifier):
+            xml = b'''<Root>
+                <PrimaryFire><Primary Device="T16000M" Key="Joy_1"><Modifier Device="T16000M" Key="%s" /></Primary></PrimaryFire>
+                <SecondaryFire><Primary Device="Keyboard" Key="Key_A"><Modifier Device="Keyboard" Key="%s" /></Primary></SecondaryFire>
+            </Root>''' % (stickModifier, keyboardModifier)
+            (physicalKeys, modifiers, devices) = bindings.parseBindings('abcdef', xml, bindings.groupStyles.keys(), bindings.Errors())
+            return bindings.hotasCardKey(physicalKeys, modifiers, 't16000m', ['T16000M'], 40, 'None', 0, '.svg')
+        key = parsedCardKey(b'Key_LeftShift', b'Joy_2')
+        self.assertEqual(key, parsedCardKey(b'Key_RightShift', b'Joy_2'))
+        self.assertNotEqual(key, parsedCardKey(b'Key_LeftShift', b'Joy_3'))
+
+    def testCachedCardIsLinked(self):
+        key = self.cardKey(self.physicalKeys)
+        self.assertIsNone(bindings.cachedRender(key))
+        cardPath = Path(self.tempDir.name) / 'card.jpg'
+        cardPath.write_bytes(b'card')
+        # As saveHOTASImage saves them, for stampCard to read back
+        boxes = [(0, 0, 10, 10), (20, 30, 5, 5)]
+        bindings.saveCachedRender(key, {'boxes': boxes}, cardPath)
+        self.assertEqual([tuple(box) for box in bindings.cachedRender(key)['boxes']], boxes)
+        linkedPath = Path(self.tempDir.name) / 'linked.jpg'
+        self.assertTrue(bindings.linkCachedCard(key, '.jpg', linkedPath))
+        self.assertTrue(linkedPath.samefile(bindings.renderCachePath(key, '.jpg')))
+        self.assertEqual(json.loads(bindings.renderCachePath(key, '.info').read_text()), {'boxes': [[0, 0, 10, 10], [20, 30, 5, 5]]})
+
+    def testUnstampableBodyIsRemembered(self):
+        def saveCardImage(img, templateName, boxes, filePath):
+            filePath.write_bytes(b'card')
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(mock.patch.object(bindings, 'patchableTemplate', return_value=object()))
+            stack.enter_context(mock.patch.object(bindings, 'openTemplate', return_value=MagicMock()))
+            stack.enter_context(mock.patch.object(bindings, 'Drawing', return_value=MagicMock()))
+            stack.enter_context(mock.patch.object(bindings, 'drawHOTASImage', return_value=[(0, 0, 10, 10)]))
+            stack.enter_context(mock.patch.object(bindings, 'writeUrlToDrawing', return_value=(0, 0, 10, 10)))
+            saveCard = stack.enter_context(mock.patch.object(bindings, 'saveCardImage', side_effect=saveCardImage))
+            stampCard = stack.enter_context(mock.patch.object(bindings, 'stampCard', return_value=False))
+            for name in ['abcdef', 'ghijkl']:
+                config = bindings.Config(name)
+                config.makeDir()
+                filePath = config.pathWithNameAndSuffix('t16000m', '.jpg')
+                bindings.saveHOTASImage(filePath, self.physicalKeys, {}, 't16000m', ['T16000M'], 40, config, True, 'None', 0)
+                self.assertEqual(filePath.read_bytes(), b'card')
+            # The body is only saved and stamped for the first card, which then falls back to the whole card
+            self.assertEqual(saveCard.call_count, 3)
+            self.assertEqual(stampCard.call_count, 1)
+        key = bindings.hotasCardKey(self.physicalKeys, {}, 't16000m', ['T16000M'], 40, 'None', 0, '.jpg')
+        self.assertEqual(bindings.cachedRender(key), {'boxes': [[0, 0, 10, 10]], 'stampable': False})
+
+    def testSVGCardsShareTheirBody(self):
+        svgs = []
+        for name in ['abcdef', 'ghijkl']:
+            config = bindings.Config(name)
+            config.makeDir()
+            with mock.patch.object(bindings, 'drawHOTASImage', wraps=bindings.drawHOTASImage) as drawHOTASImage:
+                bindings.createHOTASSVG(self.physicalKeys, {}, 't16000m', ['T16000M'], 40, config, True, 'None', 0)
+            svgs.append(config.pathWithNameAndSuffix('t16000m', '.svg').read_text())
+            self.assertEqual(drawHOTASImage.call_count, 1 if name == 'abcdef' else 0)
+        self.assertIn('/binds/abcdef</text>', svgs[0])
+        self.assertIn('Primary Fire', svgs[1])
+        self.assertEqual(svgs[0].replace('abcdef', 'ghijkl'), svgs[1])
+
+
+class CardVariantTests(TestCase):
+
+    def testSettings(self):
+        with mock.patch.dict(os.environ, {'EDREFCARD_CARD_WIDTHS': '960, 1920', 'EDREFCARD_CARD_FORMATS': 'webp,gif,avif'}):
+            self.assertEqual(bindings.cardWidths(), [1920, 960])
+            self.assertEqual(bindings.cardFormats(), ['jpg', 'avif', 'webp'])
+        with mock.patch.dict(os.environ, {'EDREFCARD_CARD_WIDTHS': 'big', 'EDREFCARD_CARD_FORMATS': ''}):
+            self.assertEqual(bindings.cardWidths(), [])
+            self.assertEqual(bindings.cardFormats(), ['jpg'])
+
+    def testVariantPath(self):
+        self.assertEqual(bindings.cardVariantPath(Path('abcdef-x52-1.jpg'), 960, 'webp'), Path('abcdef-x52-1-960.webp'))
+
+    def testPrintCard(self):
+        output = io.StringIO()
+        with mock.patch.dict(os.environ, {'EDREFCARD_CARD_WIDTHS': '960,4000', 'EDREFCARD_CARD_FORMATS': 'webp'}):
+            with contextlib.redirect_stdout(output):
+                bindings.printCard('card', 'jpg', (3840, 2160), True)
+        self.assertEqual(output.getvalue().splitlines(), [
+            '<picture>',
+            '<source type="image/webp" srcset="card-960.webp 960w" sizes="100vw"/>',
+            '<img width="3840" height="2160" style="width: 100%; height: auto" loading="lazy" decoding="async" src="card.jpg" srcset="card-960.jpg 960w, card.jpg 3840w" sizes="100vw"/>',
+            '</picture><br/>',
+        ])
+
+    def testTemplateSize(self):
+        self.assertEqual(bindings.templateSize('ds4'), (3840, 2160))
+
+
+class RenderTests(TestCase):
+
+    def testSerialRenderingKeepsOrder(self):
+        with mock.patch.dict(os.environ, {'EDREFCARD_RENDER_WORKERS': '1'}):
+            results = bindings.renderImages([(renderSquare, (i,)) for i in range(4)])
+        self.assertEqual([result[1] for result in results], [0, 1, 4, 9])
+        self.assertEqual({result[0] for result in results}, {os.getpid()})
+
+    def testParallelRenderingKeepsOrder(self):
+        with mock.patch.dict(os.environ, {'EDREFCARD_RENDER_WORKERS': '2'}):
+            results = bindings.renderImages([(renderSquare, (i,)) for i in range(4)])
+        self.assertEqual([result[1] for result in results], [0, 1, 4, 9])
+        self.assertNotIn(os.getpid(), {result[0] for result in results})
+
+    def testWorkersMeasurementsAreKept(self):
+        cache = bindings.FontMetricsCache(useFontTables=True)
+        cache.measure('../fonts/Exo2.0-Regular.otf', 40, 'Text 0', None, None)
+        with mock.patch.dict(os.environ, {'EDREFCARD_RENDER_WORKERS': '2'}), mock.patch.object(bindings, 'fontMetricsCache', cache):
+            results = bindings.renderImages([(renderMeasured, (i,)) for i in range(4)])
+        self.assertEqual(cache.measured, [('../fonts/Exo2.0-Regular.otf', 40, 'Text %d' % i) for i in [0, 1, 2, 3]])
+        self.assertEqual([cache.entries[key].text_width for key in cache.measured], results)
+
+    def testInvalidWorkerCount(self):
+        with mock.patch.dict(os.environ, {'EDREFCARD_RENDER_WORKERS': 'lots'}):
+            self.assertEqual(bindings.renderWorkers(), 1)
+
+    def testMergeMisconfigurationWarnings(self):
+        warnings = ''
+        for controlName in ['Throttle Increase', 'Yaw Left']:
+            warnings = bindings.addMisconfigurationWarning(warnings, controlName)
+        self.assertTrue(warnings.startswith('<h1>Misconfiguration detected</h1>'))
+        self.assertTrue(warnings.endswith('<b>Throttle Increase</b> , <b>Yaw Left</b>'))
+
+
+class DeviceIndexTests(TestCase):
+
+    def testSupportedDeviceFor(self):
+        self.assertIs(bindings.supportedDeviceFor('T16000MTHROTTLE'), bindings.supportedDevices['T16000MFCS'])
+        # The first supported device to handle a device shows it
+        self.assertIs(bindings.supportedDeviceFor('CHProThrottle1'), bindings.supportedDevices['CHFighterStick'])
+        self.assertIsNone(bindings.supportedDeviceFor('Mouse'))
+
+    def testIndexes(self):
+        self.assertEqual(bindings.supportedDevicesByHandledDevice['CHProThrottle1'], ['CHFighterStick', 'CHCombatStick', 'CHProThrottle'])
+        self.assertEqual(bindings.supportedDevicesByTemplate['chfighter'], ['CHFighterStick', 'CHProThrottle'])
+        self.assertEqual(bindings.supportedDevicesByKeyDevice['CHProThrottle1'], ['CHProThrottle'])
+
+    def testListFilter(self):
+        configObj = {'runID': 'abcdef', 'timestamp': datetime.datetime(2020, 1, 1), 'description': 'Test', 'devices': {'CHProThrottle1::0': None}}
+        with TemporaryDirectory() as tempDir, mock.patch.dict(os.environ, {'CONTEXT_DOCUMENT_ROOT': tempDir}):
+            configIndex = bindings.memoryConfigIndex()
+        bindings.indexConfig(configIndex, configObj)
+        for (controllers, shown) in [({'CHCombatStick'}, True), ({'T16000M', 'CHProThrottle'}, True), ({'T16000M'}, False)]:
+            self.assertEqual([row[0] for row in bindings.indexedConfigs(configIndex, {'controllers': controllers})], ['abcdef'] if shown else [])
+        configIndex.close()
+
+
+class ModifierIndexTests(TestCase):
+
+    def setUp(self):
+        xml = b'''<Root>
+            <RollLeftButton><Primary Device="T16000M" Key="Joy_1"><Modifier Device="T16000M" Key="Joy_3" /></Primary></RollLeftButton>
+            <RollRightButton><Primary Device="T16000M" Key="Joy_1"><Modifier Device="T16000M" Key="Joy_2" /></Primary></RollRightButton>
+            <YawLeftButton><Primary Device="Keyboard" Key="Key_A"><Modifier Device="Keyboard" Key="Key_LeftShift" /><Modifier Device="Keyboard" Key="Key_LeftControl" /></Primary></YawLeftButton>
+            <PitchUpButton><Primary Device="T16000M" Key="Joy_4"><Modifier Device="T16000M" Key="Pos_Joy_XAxis" /></Primary></PitchUpButton>
+        </Root>'''
+        errors = bindings.Errors()
+        (self.physicalKeys, self.modifiers, devices) = bindings.parseBindings('000000', xml, set(['Ship']), errors)
+        self.index = bindings.ModifierIndex(self.modifiers)
+
+    def testNumbers(self):
+        self.assertEqual(self.index.numbers, {'T16000M::0::Joy_3': 1, 'T16000M::0::Joy_2': 2, 'Keyboard::0::Key_LeftControl/Keyboard::0::Key_LeftShift': 101, 'T16000M::0::Pos_Joy_XAxis': 3})
+
+    def testMemberKeys(self):
+        self.assertEqual(self.index.memberKeys['Keyboard::0::Key_LeftControl/Keyboard::0::Key_LeftShift'], ['Key_LeftControl', 'Key_LeftShift'])
+
+    def testNumbersOnKey(self):
+        for (key, numbers) in [('Joy_2', [2]), ('Joy_XAxis', [3]), ('Joy_1', [])]:
+            physicalKey = bindings.PhysicalKey('T16000M', 0, key, key)
+            self.assertEqual(self.index.numbersOnKey(('T16000M', '0', key), physicalKey), numbers)
+
+    def testModifiedBinds(self):
+        modifiedBinds = self.index.modifiedBinds(self.physicalKeys[('T16000M', '0', 'Joy_1')])
+        self.assertEqual([modifierNum for (modifierNum, boundControls) in modifiedBinds], [1, 2])
+        self.assertEqual(list(modifiedBinds[1][1]), ['RollRightButton'])
+
+
+class PhysicalKeyTests(TestCase):
+
+    def testAxisAliases(self):
+        self.assertEqual(bindings.PhysicalKey('T16000M', '1', 'Joy_XAxis', 'Joy_XAxis').axisAliases, (('T16000M', '1', 'Pos_Joy_XAxis'), ('T16000M', '1', 'Neg_Joy_XAxis')))
+        self.assertEqual(bindings.PhysicalKey('Keyboard', 0, 'Key_A', 'Key_A').axisAliases, ())
+
+    def testDeviceIndexesAreOneKey(self):
+        xml = b'''<Root>
+            <RollLeftButton><Primary Device="T16000M" Key="Joy_1" /></RollLeftButton>
+            <RollRightButton><Primary Device="T16000M" DeviceIndex="0" Key="Neg_Joy_1" /></RollRightButton>
+        </Root>'''
+        (physicalKeys, modifiers, devices) = bindings.parseBindings('000000', xml, set(['Ship']), bindings.Errors())
+        self.assertEqual(list(physicalKeys), [('T16000M', '0', 'Joy_1')])
+        self.assertEqual(list(physicalKeys[('T16000M', '0', 'Joy_1')].binds['Unmodified']), ['RollLeftButton', 'RollRightButton'])
+
+    def testLegacy(self):
+        physicalKey = bindings.PhysicalKey('T16000M', 0, 'Neg_Joy_1', 'Joy_1')
+        physicalKey.binds['Unmodified'] = {'RollLeftButton': 'control'}
+        (physicalKeys, modifiers, devices) = bindings.legacyBindings({('T16000M', '0', 'Joy_1'): physicalKey}, {}, {})
+        self.assertEqual(physicalKeys, {'T16000M::0::Joy_1': {'Device': 'T16000M', 'DeviceIndex': 0, 'BaseKey': 'Neg_Joy_1', 'Key': 'Joy_1',
+            'Binds': {'Unmodified': {'Controls': OrderedDict([('RollLeftButton', 'control')])}}}})
+
+
+class PhysicalKeysTests(TestCase):
+
+    def setUp(self):
+        self.physicalKeys = bindings.PhysicalKeys()
+        for (device, deviceIndex, key) in [('CHProThrottle1', '0', 'Joy_1'), ('CHFighterStick', '0', 'Joy_1'), ('CHProThrottle1', '1', 'Joy_2'), ('CHProThrottle1', '0', 'Joy_3'), ('Keyboard', '0', 'Key_A')]:
+            self.physicalKeys.add((device, deviceIndex, key), bindings.PhysicalKey(device, deviceIndex, key, key))
+
+    def testCardKeysKeepTheirOrder(self):
+        cardKeys = self.physicalKeys.cardKeys(['CHFighterStick', 'CHProThrottle1', 'CHProThrottle2'], 0)
+        self.assertEqual(list(cardKeys), [('CHProThrottle1', '0', 'Joy_1'), ('CHFighterStick', '0', 'Joy_1'), ('CHProThrottle1', '0', 'Joy_3')])
+        self.assertEqual(list(self.physicalKeys.cardKeys(['CHProThrottle1'], 1)), [('CHProThrottle1', '1', 'Joy_2')])
+        self.assertEqual(self.physicalKeys.cardKeys(['CHProThrottle2'], 0), {})
+
+    def testKeyboardKeysAtAnyIndex(self):
+        self.assertEqual(list(self.physicalKeys.cardKeys(['Keyboard'])), [('Keyboard', '0', 'Key_A')])
+
+    def testCardJobsTakeTheirDevices(self):
+        devices = {'CHProThrottle1::0': bindings.supportedDevices['CHFighterStick'], 'CHFighterStick::0': bindings.supportedDevices['CHFighterStick'], 'Keyboard::0': bindings.supportedDevices['Keyboard']}
+        cards = bindings.cardJobs(self.physicalKeys, {}, devices, ['Ship'], bindings.Config('abcdef'), False, 'None', 'jpg')
+        self.assertEqual([(name, list(args[0])) for (createdImage, name, (function, args)) in cards], [
+            ('chfighter', [('CHProThrottle1', '0', 'Joy_1'), ('CHFighterStick', '0', 'Joy_1'), ('CHProThrottle1', '0', 'Joy_3')]),
+            ('keyboard', [('Keyboard', '0', 'Key_A')]),
+        ])
+
+
 class ModiferStylesTests(TestCase):
     
     def testZeroIndex(self):
@@ -203,6 +1011,370 @@ class ModiferStylesTests(TestCase):
         self.assertEqual(bindings.ModifierStyles.styles[1], style)
 
     
+class ParseLimitTests(TestCase):
+
+    binding = b'<RollLeftButton><Primary Device="T16000M" Key="Joy_1">%s</Primary></RollLeftButton>'
+
+    def testLimitFromEnvironment(self):
+        with mock.patch.dict(os.environ, {'EDREFCARD_MAX_BINDS_ELEMENTS': '100', 'EDREFCARD_MAX_PARSE_SECONDS': '0.5'}):
+            self.assertEqual(bindings.parseLimit('elements'), 100)
+            self.assertEqual(bindings.parseLimit('seconds'), 0.5)
+        for value in ('lots', '-1', '0', '1.5'):
+            with mock.patch.dict(os.environ, {'EDREFCARD_MAX_BINDS_ELEMENTS': value}):
+                self.assertEqual(bindings.parseLimit('elements'), 20000)
+
+    def assertExceeds(self, limit, xml):
+        with self.assertRaises(bindings.ParseLimitExceeded) as raised:
+            bindings.readBindings(xml)
+        self.assertEqual(raised.exception.limit, limit)
+
+    def testLimits(self):
+        with mock.patch.dict(os.environ, {'EDREFCARD_MAX_BINDS_BYTES': '1000'}):
+            self.assertExceeds('bytes', b'<Root>%s</Root>' % (b' ' * 1000))
+        with mock.patch.dict(os.environ, {'EDREFCARD_MAX_BINDS_ELEMENTS': '10'}):
+            self.assertExceeds('elements', b'<Root>%s</Root>' % (self.binding % b'' * 5))
+            self.assertEqual(len(bindings.readBindings(b'<Root>%s</Root>' % (self.binding % b'' * 4))), 4)
+        modifiers = b'<Modifier Device="T16000M" Key="Joy_2" />' * 9
+        self.assertExceeds('modifiers', b'<Root>%s</Root>' % (self.binding % modifiers))
+        with mock.patch.object(bindings.time, 'monotonic', side_effect=[0.0, 10.0]):
+            self.assertExceeds('seconds', b'<Root>%s</Root>' % (self.binding % b''))
+
+    def testParseBindingsCountsLimits(self):
+        xml = b'<Root>%s</Root>' % (self.binding % (b'<Modifier Device="T16000M" Key="Joy_2" />' * 9))
+        with TemporaryDirectory() as cacheDir:
+            with mock.patch.dict(os.environ, {'EDREFCARD_CACHE_DIR': cacheDir}), mock.patch.object(bindings, 'logError'):
+                for i in range(2):
+                    errors = bindings.Errors()
+                    result = bindings.parseBindings('testid', xml, bindings.groupStyles.keys(), errors)
+                    self.assertEqual(result, ({}, {}, {}))
+                    self.assertIn('more than 8 modifiers', errors.errors)
+                self.assertEqual(json.loads((Path(cacheDir) / 'parseLimits.json').read_text()), {'modifiers': 2})
+
+    def testRequestTooLarge(self):
+        with mock.patch.dict(os.environ, {'EDREFCARD_MAX_BINDS_BYTES': '1000', 'CONTENT_LENGTH': '60000'}):
+            self.assertFalse(bindings.requestTooLarge())
+        with mock.patch.dict(os.environ, {'EDREFCARD_MAX_BINDS_BYTES': '1000', 'CONTENT_LENGTH': '100000'}):
+            self.assertTrue(bindings.requestTooLarge())
+
+
+class LintTests(TestCase):
+
+    xml = b'''<Root>
+        <RollLeftButton><Primary Device="T16000M" Key="Joy_XAxis" /><Secondary Device="ThrustMasterWarthogCombined" Key="Joy_1" /></RollLeftButton>
+        <MadeUpControl><Primary Device="Keyboard" Key="Key_A" /><Secondary Device="Mystery" Key="Joy_1" /></MadeUpControl>
+        <UpThrustButton><Primary Device="Mouse" Key="Mouse_1" /></UpThrustButton>
+    </Root>'''
+
+    def testLintBindings(self):
+        parsedBindings = bindings.parseBindings('abcdef', self.xml, bindings.groupStyles.keys(), bindings.Errors())
+        self.assertEqual(bindings.lintBindings(*parsedBindings), [
+            ('misconfigured', 'Roll Left'),
+            ('mappingSoftware', 'ThrustMasterWarthogCombined::0'),
+            ('unsupportedDevice', 'Mystery::0'),
+            ('unknownControl', 'MadeUpControl'),
+        ])
+
+    def testLintOnlyCoversCards(self):
+        # The T16000M stick has no card at device index 2
+        xml = b'<Root><RollLeftButton><Primary Device="T16000M" DeviceIndex="2" Key="Joy_XAxis" /></RollLeftButton></Root>'
+        parsedBindings = bindings.parseBindings('abcdef', xml, bindings.groupStyles.keys(), bindings.Errors())
+        self.assertEqual(bindings.lintBindings(*parsedBindings), [])
+
+    def testApplyLint(self):
+        errors = bindings.Errors(misconfigurationWarnings='stale', unhandledDevicesWarnings='stale')
+        with mock.patch.object(bindings, 'logError') as logError:
+            bindings.applyLint('abcdef', [('misconfigured', 'Roll Left'), ('misconfigured', 'Roll Right'), ('unknownControl', 'MadeUpControl')], errors)
+        self.assertTrue(errors.misconfigurationWarnings.endswith('<b>Roll Left</b> , <b>Roll Right</b>'))
+        self.assertEqual(errors.unhandledDevicesWarnings, '')
+        self.assertEqual(errors.deviceWarnings, '')
+        logError.assert_called_once_with('abcdef: No control for MadeUpControl\n')
+        with mock.patch.object(bindings, 'logError'):
+            bindings.applyLint('abcdef', [('unsupportedDevice', 'Mystery::0'), ('mappingSoftware', 'ThrustMasterWarthogCombined::0')], errors)
+        self.assertEqual(errors.misconfigurationWarnings, '')
+        self.assertIn('"abcdef"', errors.unhandledDevicesWarnings)
+        self.assertIn('TARGET', errors.deviceWarnings)
+
+
+class ConfigIndexTests(TestCase):
+
+    def setUp(self):
+        self.tempDir = TemporaryDirectory()
+        self.environ = mock.patch.dict(os.environ, {'CONTEXT_DOCUMENT_ROOT': self.tempDir.name, 'EDREFCARD_CACHE_DIR': self.tempDir.name + '/cache'})
+        self.environ.start()
+        self.publish('abcdef', 'Zebra', {'T16000M::0': None, 'Keyboard::0': None})
+        self.publish('ghijkl', 'apple', {'ThrustMasterTFlightHOTASX::0': None})
+        self.publish('mnopqr', '', {'T16000M::0': None})
+
+    def tearDown(self):
+        self.environ.stop()
+        self.tempDir.cleanup()
+
+    def publish(self, runId, description, devices):
+        config = bindings.Config(runId)
+        config.makeDir()
+        bindings.saveReplayInfo(config, description, 'None', ['Ship'], devices, bindings.Errors())
+
+    def listed(self, searchOpts={}):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            bindings.printList(bindings.Mode.list, searchOpts)
+        return output.getvalue()
+
+    def testIndexedConfigs(self):
+        configIndex = bindings.currentConfigIndex()
+        self.assertEqual([row[:3] for row in bindings.indexedConfigs(configIndex, {})], [
+            ('ghijkl', 'apple', 'ThrustMasterTFlightHOTASX'),
+            ('abcdef', 'Zebra', 'T16000M'),
+        ])
+        self.assertEqual([row[0] for row in bindings.indexedConfigs(configIndex, {'controllers': {'T16000M'}})], ['abcdef'])
+        self.assertEqual([row[0] for row in bindings.indexedConfigs(configIndex, {'controllers': {'Unknown'}})], [])
+        configIndex.close()
+
+    def testListMatchesReplays(self):
+        for searchOpts in [{}, {'controllers': {'T16000M'}}]:
+            indexed = self.listed(searchOpts)
+            with mock.patch.dict(os.environ, {'EDREFCARD_CACHE_DIR': ''}):
+                self.assertEqual(indexed, self.listed(searchOpts))
+        indexed = self.listed()
+        self.assertLess(indexed.index('apple'), indexed.index('Zebra'))
+
+    def testIndexedConfigsPages(self):
+        configIndex = bindings.currentConfigIndex()
+        self.assertEqual([row[0] for row in bindings.indexedConfigs(configIndex, {}, 'date')], ['ghijkl', 'abcdef'])
+        self.assertEqual([row[0] for row in bindings.indexedConfigs(configIndex, {}, limit=1)], ['ghijkl'])
+        self.assertEqual([row[0] for row in bindings.indexedConfigs(configIndex, {}, after=['apple', 'ghijkl'])], ['abcdef'])
+        self.assertEqual([row[0] for row in bindings.indexedConfigs(configIndex, {}, before=['zebra', 'abcdef'])], ['ghijkl'])
+        self.assertEqual([row[0] for row in bindings.indexedConfigs(configIndex, {}, before=['zzz', ''], limit=2)], ['ghijkl', 'abcdef'])
+        for order in bindings.listOrders:
+            rows = list(bindings.indexedConfigs(configIndex, {}, order))
+            self.assertEqual([row[0] for row in bindings.indexedConfigs(configIndex, {}, order, after=bindings.listKey(order, rows[0]))], [rows[1][0]])
+            self.assertEqual([row[0] for row in bindings.indexedConfigs(configIndex, {}, order, before=bindings.listKey(order, rows[1]), limit=1)], [rows[0][0]])
+        configIndex.close()
+
+    def testListPages(self):
+        def link(page, name):
+            match = re.search(r'<a href="list\?([^"]*)">%s</a>' % name, page)
+            return match and dict(urllib.parse.parse_qsl(html.unescape(match.group(1))))
+        firstPage = self.listed({'pageSize': 1})
+        self.assertIn('>apple</a>', firstPage)
+        self.assertNotIn('>Zebra</a>', firstPage)
+        self.assertIsNone(link(firstPage, 'Previous'))
+        nextLink = link(firstPage, 'Next')
+        self.assertEqual(nextLink['count'], '1')
+        secondPage = self.listed({'pageSize': 1, 'after': bindings.decodeListKey(nextLink['after'])})
+        self.assertIn('>Zebra</a>', secondPage)
+        self.assertNotIn('>apple</a>', secondPage)
+        self.assertIsNone(link(secondPage, 'Next'))
+        previousPage = self.listed({'pageSize': 1, 'before': bindings.decodeListKey(link(secondPage, 'Previous')['before'])})
+        self.assertIn('>apple</a>', previousPage)
+        self.assertIsNone(link(previousPage, 'Previous'))
+        self.assertIsNotNone(link(previousPage, 'Next'))
+
+    def testDecodeListKey(self):
+        self.assertEqual(bindings.decodeListKey(bindings.encodeListKey(['zebra', 'abcdef'])), ['zebra', 'abcdef'])
+        for value in ['', 'not a key', 'é', bindings.encodeListKey(['zebra']), bindings.encodeListKey({'a': 'b'}), bindings.encodeListKey([1, 'abcdef'])]:
+            self.assertIsNone(bindings.decodeListKey(value))
+
+    def testParseTimestamp(self):
+        for timestamp in [
+            datetime.datetime(2020, 1, 2, 3, 4, 5),
+            datetime.datetime(2020, 1, 2, 3, 4, 5, 678901, datetime.timezone.utc),
+            datetime.datetime(2020, 1, 2, 3, 4, 5, tzinfo=datetime.timezone(-datetime.timedelta(hours=5, minutes=30))),
+        ]:
+            parsed = bindings.parseTimestamp(timestamp.isoformat())
+            self.assertEqual((parsed, parsed.tzinfo), (timestamp, timestamp.tzinfo))
+        with self.assertRaises(ValueError):
+            bindings.parseTimestamp('yesterday')
+
+    def testControllerBits(self):
+        self.assertEqual(bindings.controllerBits(['T16000M', 'Unknown']), 1 << bindings.supportedDeviceOrder['T16000M'])
+        self.assertLessEqual(len(bindings.supportedDevices), bindings.controllerBitsLimit, 'controllerBits has no bit for every supported device')
+        self.assertLessEqual(bindings.controllerBits(bindings.supportedDevices).bit_length(), 63)
+        configIndex = bindings.currentConfigIndex()
+        bits = dict(configIndex.execute('SELECT runId, controllerBits FROM configs'))
+        configIndex.close()
+        self.assertEqual(bits['abcdef'], bindings.controllerBits(bindings.supportedDevicesByHandledDevice['T16000M'] + ['Keyboard']))
+        self.assertEqual(bits['ghijkl'], bindings.controllerBits(['TFlightHOTASX']))
+        with mock.patch.dict(bindings.supportedDeviceOrder, {'T16000M': 63}):
+            with self.assertRaises(ValueError):
+                bindings.controllerBits(['T16000M'])
+            # The configuration is still published
+            with mock.patch.object(bindings, 'logError') as logError:
+                self.publish('stuvwx', 'Third', {'T16000M::0': None})
+            self.assertIn('supported devices that controllerBits allows for', logError.call_args[0][0])
+        self.assertTrue(bindings.Config('stuvwx').pathWithSuffix('.replay').exists())
+
+    def testOldIndexIsReplaced(self):
+        Path(self.tempDir.name, 'cache', 'configs.sqlite').unlink()
+        configIndex = bindings.sqlite3.connect(str(Path(self.tempDir.name, 'cache', 'configs.sqlite')))
+        configIndex.executescript('''
+            CREATE TABLE configs (runId TEXT PRIMARY KEY, description TEXT NOT NULL, sortKey TEXT NOT NULL, timestamp TEXT, controllers TEXT NOT NULL);
+            CREATE TABLE configDevices (device TEXT NOT NULL, runId TEXT NOT NULL, PRIMARY KEY (device, runId)) WITHOUT ROWID;
+            CREATE TABLE configIndexInfo (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+            INSERT INTO configIndexInfo VALUES ('version', '1:old');
+        ''')
+        configIndex.close()
+        configIndex = bindings.currentConfigIndex()
+        self.assertEqual([row[0] for row in bindings.indexedConfigs(configIndex, {'controllers': {'TFlightHOTASX'}})], ['ghijkl'])
+        self.assertEqual([row[0] for row in configIndex.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")], ['configIndexInfo', 'configs'])
+        configIndex.close()
+
+    def testIndexIsReadWhileLocked(self):
+        bindings.currentConfigIndex().close()
+        # Another process writing to the index
+        writer = bindings.sqlite3.connect(str(Path(self.tempDir.name, 'cache', 'configs.sqlite')))
+        writer.execute('BEGIN IMMEDIATE')
+        with mock.patch.object(bindings, 'configIndexTimeout', 0.1):
+            # A current index is read without waiting for it
+            self.assertIn('>apple</a>', self.listed())
+            # As is one from other bindingsData, which that process may be rebuilding
+            writer.execute("UPDATE configIndexInfo SET value = ? WHERE name = 'version'", ('%d:other' % bindings.configIndexFormat,))
+            writer.commit()
+            writer.execute('BEGIN IMMEDIATE')
+            self.assertIn('>apple</a>', self.listed())
+            # One that can't be read isn't built in memory instead
+            writer.execute("UPDATE configIndexInfo SET value = '1:old' WHERE name = 'version'")
+            writer.commit()
+            writer.execute('BEGIN IMMEDIATE')
+            with mock.patch.object(bindings, 'logError'), mock.patch.object(bindings, 'memoryConfigIndex') as memoryConfigIndex:
+                self.assertIn('Please try again', self.listed())
+            memoryConfigIndex.assert_not_called()
+        writer.rollback()
+        writer.close()
+        self.assertIn('>apple</a>', self.listed())
+
+    def testIndexIsRebuiltFromReplays(self):
+        # Replays added by hand are only indexed once the index is rebuilt
+        configIndex = bindings.currentConfigIndex()
+        uploadPath = Path('../../bindings/testUploads/eu/euymtn.replay').resolve(True)
+        replayPath = bindings.Config('euymtn').pathWithSuffix('.replay')
+        replayPath.parent.mkdir(parents=True)
+        shutil.copyfile(str(uploadPath), str(replayPath))
+        self.assertIsNone(bindings.updateConfigIndex(configIndex))
+        self.assertNotIn('euymtn', [row[0] for row in bindings.indexedConfigs(configIndex, {})])
+        self.assertEqual(bindings.updateConfigIndex(configIndex, force=True), 4)
+        self.assertIn('euymtn', [row[0] for row in bindings.indexedConfigs(configIndex, {})])
+        self.assertIsNone(bindings.updateConfigIndex(configIndex))
+        configIndex.close()
+        with mock.patch.object(bindings, 'configIndexFormat', 0):
+            configIndex = bindings.openConfigIndex()
+            self.assertEqual(bindings.updateConfigIndex(configIndex), 4)
+            configIndex.close()
+
+
+class PageCacheTests(TestCase):
+
+    def setUp(self):
+        self.tempDir = TemporaryDirectory()
+        self.environ = mock.patch.dict(os.environ, {'CONTEXT_DOCUMENT_ROOT': self.tempDir.name, 'EDREFCARD_CACHE_DIR': self.tempDir.name + '/cache'})
+        self.environ.start()
+        bindings.currentConfigIndex().close()
+        self.publish('abcdef', 'Zebra')
+        self.pagesMade = 0
+
+    def tearDown(self):
+        self.environ.stop()
+        self.tempDir.cleanup()
+
+    def publish(self, runId, description):
+        config = bindings.Config(runId)
+        config.makeDir()
+        bindings.saveReplayInfo(config, description, 'None', ['Ship'], {'T16000M::0': None}, bindings.Errors())
+
+    def printPage(self):
+        self.pagesMade = self.pagesMade + 1
+        bindings.printList(bindings.Mode.list, {})
+
+    def printDevices(self):
+        self.pagesMade = self.pagesMade + 1
+        bindings.printDeviceList(bindings.Mode.listDevices)
+
+    # The headers and body of a response to a request with some headers
+    def serve(self, requestHeaders={}, mode=bindings.Mode.list):
+        output = io.TextIOWrapper(io.BytesIO(), encoding='utf-8')
+        printPage = self.printDevices if mode is bindings.Mode.listDevices else self.printPage
+        with mock.patch.dict(os.environ, requestHeaders), contextlib.redirect_stdout(output):
+            bindings.serveCachedPage(mode, {}, printPage)
+        output.flush()
+        (headerBytes, separator, body) = output.buffer.getvalue().partition(b'\n\n')
+        headers = dict(line.split(': ', 1) for line in headerBytes.decode('utf-8').split('\n'))
+        return (headers, body)
+
+    def testPageIsMadeOnce(self):
+        (headers, body) = self.serve()
+        self.assertIn(b'>Zebra</a>', body)
+        self.assertIn('ETag', headers)
+        self.assertIn('Last-Modified', headers)
+        self.assertEqual(self.serve(), (headers, body))
+        self.assertEqual(self.pagesMade, 1)
+
+    def testPageIsSentAsItIsMade(self):
+        output = io.TextIOWrapper(io.BytesIO(), encoding='utf-8')
+        sent = []
+        def printPage():
+            print('<p>start</p>')
+            sys.stdout.flush()
+            sent.append(output.buffer.getvalue())
+            print('<p>end</p>')
+        with contextlib.redirect_stdout(output):
+            bindings.serveCachedPage(bindings.Mode.list, {}, printPage)
+        self.assertIn(b'<p>start</p>', sent[0])
+        self.assertNotIn(b'<p>end</p>', sent[0])
+        (headers, body) = self.serve()
+        self.assertEqual(body, b'<p>start</p>\n<p>end</p>\n')
+        self.assertEqual(self.pagesMade, 0)
+
+    def testDevicesPageOutlivesGenerations(self):
+        (headers, body) = self.serve(mode=bindings.Mode.listDevices)
+        self.assertIn(b'<li><a href=device/T16000M>', body)
+        self.publish('ghijkl', 'apple')
+        self.assertEqual(self.serve(mode=bindings.Mode.listDevices), (headers, body))
+        self.serve()
+        self.assertEqual(self.pagesMade, 2)
+        self.assertEqual(self.serve({'HTTP_IF_NONE_MATCH': headers['ETag']}, bindings.Mode.listDevices)[0]['Status'], '304 Not Modified')
+
+    def testNotModified(self):
+        (headers, body) = self.serve()
+        (notModifiedHeaders, notModifiedBody) = self.serve({'HTTP_IF_NONE_MATCH': '"other", %s' % headers['ETag']})
+        self.assertEqual(notModifiedHeaders['Status'], '304 Not Modified')
+        self.assertEqual(notModifiedBody, b'')
+        (notModifiedHeaders, notModifiedBody) = self.serve({'HTTP_IF_MODIFIED_SINCE': headers['Last-Modified']})
+        self.assertEqual(notModifiedHeaders['Status'], '304 Not Modified')
+        self.assertEqual(self.pagesMade, 1)
+        # A new configuration makes a new generation of pages, and removes the old one
+        self.publish('ghijkl', 'apple')
+        (newHeaders, newBody) = self.serve({'HTTP_IF_NONE_MATCH': headers['ETag']})
+        self.assertNotIn('Status', newHeaders)
+        self.assertNotEqual(newHeaders['ETag'], headers['ETag'])
+        self.assertIn(b'>apple</a>', newBody)
+        configIndex = bindings.currentConfigIndex()
+        self.assertEqual([path.name for path in Path(self.tempDir.name, 'cache', 'pages').iterdir()], [str(bindings.configGeneration(configIndex))])
+        configIndex.close()
+
+    def testCompressed(self):
+        (headers, body) = self.serve()
+        (gzipHeaders, gzipBody) = self.serve({'HTTP_ACCEPT_ENCODING': 'br;q=0, gzip;q=0.5'})
+        self.assertEqual(gzipHeaders['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(gzipBody), body)
+        if bindings.brotli is not None:
+            (brotliHeaders, brotliBody) = self.serve({'HTTP_ACCEPT_ENCODING': 'gzip, br'})
+            self.assertEqual(brotliHeaders['Content-Encoding'], 'br')
+            self.assertEqual(bindings.brotli.decompress(brotliBody), body)
+        self.assertEqual(self.serve({'HTTP_ACCEPT_ENCODING': 'identity'}), (headers, body))
+
+    def testUncached(self):
+        with mock.patch.dict(os.environ, {'EDREFCARD_CACHE_DIR': ''}):
+            (headers, body) = self.serve()
+        self.assertEqual(headers, {'Content-Type': 'text/html'})
+        self.assertIn(b'>Zebra</a>', body)
+        self.assertFalse(Path(self.tempDir.name, 'cache', 'pages').exists())
+
+    def testPageCacheKey(self):
+        key = bindings.pageCacheKey(bindings.Mode.list, {'controllers': {'T16000M', 'Warthog', 'XBox'}, 'order': 'date'}, 1)
+        self.assertEqual(bindings.pageCacheKey(bindings.Mode.list, {'order': 'date', 'controllers': {'XBox', 'Warthog', 'T16000M'}}, 1), key)
+        self.assertNotEqual(bindings.pageCacheKey(bindings.Mode.list, {'controllers': {'T16000M', 'Warthog', 'XBox'}, 'order': 'date'}, 2), key)
+        self.assertNotEqual(bindings.pageCacheKey(bindings.Mode.listDevices, {}, 1), bindings.pageCacheKey(bindings.Mode.list, {}, 1))
+
 class ParserTests(TestCase):
     
     def setUp(self):
@@ -221,6 +1393,37 @@ class ParserTests(TestCase):
         self.assertEqual(result, expectedResult)
         self.assertTrue(len(errors.errors) > 0)
         
+    def testReadBindingsOrder(self):
+        xml = b'''<Root>
+            <YawLeftButton><Primary Device="Keyboard" Key="Key_A"><Modifier Device="Keyboard" Key="Key_LeftShift" /></Primary><Secondary Device="{NoDevice}" Key="" /></YawLeftButton>
+            <YawAxisRaw><Binding Device="T16000M" DeviceIndex="1" Key="Joy_XAxis" /></YawAxisRaw>
+            <RollLeftButton><Primary Device="T16000M" Key="Joy_1" /><Secondary Device="Keyboard" Key="Key_Q" /></RollLeftButton>
+        </Root>'''
+        self.assertEqual(bindings.readBindings(xml), [
+            ('YawAxisRaw', 'T16000M', '1', 'Joy_XAxis', []),
+            ('YawLeftButton', 'Keyboard', 0, 'Key_A', [('Keyboard', 0, 'Key_LeftShift')]),
+            ('RollLeftButton', 'T16000M', 0, 'Joy_1', []),
+            ('YawLeftButton', '{NoDevice}', 0, '', []),
+            ('RollLeftButton', 'Keyboard', 0, 'Key_Q', []),
+        ])
+        self.assertEqual(bindings.readBindings(xml.decode('utf-8')), bindings.readBindings(xml))
+
+    def testReadBindingsT16000MThrottle(self):
+        xml = b'''<Root>
+            <RollLeftButton><Primary Device="T16000M" Key="Joy_1"><Modifier Device="T16000M" Key="Joy_2" /></Primary></RollLeftButton>
+            <ThrottleAxis><Binding Device="T16000MTHROTTLE" Key="Joy_ZAxis" /></ThrottleAxis>
+        </Root>'''
+        self.assertEqual(bindings.readBindings(xml), [
+            ('ThrottleAxis', 'T16000MTHROTTLE', 0, 'Joy_ZAxis', []),
+            ('RollLeftButton', 'T16000MFCS', 0, 'Joy_1', [('T16000MFCS', 0, 'Joy_2')]),
+        ])
+        # As the throttle is looked for on every element, not just on bindings
+        xml = b'''<Root>
+            <RollLeftButton><Primary Device="T16000M" Key="Joy_1" /></RollLeftButton>
+            <ThrottleSettings Device="T16000MTHROTTLE" />
+        </Root>'''
+        self.assertEqual(bindings.readBindings(xml), [('RollLeftButton', 'T16000MFCS', 0, 'Joy_1', [])])
+
     def testRedundantSpecialisation(self):
         control = {'Group': 'Galaxy map', 'Category': 'UI', 'Order': 12, 'Name': 'GalMap Pitch Up', 'Type': 'Digital', 'HasAnalogue': True, 'HideIfSameAs': ['PitchUpButton']}
         bind = {'Controls': OrderedDict([('CamPitchUp', 'blah'), ('PitchUpButton', 'blah')])}
@@ -6,30 +6,58 @@ from lxml import etree
 
 from collections import OrderedDict
 
-from wand.drawing import Drawing
-from wand.image import Image
+from wand.drawing import Drawing, FontMetrics
+from wand.image import Image, IMAGE_TYPES
+from wand.api import library
 from wand.font import Font
 from wand.color import Color
+from wand.exceptions import WandException
 
 import cgi
 import cgitb
+import contextlib
+import email.utils
+import gzip
 import html
+import io
+import marshal
 import sys
 import string
 import random
 import datetime
+import base64
+import json
+import hashlib
+import heapq
 import codecs
 import os
 import pickle
 import re
+import shutil
+import sqlite3
+import time
+import multiprocessing
 from enum import Enum
 from pathlib import Path
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlencode
+
+try:
+    import fcntl
+except ImportError: # pragma: no cover
+    fcntl = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 try:
     from .bindingsData import *
+    from . import fontMetrics
+    from . import jpegPatch
 except: # pragma: no cover
     from bindingsData import *
+    import fontMetrics
+    import jpegPatch
 
 
 class Config:
@@ -59,6 +87,13 @@ class Config:
     
     def configsPath():
         return Config.dirRoot() / 'configs'
+
+    # Location for derived data that can be rebuilt at any time, or None if caching to disk isn't enabled
+    def cachePath():
+        path = os.environ.get('EDREFCARD_CACHE_DIR')
+        if not path:
+            return None
+        return Path(path)
         
     def path(self):
         path = Config.configsPath() / self.name[:2] / self.name
@@ -88,20 +123,23 @@ class Config:
         url = urljoin(Config.webRoot(), "configs/%s.binds" % self.name)
         return url
 
+    # Pickled replay info, from before replay records, with its runID. Only plain data and datetimes are loaded from it
     def unpickle(path):
         with path.open('rb') as file:
-            object = pickle.load(file)
+            object = ReplayUnpickler(file).load()
             object['runID'] = path.stem
         return object
-            
-    def allConfigs(sortKey=None):
-        configsPath = Config.configsPath()
-        picklePaths = list(configsPath.glob('**/*.replay'))
-        objs = [Config.unpickle(path) for path in picklePaths]
-        if sortKey is not None:
-            objs.sort(key=sortKey)
-        return objs
 
+    # A configuration's replay info from its record, or from the pickle it replaced, with its runID
+    def loadReplay(path):
+        data = path.read_bytes()
+        if data.startswith(b'{'):
+            replayInfo = replayInfoFromRecord(json.loads(data))
+        else:
+            replayInfo = replayInfoFromRecord(replayRecord(Config.unpickle(path)))
+        replayInfo['runID'] = path.stem
+        return replayInfo
+            
 	
 class Mode(Enum):
     invalid = 0
@@ -110,6 +148,7 @@ class Mode(Enum):
     replay = 3
     generate = 4
     listDevices = 5
+    render = 6
 
 
 class Errors:
@@ -199,15 +238,624 @@ def transKey(key):
         trans = key.replace('Key_', '')
     return trans
 
+# Indexes of supportedDevices, built once: the keys of the supported devices that handle a device, that use a template,
+# and that are shown for a key device, each in the order of supportedDevices
+def indexSupportedDevices(field):
+    index = {}
+    for supportedDeviceKey, supportedDevice in supportedDevices.items():
+        values = supportedDevice.get(field, supportedDevice['HandledDevices'])
+        for value in ([values] if isinstance(values, str) else values):
+            keys = index.setdefault(value, [])
+            if supportedDeviceKey not in keys:
+                keys.append(supportedDeviceKey)
+    return index
+
+supportedDevicesByHandledDevice = indexSupportedDevices('HandledDevices')
+supportedDevicesByTemplate = indexSupportedDevices('Template')
+supportedDevicesByKeyDevice = indexSupportedDevices('KeyDevices')
+supportedDeviceOrder = {supportedDeviceKey: position for position, supportedDeviceKey in enumerate(supportedDevices)}
+
+# The supported device whose card shows a device's bindings, or None if it isn't supported
+def supportedDeviceFor(device):
+    supportedDeviceKeys = supportedDevicesByHandledDevice.get(device)
+    if supportedDeviceKeys is None:
+        return None
+    return supportedDevices[supportedDeviceKeys[0]]
+
+# Lookups over the modifiers found by parseBindings, made in one pass over them: the number shown for each combination
+# of modifiers, the keys that make up each combination, and the numbers of the modifiers on each physical key, which are
+# keyed as physical keys are
+class ModifierIndex:
+    def __init__(self, modifiers):
+        self.numbers = {}
+        self.memberKeys = {}
+        self.keyNumbers = {}
+        for modifierSpec, keyModifiers in modifiers.items():
+            for keyModifier in keyModifiers:
+                combination = keyModifier['ModifierKey']
+                if modifierSpec == combination and combination not in self.numbers:
+                    self.numbers[combination] = keyModifier['Number']
+                if keyModifier.get('Key') is not None:
+                    self.memberKeys.setdefault(combination, []).append(keyModifier['Key'])
+            if '/' not in modifierSpec and keyModifiers:
+                self.keyNumbers[modifierKeyId(keyModifiers[0])] = [keyModifier['Number'] for keyModifier in keyModifiers]
+
+    # The numbers of the modifiers on a physical key, including those on either direction of an axis
+    def numbersOnKey(self, keyId, physicalKey):
+        numbers = list(self.keyNumbers.get(keyId, []))
+        for axisAlias in physicalKey.axisAliases:
+            numbers.extend(self.keyNumbers.get(axisAlias, []))
+        return numbers
+
+    # A physical key's modified binds, as (modifier number, controls) in the order of their numbers
+    def modifiedBinds(self, physicalKey):
+        modifiedBinds = [(self.numbers[modifier], boundControls) for modifier, boundControls in physicalKey.binds.items() if modifier != 'Unmodified' and modifier in self.numbers]
+        return sorted(modifiedBinds, key=lambda modifiedBind: modifiedBind[0])
+
+# Font metrics section
+
+# Bounded LRU cache of text metrics keyed by (font path, font size, text), shared by every card rendered in this process.
+# Metrics come from the drawing context, or with EDREFCARD_TEXT_METRICS set to fonttables from the font tables where
+# possible, so that layout doesn't need ImageMagick
+class FontMetricsCache:
+    def __init__(self, maxEntries=20000, useFontTables=None):
+        self.maxEntries = maxEntries
+        if useFontTables is None:
+            useFontTables = os.environ.get('EDREFCARD_TEXT_METRICS', 'imagemagick') == 'fonttables'
+        self.useFontTables = useFontTables
+        self.entries = OrderedDict()
+        # The keys of the entries measured by this process, in order, so that those measured by render workers can be
+        # sent back to be saved
+        self.measured = []
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return "FontMetricsCache(entries=%d, hits=%d, misses=%d)" % (len(self.entries), self.hits, self.misses)
+
+    def measure(self, font, fontSize, text, context, img):
+        key = (font, fontSize, text)
+        metrics = self.entries.get(key)
+        if metrics is None:
+            self.misses = self.misses + 1
+            if self.useFontTables:
+                metrics = fontMetrics.textMetrics(font, fontSize, text)
+            if metrics is None:
+                context.push()
+                context.font = font
+                context.font_size = fontSize
+                metrics = context.get_font_metrics(img, text, multiline=False)
+                context.pop()
+            self.entries[key] = metrics
+            self.measured.append(key)
+            if len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+        else:
+            self.hits = self.hits + 1
+            self.entries.move_to_end(key)
+        return metrics
+
+    def metrics(self, context, img, text):
+        return self.measure(context.font, context.font_size, text, context, img)
+
+    # The entries measured since the given number had been, as (key, metrics) pairs
+    def measuredSince(self, count):
+        return [(key, tuple(self.entries[key])) for key in self.measured[count:] if key in self.entries]
+
+    # Add entries measured by another process
+    def merge(self, measuredEntries):
+        for key, values in measuredEntries:
+            if key not in self.entries:
+                self.entries[key] = FontMetrics(*values)
+                self.measured.append(key)
+        while len(self.entries) > self.maxEntries:
+            self.entries.popitem(last=False)
+
+    # The file is JSON: a list of [font, font size, text, metrics]. One that can't be used, such as one left by an
+    # earlier version, is ignored, and replaced when the cache is next saved
+    def load(self, path):
+        try:
+            storedEntries = OrderedDict()
+            for font, fontSize, text, values in json.loads(path.read_bytes()):
+                storedEntries[(font, fontSize, text)] = FontMetrics(*values)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logError('Unable to load the font metrics cache %s: %s\n' % (path, e))
+            return
+        self.entries.update(storedEntries)
+        while len(self.entries) > self.maxEntries:
+            self.entries.popitem(last=False)
+
+    def save(self, path):
+        # Write to a temporary file first so that concurrent readers never see a partial cache
+        storedEntries = [list(key) + [list(metrics)] for key, metrics in self.entries.items()]
+        tempPath = path.with_name('%s.%d' % (path.name, os.getpid()))
+        try:
+            tempPath.write_text(json.dumps(storedEntries), encoding='utf-8')
+            os.replace(str(tempPath), str(path))
+        except OSError:
+            pass
+
+fontMetricsCache = FontMetricsCache()
+
+# Optional on-disk copy of the font metrics cache, so that short-lived CGI processes can share measurements
+def fontMetricsCachePath():
+    path = os.environ.get('EDREFCARD_FONT_METRICS_CACHE')
+    if not path:
+        return None
+    return Path(path)
+
 # Output section
 
-def writeUrlToDrawing(config, drawing, public):
-    url = config.refcardURL() if public else Config.webRoot()
+# Decoded template images are kept in ImageMagick's MPC format: a small header plus the raw pixel cache, which is
+# memory-mapped when opened rather than decoded, so every process shares the same pages. The file name includes the size
+# and modification time of the source JPEG, so changing a file in www/res invalidates its cache automatically
+def cachedTemplatePath(sourcePath, suffix='.mpc'):
+    cachePath = Config.cachePath()
+    if cachePath is None:
+        return None
+    stat = sourcePath.stat()
+    return cachePath / 'templates' / ('%s-%d-%d%s' % (sourcePath.stem, stat.st_size, stat.st_mtime_ns, suffix))
+
+# Remove cached files made from older versions of a template
+def removeStaleTemplateCaches(sourcePath, cachedPath):
+    staleName = re.compile(r'%s-(\d+-\d+)\.' % re.escape(sourcePath.stem))
+    currentVersion = staleName.match(cachedPath.name).group(1)
+    for path in cachedPath.parent.iterdir():
+        match = staleName.match(path.name)
+        if match and match.group(1) != currentVersion:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+def buildTemplateCache(sourcePath, cachedPath):
+    cachedPath.parent.mkdir(parents=True, exist_ok=True)
+    tempPath = cachedPath.with_name('%s.%d.mpc' % (cachedPath.stem, os.getpid()))
+    with Image(filename=str(sourcePath)) as sourceImg:
+        sourceImg.save(filename=str(tempPath))
+    # Move the pixels before the header, so nobody can open a header without its pixels
+    os.replace(str(tempPath.with_suffix('.cache')), str(cachedPath.with_suffix('.cache')))
+    os.replace(str(tempPath), str(cachedPath))
+    removeStaleTemplateCaches(sourcePath, cachedPath)
+
+# Open the background image for a template. Drawing on it makes ImageMagick copy the pixels it was given, so the shared
+# cache itself is never written to
+def openTemplate(templateName):
+    sourcePath = Path('../res/%s.jpg' % templateName)
+    try:
+        cachedPath = cachedTemplatePath(sourcePath)
+        if cachedPath is not None:
+            if not cachedPath.exists():
+                buildTemplateCache(sourcePath, cachedPath)
+            return Image(filename=str(cachedPath))
+    except (OSError, WandException) as e:
+        logError('Unable to use cached template for %s: %s\n' % (templateName, e))
+    return Image(filename=str(sourcePath))
+
+# Templates can also be kept as a losslessly transcoded JPEG whose restart intervals are tiles of a few MCUs, along with
+# its quantisation tables in ImageMagick's format. Cards drawn on such a template are saved by encoding only the tiles that
+# were drawn on, and copying the compressed data of every other tile from the template. Transcoding takes a few seconds,
+# so these are only made by prepareTemplates.py and never while handling a request
+patchTileMCUs = 16
+patchableTemplates = {}
+
+def buildPatchableTemplate(sourcePath):
+    cachedPath = cachedTemplatePath(sourcePath, '.rst.jpg')
+    sourceData = sourcePath.read_bytes()
+    data = jpegPatch.transcode(sourceData, jpegPatch.tileMCUs(jpegPatch.JpegStream(sourceData).frame, patchTileMCUs))
+    patchable = jpegPatch.PatchableJpeg(data)
+    cachedPath.parent.mkdir(parents=True, exist_ok=True)
+    for (path, content) in [(cachedPath.with_suffix('.xml'), patchable.quantTableXml().encode()), (cachedPath, data)]:
+        tempPath = path.with_name('%s.%d%s' % (path.name, os.getpid(), '.tmp'))
+        tempPath.write_bytes(content)
+        os.replace(str(tempPath), str(path))
+    removeStaleTemplateCaches(sourcePath, cachedPath)
+
+# The patchable version of a template, or None if it hasn't been prepared
+def patchableTemplate(templateName):
+    sourcePath = Path('../res/%s.jpg' % templateName)
+    try:
+        cachedPath = cachedTemplatePath(sourcePath, '.rst.jpg')
+        if cachedPath is None:
+            return None
+        patchable = patchableTemplates.get(cachedPath)
+        if patchable is None and cachedPath.exists():
+            patchable = jpegPatch.PatchableJpeg(cachedPath.read_bytes())
+            patchable.quantTablePath = cachedPath.with_suffix('.xml')
+            patchableTemplates[cachedPath] = patchable
+        return patchable
+    except (OSError, jpegPatch.UnsupportedJpeg) as e:
+        logError('Unable to use patchable template for %s: %s\n' % (templateName, e))
+        return None
+
+# Encode one tile of a drawn card on its own, returning its entropy-coded data. The image may be a strip of the card
+# starting at the given row
+def encodeTile(img, patchable, index, imgTop=0):
+    (left, top, width, height) = patchable.tileRect(index)
+    with img[left:left + width, top - imgTop:top - imgTop + height] as tile:
+        tile.format = 'jpeg'
+        # The tables are used as given at quality 50
+        tile.compression_quality = 50
+        tile.options['jpeg:q-table'] = str(patchable.quantTablePath)
+        tile.options['jpeg:sampling-factor'] = patchable.samplingFactors()
+        tile.options['jpeg:optimize-coding'] = 'false'
+        # Stop tiles without colour being written as greyscale
+        library.MagickSetType(tile.wand, IMAGE_TYPES.index('truecolor'))
+        return patchable.tileData(tile.make_blob())
+
+# Save a card drawn on a template. Boxes are the (left, top, width, height) areas that were drawn on
+def saveCardImage(img, templateName, boxes, filePath):
+    patchable = patchableTemplate(templateName)
+    if patchable is not None and img.size == (patchable.frame.width, patchable.frame.height):
+        try:
+            replacements = {}
+            for index in patchable.tilesTouching(boxes):
+                replacements[index] = encodeTile(img, patchable, index)
+            filePath.write_bytes(patchable.patched(replacements))
+            return
+        except (jpegPatch.UnsupportedJpeg, WandException) as e:
+            logError('Unable to patch %s, saving it in full: %s\n' % (filePath.name, e))
+    img.save(filename=str(filePath))
+
+# Smaller copies of JPEG cards, for screens that don't need every pixel, from EDREFCARD_CARD_WIDTHS. These are saved
+# as progressive JPEGs and in each of the formats in EDREFCARD_CARD_FORMATS, which can be avif and webp, offered to
+# browsers in that order. The full size card is left as it is, as the one to print
+cardFormatOptions = {
+    'jpg': ('jpeg', 82, {'jpeg:sampling-factor': '2x2,1x1,1x1'}),
+    'avif': ('avif', 60, {'heic:speed': '6'}),
+    'webp': ('webp', 80, {'webp:method': '4'}),
+}
+
+def cardWidths():
+    try:
+        return sorted({int(width) for width in os.environ.get('EDREFCARD_CARD_WIDTHS', '1920,960').split(',') if width.strip()}, reverse=True)
+    except ValueError:
+        return []
+
+def cardFormats():
+    formats = [cardFormat.strip() for cardFormat in os.environ.get('EDREFCARD_CARD_FORMATS', 'webp').split(',')]
+    return ['jpg'] + [cardFormat for cardFormat in cardFormatOptions if cardFormat != 'jpg' and cardFormat in formats]
+
+def cardVariantPath(filePath, width, cardFormat):
+    return filePath.with_name('%s-%d.%s' % (filePath.stem, width, cardFormat))
+
+# Write the smaller copies of a card that are missing. The card is decoded once, and each size is scaled down from the
+# one before it. Copies of identical cards are shared through the render cache, by a hash of the card
+def saveCardVariants(filePath):
+    variants = [(width, cardFormat) for width in cardWidths() for cardFormat in cardFormats() if not cardVariantPath(filePath, width, cardFormat).exists()]
+    if not variants:
+        return
+    try:
+        key = renderCacheKey('Variants', hashlib.sha256(filePath.read_bytes()).hexdigest())
+        if key is not None and cachedRender(key) is not None:
+            variants = [(width, cardFormat) for (width, cardFormat) in variants if not renderCachePath(key, '-%d.%s' % (width, cardFormat)).exists()
+                or not linkCachedCard(key, '-%d.%s' % (width, cardFormat), cardVariantPath(filePath, width, cardFormat))]
+        if not variants:
+            return
+        if key is not None:
+            renderCachePath(key, '.info').parent.mkdir(parents=True, exist_ok=True)
+        with Image(filename=str(filePath)) as img:
+            img.strip()
+            for width in sorted({width for (width, cardFormat) in variants}, reverse=True):
+                # Cards are never scaled up
+                if width >= img.width:
+                    continue
+                img.resize(width, int(round(img.height * width / img.width)))
+                for cardFormat in [cardFormat for (variantWidth, cardFormat) in variants if variantWidth == width]:
+                    (imageFormat, quality, options) = cardFormatOptions[cardFormat]
+                    variantPath = cardVariantPath(filePath, width, cardFormat)
+                    with img.clone() as variant:
+                        variant.format = imageFormat
+                        variant.compression_quality = quality
+                        if cardFormat == 'jpg':
+                            variant.interlace_scheme = 'plane'
+                        for name, value in options.items():
+                            variant.options[name] = value
+                        tempPath = temporaryPath(variantPath)
+                        variant.save(filename=str(tempPath))
+                    if key is not None:
+                        linkFile(tempPath, renderCachePath(key, '-%d.%s' % (width, cardFormat)))
+                    os.replace(str(tempPath), str(variantPath))
+        if key is not None:
+            saveCachedRender(key, {})
+    except (OSError, WandException) as e:
+        logError('Unable to save smaller copies of %s: %s\n' % (filePath.name, e))
+
+# The area covered by a piece of text drawn with its baseline starting at (x, y), with a margin for antialiasing and
+# glyphs that overhang their advance
+def textBox(context, img, font, fontSize, x, y, text):
+    metrics = fontMetricsCache.measure(font, fontSize, text, context, img)
+    margin = int(fontSize / 2) + 2
+    top = y - max(metrics.ascender, fontSize)
+    return (int(x - margin), int(top - margin), int(metrics.text_width + 2 * margin), int(y - top + fontSize / 2 + 2 * margin))
+
+# Weights of the Exo 2 font faces, by the name used in their file names
+fontWeights = {'Thin': 100, 'ExtraLight': 200, 'Light': 300, 'Regular': 400, 'Medium': 500, 'SemiBold': 600, 'Bold': 700, 'ExtraBold': 800, 'Black': 900}
+
+# CSS weight and style of one of our font files
+def fontWeightAndStyle(fontPath):
+    name = Path(fontPath).stem.split('-', 1)[1]
+    style = 'normal'
+    if name.endswith('Italic'):
+        style = 'italic'
+        name = name[:-len('Italic')]
+    return (fontWeights.get(name or 'Regular', 400), style)
+
+def svgColor(color):
+    return '#%02x%02x%02x' % (color.red_int8, color.green_int8, color.blue_int8)
+
+# Stands in for a wand Drawing, recording text and rectangles as SVG elements rather than drawing them. A card drawn on
+# this is saved as an SVG which places the texts over the template image, so no raster work is done for it at all
+class SVGDrawing:
+    stateNames = ['font', 'font_size', 'font_style', 'fill_color', 'fill_opacity', 'stroke_color', 'stroke_width', 'text_antialias']
+
+    def __init__(self):
+        self.font = getFontPath('Regular', 'Normal')
+        self.font_size = 12
+        self.font_style = 'normal'
+        self.fill_color = Color('Black')
+        self.fill_opacity = 1
+        self.stroke_color = None
+        self.stroke_width = 1
+        self.text_antialias = True
+        self.states = []
+        self.elements = []
+        self.fonts = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def push(self):
+        self.states.append({name: getattr(self, name) for name in SVGDrawing.stateNames})
+
+    def pop(self):
+        for name, value in self.states.pop().items():
+            setattr(self, name, value)
+
+    def paint(self):
+        if self.fill_opacity == 0:
+            paint = 'fill="none"'
+        else:
+            paint = 'fill="%s"' % svgColor(self.fill_color)
+            if self.fill_opacity != 1:
+                paint = paint + ' fill-opacity="%s"' % self.fill_opacity
+        if self.stroke_color is not None and self.stroke_width > 0:
+            paint = paint + ' stroke="%s" stroke-width="%s"' % (svgColor(self.stroke_color), self.stroke_width)
+        return paint
+
+    def text(self, x, y, body):
+        self.fonts.add(self.font)
+        (weight, style) = fontWeightAndStyle(self.font)
+        self.elements.append('<text x="%s" y="%s" font-size="%s" font-weight="%d" font-style="%s" %s>%s</text>' % (x, y, self.font_size, weight, style, self.paint(), html.escape(body)))
+
+    def rectangle(self, left, top, width, height, radius=0):
+        self.elements.append('<rect x="%s" y="%s" width="%s" height="%s" rx="%s" %s/>' % (left, top, width, height, radius, self.paint()))
+
+    # What has been drawn, as plain data that can be cached and added to another drawing
+    def recorded(self):
+        return (list(self.elements), sorted(self.fonts))
+
+    def extend(self, recording):
+        (elements, fonts) = recording
+        self.elements.extend(elements)
+        self.fonts.update(fonts)
+
+    # Only used when text can't be measured from the font tables
+    def get_font_metrics(self, img, text, multiline=False):
+        with Drawing() as drawing:
+            with Image(width=1, height=1) as scratchImg:
+                drawing.font = self.font
+                drawing.font_size = self.font_size
+                return drawing.get_font_metrics(scratchImg, text, multiline=multiline)
+
+    # Write the SVG. Cards are served from configs/xx/, so the template image and fonts are referred to relative to that
+    def save(self, filePath, templateName):
+        (width, height) = jpegPatch.frameSize(Path('../res/%s.jpg' % templateName).read_bytes())
+        lines = [
+            '<?xml version="1.0" encoding="UTF-8"?>',
+            '<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" width="%d" height="%d" viewBox="0 0 %d %d">' % (width, height, width, height),
+            '<style>',
+        ]
+        for font in sorted(self.fonts):
+            (weight, style) = fontWeightAndStyle(font)
+            lines.append('@font-face { font-family: "Exo 2"; src: url("../../fonts/%s"); font-weight: %d; font-style: %s; }' % (Path(font).name, weight, style))
+        # Texts were laid out without kerning
+        lines.append('text { font-family: "Exo 2", sans-serif; font-kerning: none; white-space: pre; }')
+        lines.append('</style>')
+        lines.append('<image x="0" y="0" width="%d" height="%d" xlink:href="../../res/%s.jpg"/>' % (width, height, templateName))
+        lines.extend(self.elements)
+        lines.append('</svg>')
+        with codecs.open(str(filePath), 'w', 'utf-8') as svgFile:
+            svgFile.write('\n'.join(lines) + '\n')
+
+# The URL shown on a card, which is the only part of it that depends on the run
+def cardURL(config, public):
+    return config.refcardURL() if public else Config.webRoot()
+
+# Returns the area the URL covers
+def writeUrlToDrawing(config, drawing, public, img=None):
+    url = cardURL(config, public)
     drawing.push()
     drawing.font = getFontPath('SemiBold', 'Normal')
     drawing.font_size = 72
     drawing.text(x=23, y=252, body=url)
     drawing.pop()
+    if img is not None:
+        return textBox(drawing, img, getFontPath('SemiBold', 'Normal'), 72, 23, 252, url)
+
+# Rendered cards are also kept in EDREFCARD_CACHE_DIR, keyed by a hash of everything that is drawn on them: the bindings
+# for the device, the options, the template and the code that draws them. Identical cards from different runs are then
+# hard links to the same file. Public cards show their own URL, so for those only the body is cached and the URL is
+# stamped on to a copy of it, by encoding just the tiles it covers
+codeVersions = {}
+
+# Hash of some of our modules, so that changing any of them invalidates what was made by them
+def codeVersion(modules):
+    if modules not in codeVersions:
+        digest = hashlib.sha256()
+        for module in modules:
+            digest.update((Path(__file__).parent / module).read_bytes())
+        codeVersions[modules] = digest.hexdigest()
+    return codeVersions[modules]
+
+# Hash of the modules that decide how a card looks
+def renderCodeVersion():
+    return codeVersion(('bindings.py', 'bindingsData.py', 'fontMetrics.py', 'jpegPatch.py'))
+
+# The key for a rendered card, or None if there is no cache. Everything in the parts is plain data, so its repr is the
+# same in every process; dicts are kept in order, as that is the order things are drawn in
+def renderCacheKey(*parts):
+    if Config.cachePath() is None:
+        return None
+    digest = hashlib.sha256(renderCodeVersion().encode())
+    digest.update(repr(parts).encode('utf-8'))
+    return digest.hexdigest()
+
+def templateVersion(source):
+    stat = Path('../res/%s.jpg' % source).stat()
+    return (stat.st_size, stat.st_mtime_ns)
+
+# A card's fingerprint: a hash of what is drawn on it from the bindings, being the names of the controls on each of its
+# keys and the modifiers shown with them. It only changes when its own devices' bindings do, so that when a configuration
+# is uploaded again with some devices changed, the cards for the others are found in the cache
+def bindingsFingerprint(parts):
+    return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+
+def hotasFingerprint(physicalKeys, modifiers, imageDevices, deviceIndex):
+    modifierIndex = ModifierIndex(modifiers)
+    keys = []
+    for keyId, physicalKey in physicalKeys.items():
+        if physicalKey.device not in imageDevices or int(physicalKey.deviceIndex) != deviceIndex:
+            continue
+        binds = [(0, list(physicalKey.binds.get('Unmodified', {})))]
+        binds.extend((modifierNum, list(boundControls)) for (modifierNum, boundControls) in modifierIndex.modifiedBinds(physicalKey))
+        keys.append((keyId, modifierIndex.numbersOnKey(keyId, physicalKey), binds))
+    # Modifiers are also shown on keys of their own
+    keyModifiers = []
+    for modifierSpec, specModifiers in modifiers.items():
+        if '/' in modifierSpec:
+            continue
+        deviceModifiers = [(keyModifier.get('Device'), keyModifier.get('Key'), keyModifier.get('Number')) for keyModifier in specModifiers
+            if keyModifier.get('Device') in imageDevices and int(keyModifier.get('DeviceIndex')) == deviceIndex]
+        if deviceModifiers:
+            keyModifiers.append((modifierSpec, deviceModifiers))
+    return bindingsFingerprint((keys, keyModifiers))
+
+def keyboardFingerprint(physicalKeys, modifiers, imageDevices):
+    modifierIndex = ModifierIndex(modifiers)
+    keys = []
+    for keyId, physicalKey in physicalKeys.items():
+        if physicalKey.device not in imageDevices:
+            continue
+        binds = [(modifierIndex.memberKeys.get(modifier, []) if modifier != 'Unmodified' else [], list(boundControls)) for modifier, boundControls in physicalKey.binds.items()]
+        keys.append((keyId, binds))
+    return bindingsFingerprint(keys)
+
+def hotasCardKey(physicalKeys, modifiers, source, imageDevices, biggestFontSize, styling, deviceIndex, *extra):
+    if Config.cachePath() is None:
+        return None
+    fingerprint = hotasFingerprint(physicalKeys, modifiers, imageDevices, deviceIndex)
+    return renderCacheKey('HOTAS', source, templateVersion(source), imageDevices, biggestFontSize, styling, deviceIndex, fingerprint, extra)
+
+def keyboardCardKey(physicalKeys, modifiers, source, imageDevices, biggestFontSize, displayGroups, *extra):
+    if Config.cachePath() is None:
+        return None
+    fingerprint = keyboardFingerprint(physicalKeys, modifiers, imageDevices)
+    return renderCacheKey('Keyboard', source, templateVersion(source), imageDevices, biggestFontSize, displayGroups, fingerprint, extra)
+
+def renderCachePath(key, suffix):
+    return Config.cachePath() / 'cards' / key[:2] / (key + suffix)
+
+# The information saved with a cached card, as JSON, or None if it isn't cached. Using an entry marks it as recently
+# used, so purgeConfigGraphics.sh can remove the ones that aren't
+def cachedRender(key):
+    path = renderCachePath(key, '.info')
+    try:
+        info = json.loads(path.read_bytes())
+        os.utime(str(path))
+        return info
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logError('Unable to use cached card %s: %s\n' % (key, e))
+        return None
+
+# Hard link a file to a new path, or copy it if that isn't possible, replacing anything already there
+def linkFile(sourcePath, filePath):
+    tempPath = temporaryPath(filePath)
+    try:
+        os.link(str(sourcePath), str(tempPath))
+    except OSError:
+        shutil.copyfile(str(sourcePath), str(tempPath))
+    os.replace(str(tempPath), str(filePath))
+
+# Cache a card's information, along with the card itself if given. The information is written last, as it is what marks
+# the entry as complete
+def saveCachedRender(key, info, cardPath=None):
+    path = renderCachePath(key, '.info')
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if cardPath is not None:
+            linkFile(cardPath, renderCachePath(key, cardPath.suffix))
+        tempPath = temporaryPath(path)
+        tempPath.write_text(json.dumps(info), encoding='utf-8')
+        os.replace(str(tempPath), str(path))
+    except OSError as e:
+        logError('Unable to cache card %s: %s\n' % (key, e))
+
+def linkCachedCard(key, suffix, filePath):
+    try:
+        linkFile(renderCachePath(key, suffix), filePath)
+        return True
+    except OSError as e:
+        logError('Unable to use cached card %s: %s\n' % (key, e))
+        return False
+
+# Save a public card by drawing its URL on to the tiles of a cached body that it covers. Only a strip of the template as
+# tall as those tiles is drawn on. Returns False if the card has to be drawn in full instead: when the template isn't
+# patchable, or the URL shares a tile with the body's own drawing
+def stampCard(bodyPath, source, config, public, boxes, filePath):
+    patchable = patchableTemplate(source)
+    if patchable is None:
+        return False
+    try:
+        body = jpegPatch.PatchableJpeg(bodyPath.read_bytes())
+        with openTemplate(source) as sourceImg:
+            with Drawing() as context:
+                urlBox = textBox(context, sourceImg, getFontPath('SemiBold', 'Normal'), 72, 23, 252, cardURL(config, public))
+            tiles = patchable.tilesTouching([urlBox])
+            if set(tiles) & set(patchable.tilesTouching(boxes)) or len(body.tiles) != len(patchable.tiles):
+                return False
+            rects = [patchable.tileRect(index) for index in tiles]
+            top = min(rect[1] for rect in rects)
+            bottom = max(rect[1] + rect[3] for rect in rects)
+            with sourceImg[0:sourceImg.width, top:bottom] as strip:
+                with Drawing() as context:
+                    context.translate(0, -top)
+                    writeUrlToDrawing(config, context, public)
+                    context.draw(strip)
+                replacements = {index: encodeTile(strip, patchable, index, top) for index in tiles}
+        tempPath = temporaryPath(filePath)
+        tempPath.write_bytes(body.patched(replacements))
+        os.replace(str(tempPath), str(filePath))
+        return True
+    except (OSError, jpegPatch.UnsupportedJpeg, WandException) as e:
+        logError('Unable to stamp %s, drawing it in full: %s\n' % (filePath.name, e))
+        return False
+
+# Save an SVG card from a drawing of its body, with the URL first as it would have been drawn
+def saveSVGCard(body, config, public, source, filePath):
+    with SVGDrawing() as context:
+        writeUrlToDrawing(config, context, public)
+        context.extend(body.recorded())
+        tempPath = temporaryPath(filePath)
+        context.save(tempPath, source)
+        os.replace(str(tempPath), str(filePath))
 
 # Create a keyboard image from the template plus bindings
 def createKeyboardImage(physicalKeys, modifiers, source, imageDevices, biggestFontSize, displayGroups, runId, public):
@@ -215,90 +863,119 @@ def createKeyboardImage(physicalKeys, modifiers, source, imageDevices, biggestFo
     filePath = config.pathWithNameAndSuffix(source, '.jpg')
 
     # See if it already exists or if we need to recreate it
-    if filePath.exists():
-        return True
-    with Image(filename='../res/' + source + '.jpg') as sourceImg:
+    if not filePath.exists():
+        saveKeyboardImage(filePath, physicalKeys, modifiers, source, imageDevices, biggestFontSize, displayGroups, config, public)
+    saveCardVariants(filePath)
+
+def saveKeyboardImage(filePath, physicalKeys, modifiers, source, imageDevices, biggestFontSize, displayGroups, config, public):
+    # Only private keyboard cards are cached, as the keyboard template is never patchable to stamp a URL on to
+    key = None
+    if not public:
+        key = keyboardCardKey(physicalKeys, modifiers, source, imageDevices, biggestFontSize, displayGroups, '.jpg', cardURL(config, public))
+        if key is not None and cachedRender(key) is not None and linkCachedCard(key, '.jpg', filePath):
+            return
+    with openTemplate(source) as sourceImg:
         with Drawing() as context:
+            writeUrlToDrawing(config, context, public, sourceImg)
+            drawKeyboardImage(context, sourceImg, physicalKeys, modifiers, imageDevices, biggestFontSize, displayGroups)
+            context.draw(sourceImg)
+            tempPath = temporaryPath(filePath)
+            sourceImg.save(filename=str(tempPath))
+            if key is not None:
+                saveCachedRender(key, {}, tempPath)
+            os.replace(str(tempPath), str(filePath))
+
+# As createKeyboardImage, but as an SVG card
+def createKeyboardSVG(physicalKeys, modifiers, source, imageDevices, biggestFontSize, displayGroups, runId, public):
+    config = Config(runId)
+    filePath = config.pathWithNameAndSuffix(source, '.svg')
+    if filePath.exists():
+        return
+    key = keyboardCardKey(physicalKeys, modifiers, source, imageDevices, biggestFontSize, displayGroups, '.svg')
+    with SVGDrawing() as body:
+        cached = cachedRender(key) if key is not None else None
+        if cached is not None:
+            body.extend(cached['drawing'])
+        else:
+            drawKeyboardImage(body, None, physicalKeys, modifiers, imageDevices, biggestFontSize, displayGroups)
+            if key is not None:
+                saveCachedRender(key, {'drawing': body.recorded()})
+        saveSVGCard(body, config, public, source, filePath)
+
+# Draw the bindings for the keyboard on to a drawing context, other than the URL
+def drawKeyboardImage(context, sourceImg, physicalKeys, modifiers, imageDevices, biggestFontSize, displayGroups):
+    # Defaults for the font
+    context.font = getFontPath('Regular', 'Normal')
+    context.text_antialias = True
+    context.font_style = 'normal'
+    context.stroke_width = 0
+    context.fill_color = Color('Black')
+    context.fill_opacity = 1
+
+    modifierIndex = ModifierIndex(modifiers)
+    outputs = {}
+    for group in displayGroups:
+        outputs[group] = {}
+
+    # Find the correct bindings and order them appropriately
+    for physicalKey in physicalKeys.values():
+        itemDevice = physicalKey.device
+        itemKey = physicalKey.key
+
+        # Only show it if we are handling the appropriate image at this time
+        if itemDevice not in imageDevices:
+            continue
 
-            # Defaults for the font
-            context.font = getFontPath('Regular', 'Normal')
-            context.text_antialias = True
-            context.font_style = 'normal'
-            context.stroke_width = 0
-            context.fill_color = Color('Black')
-            context.fill_opacity = 1
-
-            # Add the ID to the title
-            writeUrlToDrawing(config, context, public)
-
-            outputs = {}
-            for group in displayGroups:
-                outputs[group] = {}
-
-            # Find the correct bindings and order them appropriately
-            for physicalKeySpec, physicalKey in physicalKeys.items():
-                itemDevice = physicalKey.get('Device')
-                itemKey = physicalKey.get('Key')
-
-                # Only show it if we are handling the appropriate image at this time
-                if itemDevice not in imageDevices:
-                    continue
-
-                for modifier, bind in physicalKey.get('Binds').items():
-                    for controlKey, control in bind.get('Controls').items():
-                        bind = {}
-                        bind['Control'] = control
-                        bind['Key'] = itemKey
-                        bind['Modifiers'] = []
-
-                        if modifier != 'Unmodified':
-                            for modifierKey, modifierControls in modifiers.items():
-                                for modifierControl in modifierControls:
-                                    if modifierControl.get('ModifierKey') == modifier and modifierControl.get('Key') is not None:
-                                        bind['Modifiers'].append(modifierControl.get('Key'))
-
-                        outputs[control['Group']][control['Name']] = bind
-
-            # Set up a screen state to handle output
-            screenState = {}
-            screenState['baseX'] = 60
-            screenState['baseY'] = 320
-            screenState['maxWidth'] = 0
-            screenState['thisWidth'] = 0
-            screenState['currentX'] = screenState['baseX']
-            screenState['currentY'] = screenState['baseY']
-
-            font = Font(getFontPath('Regular', 'Normal'), antialias=True, size=biggestFontSize)
-            groupTitleFont = Font(getFontPath('Regular', 'Normal'), antialias=True, size=biggestFontSize*2)
-            context.stroke_width=2
-            context.stroke_color=Color('Black')
-            context.fill_opacity=0
-
-            # Go through once for each display group
-            for displayGroup in displayGroups:
-                if outputs[displayGroup] == {}:
-                    continue
+        for modifier, boundControls in physicalKey.binds.items():
+            for controlKey, control in boundControls.items():
+                bind = {}
+                bind['Control'] = control
+                bind['Key'] = itemKey
+                bind['Modifiers'] = []
+
+                if modifier != 'Unmodified':
+                    bind['Modifiers'].extend(modifierIndex.memberKeys.get(modifier, []))
+
+                outputs[control['Group']][control['Name']] = bind
+
+    # Set up a screen state to handle output
+    screenState = {}
+    screenState['baseX'] = 60
+    screenState['baseY'] = 320
+    screenState['maxWidth'] = 0
+    screenState['thisWidth'] = 0
+    screenState['currentX'] = screenState['baseX']
+    screenState['currentY'] = screenState['baseY']
+
+    font = Font(getFontPath('Regular', 'Normal'), antialias=True, size=biggestFontSize)
+    groupTitleFont = Font(getFontPath('Regular', 'Normal'), antialias=True, size=biggestFontSize*2)
+    context.stroke_width=2
+    context.stroke_color=Color('Black')
+    context.fill_opacity=0
+
+    # Go through once for each display group
+    for displayGroup in displayGroups:
+        if outputs[displayGroup] == {}:
+            continue
 
-                writeText(context, sourceImg, displayGroup, screenState, groupTitleFont, False, True)
+        writeText(context, sourceImg, displayGroup, screenState, groupTitleFont, False, True)
 
-                orderedOutputs = OrderedDict(sorted(outputs[displayGroup].items(), key=lambda x: x[1].get('Control').get('Order')))
-                for bindKey, bind in orderedOutputs.items():
-                    for modifier in bind.get('Modifiers', []):
-                        writeText(context, sourceImg, transKey(modifier), screenState, font, True, False)
-                    writeText(context, sourceImg, transKey(bind.get('Key')), screenState, font, True, False)
-                    writeText(context, sourceImg, bind.get('Control').get('Name'), screenState, font, False, True)
+        orderedOutputs = OrderedDict(sorted(outputs[displayGroup].items(), key=lambda x: x[1].get('Control').get('Order')))
+        for bindKey, bind in orderedOutputs.items():
+            for modifier in bind.get('Modifiers', []):
+                writeText(context, sourceImg, transKey(modifier), screenState, font, True, False)
+            writeText(context, sourceImg, transKey(bind.get('Key')), screenState, font, True, False)
+            writeText(context, sourceImg, bind.get('Control').get('Name'), screenState, font, False, True)
 
-            context.draw(sourceImg)
-            sourceImg.save(filename=str(filePath))
-    return True
 
-def appendKeyboardImage(createdImages, physicalKeys, modifiers, displayGroups, runId, public):
+# The render job for the keyboard card
+def keyboardJob(physicalKeys, modifiers, displayGroups, runId, public, cardFormat='jpg'):
     def countKeyboardItems(physicalKeys):
         keyboardItems = 0
         for  physicalKey in physicalKeys.values():
-            if physicalKey.get('Device') == 'Keyboard':
-                for bind in physicalKey.get('Binds').values():
-                    keyboardItems = keyboardItems + len(bind.get('Controls'))
+            if physicalKey.device == 'Keyboard':
+                for boundControls in physicalKey.binds.values():
+                    keyboardItems = keyboardItems + len(boundControls)
         return keyboardItems
     
     def fontSizeForKeyBoardItems(physicalKeys):
@@ -312,8 +989,8 @@ def appendKeyboardImage(createdImages, physicalKeys, modifiers, displayGroups, r
         return fontSize
     
     fontSize = fontSizeForKeyBoardItems(physicalKeys)
-    createKeyboardImage(physicalKeys, modifiers, 'keyboard', ['Keyboard'], fontSize, displayGroups, runId, public)
-    createdImages.append('Keyboard')
+    createCard = createKeyboardSVG if cardFormat == 'svg' else createKeyboardImage
+    return (createCard, (physicalKeys, modifiers, 'keyboard', ['Keyboard'], fontSize, displayGroups, runId, public))
 
 # Write text, possible wrapping
 def writeText(context, img, text, screenState, font, surround, newLine):
@@ -332,7 +1009,7 @@ def writeText(context, img, text, screenState, font, surround, newLine):
         text = 'invalid'
         context.fill_color=Color('Red')
 
-    metrics = context.get_font_metrics(img, text, multiline=False)
+    metrics = fontMetricsCache.metrics(context, img, text)
     if screenState['currentY'] + int(metrics.text_height + 32) > 2160:
         # Gone off the bottom of the page; go to next column
         screenState['currentY'] = screenState['baseY']
@@ -372,7 +1049,7 @@ def createBlockImage(supportedDeviceKey, strokeColor='Red', fillColor='LightGree
     config.makeDir()
     filePath = config.pathWithSuffix('.jpg')
     
-    with Image(filename='../res/' + supportedDevice['Template'] + '.jpg') as sourceImg:
+    with openTemplate(supportedDevice['Template']) as sourceImg:
         with Drawing() as context:
             if not dryRun:        
                 context.font = getFontPath('Regular', 'Normal')
@@ -402,298 +1079,554 @@ def createBlockImage(supportedDeviceKey, strokeColor='Red', fillColor='LightGree
                 context.draw(sourceImg)
                 sourceImg.save(filename=str(filePath))
 
-# Return whether a binding is a redundant specialisation and thus can be hidden
-def isRedundantSpecialisation(control, bind):
+# Add a control to the misconfiguration warnings
+def addMisconfigurationWarning(misconfigurationWarnings, controlName):
+    if misconfigurationWarnings == '':
+        return '<h1>Misconfiguration detected</h1>You have one or more analogue controls configured incorrectly. Please see <a href="https://forums.frontier.co.uk/showthread.php?t=209792">this thread</a> for details of the problem and how to correct it.<br/> <b>Your misconfigured controls:</b> <b>%s</b> ' % controlName
+    else:
+        return '%s, <b>%s</b>' % (misconfigurationWarnings, controlName)
+
+# Number of processes to render device images with, from EDREFCARD_RENDER_WORKERS
+def renderWorkers():
+    try:
+        return max(int(os.environ.get('EDREFCARD_RENDER_WORKERS', min(os.cpu_count() or 1, 4))), 1)
+    except ValueError:
+        return 1
+
+# Run a render job in a worker process, returning its result along with the text it measured
+def runRenderJob(render, args):
+    measuredCount = len(fontMetricsCache.measured)
+    result = render(*args)
+    return (result, fontMetricsCache.measuredSince(measuredCount))
+
+# Run a list of (function, args) render jobs, returning their results in the same order.
+# Jobs run in a pool of worker processes so that the page waits for the slowest image rather than the sum of them all.
+# The text they measure is added to this process's font metrics cache, so that it can be saved
+def renderImages(renderJobs):
+    workers = min(renderWorkers(), len(renderJobs))
+    if workers <= 1:
+        return [render(*args) for (render, args) in renderJobs]
+    # Forking shares what we have already loaded, such as the font metrics, with the workers
+    try:
+        context = multiprocessing.get_context('fork')
+    except ValueError: # pragma: no cover
+        context = multiprocessing.get_context()
+    with context.Pool(workers) as pool:
+        results = [pool.apply_async(runRenderJob, job) for job in renderJobs]
+        results = [result.get() for result in results]
+    for (result, measuredEntries) in results:
+        fontMetricsCache.merge(measuredEntries)
+    return [result for (result, measuredEntries) in results]
+
+# The supported devices, other than the keyboard, that have cards for a configuration's devices, as
+# (supported device key, device index) in the order they are shown
+def cardDevices(devices):
+    # The supported devices shown for the devices in this configuration, in the order of supportedDevices
+    handled = set()
+    for deviceKey, supportedDevice in devices.items():
+        (device, deviceIndex) = deviceKey.rsplit('::', 1)
+        if supportedDevice is None or deviceIndex not in ['0', '1']:
+            continue
+        for supportedDeviceKey in supportedDevicesByKeyDevice.get(device, []):
+            if supportedDeviceKey != 'Keyboard':
+                # We handle the keyboard separately below
+                handled.add((supportedDeviceOrder[supportedDeviceKey], int(deviceIndex), supportedDeviceKey))
+
+    cards = []
+    alreadyHandledDevices = set()
+    for (order, deviceIndex, supportedDeviceKey) in sorted(handled):
+        supportedDevice = supportedDevices[supportedDeviceKey]
+        # See if we have any new bindings for this device
+        hasNewBindings = False
+        for device in supportedDevice.get('KeyDevices', supportedDevice.get('HandledDevices')):
+            deviceKey = '%s::%s' % (device, deviceIndex)
+            if deviceKey not in alreadyHandledDevices:
+                hasNewBindings = True
+                break
+        if hasNewBindings is True:
+            cards.append((supportedDeviceKey, deviceIndex))
+            for handledDevice in supportedDevice['HandledDevices']:
+                alreadyHandledDevices.add('%s::%s' % (handledDevice, deviceIndex))
+    return cards
+
+# The cards to create for a configuration, as (created image, card name, render job) in the order they are shown
+def cardJobs(physicalKeys, modifiers, devices, displayGroups, config, public, styling, cardFormat):
+    createHOTASCard = createHOTASSVG if cardFormat == 'svg' else createHOTASImage
+    if not isinstance(physicalKeys, PhysicalKeys):
+        physicalKeys = PhysicalKeys(physicalKeys.items())
+    cards = []
+    for (supportedDeviceKey, deviceIndex) in cardDevices(devices):
+        supportedDevice = supportedDevices[supportedDeviceKey]
+        devicePhysicalKeys = physicalKeys.cardKeys(supportedDevice['HandledDevices'], deviceIndex)
+        job = (createHOTASCard, (devicePhysicalKeys, modifiers, supportedDevice['Template'], supportedDevice['HandledDevices'], 40, config, public, styling, deviceIndex))
+        cards.append(('%s::%s' % (supportedDeviceKey, deviceIndex), cardName(supportedDevice['Template'], deviceIndex), job))
+
+    if devices.get('Keyboard::0') is not None:
+        cards.append(('Keyboard', 'keyboard', keyboardJob(physicalKeys.cardKeys(['Keyboard']), modifiers, displayGroups, config.name, public, cardFormat)))
+    return cards
+
+# Whether cards are left to be rendered when they are first requested, from EDREFCARD_RENDER_ON_DEMAND. This needs the
+# web server to send requests for missing cards to this script, as in conf/apache/edrefcard.conf
+def renderOnDemand():
+    return os.environ.get('EDREFCARD_RENDER_ON_DEMAND', '') not in ('', '0')
+
+# Settings needed to render a configuration's cards later, kept as JSON. Unlike replay info these are kept for private
+# configurations
+def saveRenderSettings(config, displayGroups, styling, public):
+    renderSettings = {}
+    renderSettings['displayGroups'] = displayGroups
+    renderSettings['styling'] = styling
+    renderSettings['public'] = public
+    config.pathWithSuffix('.render').write_text(json.dumps(renderSettings), encoding='utf-8')
+
+def loadRenderSettings(config):
+    try:
+        data = config.pathWithSuffix('.render').read_bytes()
+        if data.startswith(b'{'):
+            return json.loads(data)
+        # Saved by an earlier version, which pickled them
+        return ReplayUnpickler(io.BytesIO(data)).load()
+    except FileNotFoundError:
+        pass
+    # Configurations published before rendering on demand only have their replay info
+    replayInfo = Config.loadReplay(config.pathWithSuffix('.replay'))
+    renderSettings = {}
+    renderSettings['displayGroups'] = replayInfo.get('displayGroups', ['Galaxy map', 'General', 'Head look', 'SRV', 'Ship', 'UI'])
+    renderSettings['styling'] = replayInfo.get('styling', 'None')
+    renderSettings['public'] = True
+    return renderSettings
+
+# A configuration's binds file never changes, so the result of parsing it is saved alongside it, for replays and cards
+# rendered on demand. It is saved with marshal as plain data, holding the names of controls and devices rather than
+# their entries in bindingsData, and is only used if it was saved by the same parser and data for the same display
+# groups. The problems found by lintBindings are saved with it. Otherwise the binds file is parsed again and the saved
+# parse replaced
+parsedBindingsFormat = 2
+
+def parsedBindingsVersion(displayGroups):
+    return (parsedBindingsFormat, __version__, codeVersion(('bindings.py', 'bindingsData.py')), list(displayGroups))
+
+def saveParsedBindings(config, displayGroups, parsedBindings, lint):
+    (physicalKeys, modifiers, devices) = parsedBindings
+    keys = [(keyId, physicalKey.deviceIndex, physicalKey.baseKey, [(modifiersKey, list(boundControls)) for modifiersKey, boundControls in physicalKey.binds.items()])
+        for keyId, physicalKey in physicalKeys.items()]
+    path = config.pathWithSuffix('.parsed')
+    try:
+        tempPath = temporaryPath(path)
+        tempPath.write_bytes(marshal.dumps((parsedBindingsVersion(displayGroups), keys, modifiers, list(devices), lint)))
+        os.replace(str(tempPath), str(path))
+    except (OSError, ValueError) as e:
+        logError('%s: Unable to save parsed bindings: %s\n' % (config.name, e))
+
+# The parsed bindings saved for a configuration and their lint, as (parsed bindings, lint), or None if there aren't any
+# that are current
+def loadParsedBindings(config, displayGroups):
+    try:
+        (version, keys, modifiers, deviceKeys, lint) = marshal.loads(config.pathWithSuffix('.parsed').read_bytes())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if version != parsedBindingsVersion(displayGroups):
+        return None
+    physicalKeys = PhysicalKeys()
+    for (keyId, deviceIndex, baseKey, binds) in keys:
+        physicalKey = PhysicalKey(keyId[0], deviceIndex, baseKey, keyId[2])
+        for (modifiersKey, controlNames) in binds:
+            physicalKey.binds[modifiersKey] = {controlName: controls.get(controlName) or unknownControl(controlName) for controlName in controlNames}
+        physicalKeys.add(keyId, physicalKey)
+    devices = {deviceKey: supportedDeviceFor(deviceKey.rsplit('::', 1)[0]) for deviceKey in deviceKeys}
+    return ((physicalKeys, modifiers, devices), lint)
+
+# Parse and lint the bindings of a saved configuration, returning (parsed bindings, lint). Uses the saved parse if it is
+# current, and saves it if not
+def parseConfigBindings(config, displayGroups, errors):
+    savedBindings = loadParsedBindings(config, displayGroups)
+    if savedBindings is not None:
+        return savedBindings
+    xml = config.pathWithSuffix('.binds').read_bytes()
+    parsedBindings = parseBindings(config.name, xml, displayGroups, errors)
+    lint = lintBindings(*parsedBindings)
+    if not errors.errors:
+        saveParsedBindings(config, displayGroups, parsedBindings, lint)
+    return (parsedBindings, lint)
+
+# Render a single card of a configuration, returning its path or None if the configuration doesn't have that card
+def renderCard(config, name, cardFormat):
+    filePath = config.pathWithNameAndSuffix(name, '.%s' % cardFormat)
+    # Smaller copies of a JPEG card are made along with it
+    variant = re.fullmatch(r'(.+)-(\d+)', name)
+    if variant is not None and int(variant.group(2)) in cardWidths() and cardFormat in cardFormats():
+        name = variant.group(1)
+        cardFormat = 'jpg'
+    elif cardFormat not in ['jpg', 'svg']:
+        return None
+    try:
+        renderSettings = loadRenderSettings(config)
+        displayGroups = renderSettings['displayGroups']
+        ((physicalKeys, modifiers, devices), lint) = parseConfigBindings(config, displayGroups, Errors())
+    except (FileNotFoundError, ValueError, pickle.UnpicklingError):
+        return None
+    for (createdImage, jobName, (function, args)) in cardJobs(physicalKeys, modifiers, devices, displayGroups, config, renderSettings['public'], renderSettings['styling'], cardFormat):
+        if jobName == name:
+            function(*args)
+            return filePath if filePath.exists() else None
+    return None
+
+cardContentTypes = {'jpg': 'image/jpeg', 'svg': 'image/svg+xml', 'webp': 'image/webp', 'avif': 'image/avif'}
+
+# Send a card, given its file name as <runId>-<card name>.<format>, rendering it if this is the first request for it
+def serveCard(fileName):
+    match = re.fullmatch(r'([a-z]{6})-([a-z0-9-]+)\.(jpg|svg|webp|avif)', fileName)
+    filePath = None
+    if match is not None:
+        (runId, name, cardFormat) = match.groups()
+        config = Config(runId)
+        filePath = config.pathWithNameAndSuffix(name, '.%s' % cardFormat)
+        if not filePath.exists():
+            filePath = renderCard(config, name, cardFormat)
+    if filePath is None:
+        print('Status: 404 Not Found\nContent-Type: text/plain\n\nNo such card')
+        return
+    print('Content-Type: %s\n' % cardContentTypes[cardFormat])
+    sys.stdout.flush()
+    sys.stdout.buffer.write(filePath.read_bytes())
+    sys.stdout.flush()
+
+# Return whether a control is a redundant specialisation of another of the controls bound alongside it, and thus can be
+# hidden
+def isRedundantAmong(control, boundControls):
     moreGeneralControls = control.get('HideIfSameAs')
     if len(moreGeneralControls) == 0:
         return False
-    for moreGeneralMatch in bind.get('Controls').keys():
+    for moreGeneralMatch in boundControls.keys():
         if moreGeneralMatch in moreGeneralControls:
             return True
     return False
 
-# Create a HOTAS image from the template plus bindings
-def createHOTASImage(physicalKeys, modifiers, source, imageDevices, biggestFontSize, config, public, styling, deviceIndex, misconfigurationWarnings):
-    # Set up the path for our file
-    runId = config.name
+# As isRedundantAmong, for a bind in the form of legacyBindings
+def isRedundantSpecialisation(control, bind):
+    return isRedundantAmong(control, bind.get('Controls'))
+
+# Check if this is a digital control on an analogue stick with an analogue equivalent
+def isMisconfigured(control, hotasDetail):
+    return control.get('Type') == 'Digital' and control.get('HasAnalogue') is True and hotasDetail.get('Type') == 'Analogue'
+
+# The names of the misconfigured controls on the card for some devices at a device index
+def findMisconfiguredControls(physicalKeys, imageDevices, deviceIndex):
+    misconfiguredControls = []
+    for physicalKey in physicalKeys.values():
+        if physicalKey.device not in imageDevices or int(physicalKey.deviceIndex) != deviceIndex:
+            continue
+        hotasDetail = hotasDetails.get(physicalKey.device, {}).get(physicalKey.key)
+        if hotasDetail is None:
+            continue
+        boundControls = physicalKey.binds.get('Unmodified')
+        if boundControls is None:
+            continue
+        for controlKey, control in boundControls.items():
+            if not isRedundantAmong(control, boundControls) and isMisconfigured(control, hotasDetail):
+                misconfiguredControls.append(control['Name'])
+    return misconfiguredControls
+
+# Cards are written under a temporary name and then moved in to place, as they may be served as soon as they exist
+def temporaryPath(filePath):
+    return filePath.with_name('%s.%d%s' % (filePath.stem, os.getpid(), filePath.suffix))
+
+# Name of the card for a device with a given template
+def cardName(source, deviceIndex):
     if deviceIndex == 0:
-        name = source
-    else:
-        name = '%s-%s' % (source, deviceIndex)
-    filePath = config.pathWithNameAndSuffix(name, '.jpg')
-    
+        return source
+    return '%s-%s' % (source, deviceIndex)
+
+# Create a HOTAS image from the template plus bindings
+def createHOTASImage(physicalKeys, modifiers, source, imageDevices, biggestFontSize, config, public, styling, deviceIndex):
+    filePath = config.pathWithNameAndSuffix(cardName(source, deviceIndex), '.jpg')
+
     # See if it already exists or if we need to recreate it
-    if filePath.exists():
-        return True
-    with Image(filename='../res/' + source + '.jpg') as sourceImg:
-        with Drawing() as context:
+    if not filePath.exists():
+        saveHOTASImage(filePath, physicalKeys, modifiers, source, imageDevices, biggestFontSize, config, public, styling, deviceIndex)
+    saveCardVariants(filePath)
+
+def saveHOTASImage(filePath, physicalKeys, modifiers, source, imageDevices, biggestFontSize, config, public, styling, deviceIndex):
+    # Private cards all show the same URL, so are cached whole. Public cards are cached without their URL, which is
+    # stamped on afterwards, provided the template is patchable
+    key = None
+    if not public:
+        key = hotasCardKey(physicalKeys, modifiers, source, imageDevices, biggestFontSize, styling, deviceIndex, '.jpg', cardURL(config, public))
+    elif patchableTemplate(source) is not None:
+        key = hotasCardKey(physicalKeys, modifiers, source, imageDevices, biggestFontSize, styling, deviceIndex, '.jpg')
+    cached = cachedRender(key) if key is not None else None
+    if cached is not None:
+        if not public and linkCachedCard(key, '.jpg', filePath):
+            return
+        # A body that a URL couldn't be stamped on to is recorded as such, so that it isn't tried for every card
+        if public and cached.get('stampable', True) and stampCard(renderCachePath(key, '.jpg'), source, config, public, cached['boxes'], filePath):
+            return
 
-            # Defaults for the font
-            context.font = getFontPath('Regular', 'Normal')
-            context.text_antialias = True
-            context.font_style = 'normal'
-            context.stroke_width = 0
-            context.fill_color = Color('Black')
-            context.fill_opacity = 1
+    # A public card's body is cached before its URL is drawn on, unless it already was
+    cacheBody = key is not None and public and cached is None
+    with openTemplate(source) as sourceImg:
+        with Drawing() as context:
+            urlBox = None if cacheBody else writeUrlToDrawing(config, context, public, sourceImg)
+            boxes = drawHOTASImage(context, sourceImg, physicalKeys, modifiers, imageDevices, biggestFontSize, config, styling, deviceIndex)
+            context.draw(sourceImg)
+        tempPath = temporaryPath(filePath)
+        if cacheBody:
+            saveCardImage(sourceImg, source, boxes, tempPath)
+            saveCachedRender(key, {'boxes': boxes}, tempPath)
+            # The cache may now share this file, so it mustn't be written to again
+            tempPath.unlink()
+            if stampCard(renderCachePath(key, '.jpg'), source, config, public, boxes, filePath):
+                return
+            saveCachedRender(key, {'boxes': boxes, 'stampable': False})
+            with Drawing() as context:
+                urlBox = writeUrlToDrawing(config, context, public, sourceImg)
+                context.draw(sourceImg)
+        saveCardImage(sourceImg, source, boxes + [urlBox], tempPath)
+        if key is not None and not public:
+            saveCachedRender(key, {}, tempPath)
+        os.replace(str(tempPath), str(filePath))
+
+# As createHOTASImage, but as an SVG card
+def createHOTASSVG(physicalKeys, modifiers, source, imageDevices, biggestFontSize, config, public, styling, deviceIndex):
+    filePath = config.pathWithNameAndSuffix(cardName(source, deviceIndex), '.svg')
+    if filePath.exists():
+        return
+    key = hotasCardKey(physicalKeys, modifiers, source, imageDevices, biggestFontSize, styling, deviceIndex, '.svg')
+    with SVGDrawing() as body:
+        cached = cachedRender(key) if key is not None else None
+        if cached is not None:
+            body.extend(cached['drawing'])
+        else:
+            drawHOTASImage(body, None, physicalKeys, modifiers, imageDevices, biggestFontSize, config, styling, deviceIndex)
+            if key is not None:
+                saveCachedRender(key, {'drawing': body.recorded()})
+        saveSVGCard(body, config, public, source, filePath)
+
+# Draw the bindings for a HOTAS on to a drawing context, other than the URL.
+# Returns the areas that were drawn on
+def drawHOTASImage(context, sourceImg, physicalKeys, modifiers, imageDevices, biggestFontSize, config, styling, deviceIndex):
+    runId = config.name
 
-            # Add the ID to the title
-            writeUrlToDrawing(config, context, public)
+    # Defaults for the font
+    context.font = getFontPath('Regular', 'Normal')
+    context.text_antialias = True
+    context.font_style = 'normal'
+    context.stroke_width = 0
+    context.fill_color = Color('Black')
+    context.fill_opacity = 1
 
-            for physicalKeySpec, physicalKey in physicalKeys.items():
-                itemDevice = physicalKey.get('Device')
-                itemDeviceIndex = int(physicalKey.get('DeviceIndex'))
-                itemKey = physicalKey.get('Key')
+    # Keep track of where we draw
+    boxes = []
+    modifierIndex = ModifierIndex(modifiers)
 
-                # Only show it if we are handling the appropriate image at this time
-                if itemDevice not in imageDevices:
-                    continue
+    for keyId, physicalKey in physicalKeys.items():
+        itemDevice = physicalKey.device
+        itemDeviceIndex = int(physicalKey.deviceIndex)
+        itemKey = physicalKey.key
 
-                # Only show it if we are handling the appropriate index at this time
-                if itemDeviceIndex != deviceIndex: 
-                    continue
+        # Only show it if we are handling the appropriate image at this time
+        if itemDevice not in imageDevices:
+            continue
 
-                # Find the details for the control
-                texts = []
-                hotasDetail = None
-                try:
-                    hotasDetail = hotasDetails.get(itemDevice).get(itemKey)
-                except AttributeError:
-                    hotasDetail = None
-                if hotasDetail is None:
-                    logError('%s: No drawing box found for %s\n' % (runId, physicalKeySpec))
-                    continue
+        # Only show it if we are handling the appropriate index at this time
+        if itemDeviceIndex != deviceIndex: 
+            continue
 
-                # First obtain the modifiers if there are any
-                for keyModifier in modifiers.get(physicalKeySpec, []):
-                    if styling == 'Modifier':
-                        style = ModifierStyles.index(keyModifier.get('Number'))
-                    else:
-                        style = groupStyles.get('Modifier')
-                    texts.append({'Text': 'Modifier %s' % (keyModifier.get('Number')), 'Group': 'Modifier', 'Style': style})
-                if '::Joy' in physicalKeySpec:
-                    # Same again but for positive modifier
-                    for keyModifier in modifiers.get(physicalKeySpec.replace('::Joy', '::Pos_Joy'), []):
-                        if styling == 'Modifier':
-                            style = ModifierStyles.index(keyModifier.get('Number'))
-                        else:
-                            style = groupStyles.get('Modifier')
-                        texts.append({'Text': 'Modifier %s' % (keyModifier.get('Number')), 'Group': 'Modifier', 'Style': style})
-                    # Same again but for negative modifier
-                    for keyModifier in modifiers.get(physicalKeySpec.replace('::Joy', '::Neg_Joy'), []):
-                        if styling == 'Modifier':
-                            style = ModifierStyles.index(keyModifier.get('Number'))
-                        else:
-                            style = groupStyles.get('Modifier')
-                        texts.append({'Text': 'Modifier %s' % (keyModifier.get('Number')), 'Group': 'Modifier', 'Style': style})
-
-                # Next obtain unmodified bindings
-                for modifier, bind in physicalKey.get('Binds').items():
-                    if modifier == 'Unmodified':
-                        for controlKey, control in bind.get('Controls').items():
-                            if isRedundantSpecialisation(control, bind):
-                                continue
-                            # Check if this is a digital control on an analogue stick with an analogue equivalent
-                            if control.get('Type') == 'Digital' and control.get('HasAnalogue') is True and hotasDetail.get('Type') == 'Analogue':
-                                if misconfigurationWarnings == '':
-                                    misconfigurationWarnings = '<h1>Misconfiguration detected</h1>You have one or more analogue controls configured incorrectly. Please see <a href="https://forums.frontier.co.uk/showthread.php?t=209792">this thread</a> for details of the problem and how to correct it.<br/> <b>Your misconfigured controls:</b> <b>%s</b> ' % control['Name']
-                                else:
-                                    misconfigurationWarnings = '%s, <b>%s</b>' % (misconfigurationWarnings, control['Name'])
-                                #logError('%s: Digital command %s found on hotas control %s::%s\n' % (runId, control['Name'], itemDevice, itemKey))
-
-                            if styling == 'Modifier':
-                                texts.append({'Text': '%s' % (control.get('Name')), 'Group': control.get('Group'), 'Style': ModifierStyles.index(0)})
-                            elif styling == 'Category':
-                                texts.append({'Text': '%s' % (control.get('Name')), 'Group': control.get('Group'), 'Style': categoryStyles.get(control.get('Category', 'General'))})
-                            else:
-                                texts.append({'Text': '%s' % (control.get('Name')), 'Group': control.get('Group'), 'Style': groupStyles.get(control.get('Group'))})
-
-                # Next obtain bindings with modifiers
-                # Lazy approach to do this but covers us for now
-                for curModifierNum in range(1, 200):
-                    for modifier, bind in physicalKey.get('Binds').items():
-                        if modifier != 'Unmodified':
-                            keyModifiers = modifiers.get(modifier)
-                            modifierNum = 0
-                            for keyModifier in keyModifiers:
-                                if keyModifier['ModifierKey'] == modifier:
-                                    modifierNum = keyModifier['Number']
-                                    break
-                            if modifierNum != curModifierNum:
-                                continue
-                            for controlKey, control in bind.get('Controls').items():
-                                if isRedundantSpecialisation(control, bind):
-                                    continue
-                                if styling == 'Modifier':
-                                    texts.append({'Text': '%s' % control.get('Name'), control.get('Group'): 'Modifier', 'Style': ModifierStyles.index(curModifierNum)})
-                                elif styling == 'Category':
-                                    texts.append({'Text': '%s[%s]' % (control.get('Name'), curModifierNum), 'Group': control.get('Group'), 'Style': categoryStyles.get(control.get('Category', 'General'))})
-                                else:
-                                    texts.append({'Text': '%s[%s]' % (control.get('Name'), curModifierNum), 'Group': control.get('Group'), 'Style': groupStyles.get(control.get('Group'))})
-            
-                # Obtain the layout of the texts and write them
-                texts = layoutText(sourceImg, context, texts, hotasDetail, biggestFontSize)
-                for text in texts:
-                    context.font_size = text['Size']
-                    context.font = text['Style']['Font']
-                    if styling != 'None':
-                        context.fill_color = text['Style']['Color']
-                    context.text(x=text['X'], y=text['Y'], body=text['Text'])
-
-            # Also need to add standalone modifiers (those without other binds)
-            for modifierSpec, keyModifiers in modifiers.items():
-                modifierTexts = []
-                for keyModifier in keyModifiers:
-                    if keyModifier.get('Device') not in imageDevices:
-                        # We don't have an image for this device
-                        continue
-                    if int(keyModifier.get('DeviceIndex')) != deviceIndex:
-                        # This is not four our current device
-                        continue
-                    if '/' in modifierSpec:
-                        # This is a logical modifier so ignore it
-                        continue
-                    if physicalKeys.get(modifierSpec) is not None or physicalKeys.get(modifierSpec.replace('::Pos_Joy', '::Joy')) is not None or physicalKeys.get(modifierSpec.replace('::Neg_Joy', '::Joy')) is not None:
-                        # This has already been handled because it has other binds
-                        continue
+        # Find the details for the control
+        texts = []
+        hotasDetail = None
+        try:
+            hotasDetail = hotasDetails.get(itemDevice).get(itemKey)
+        except AttributeError:
+            hotasDetail = None
+        if hotasDetail is None:
+            logError('%s: No drawing box found for %s::%s::%s\n' % ((runId,) + keyId))
+            continue
 
-                    modifierKey = keyModifier.get('Key')
-                    hotasDetail = hotasDetails.get(keyModifier.get('Device')).get(modifierKey)
-                    if hotasDetail is None:
-                        logError('%s: No location for %s\n' % (runId, modifierSpec))
+        # First obtain the modifiers if there are any
+        for modifierNum in modifierIndex.numbersOnKey(keyId, physicalKey):
+            if styling == 'Modifier':
+                style = ModifierStyles.index(modifierNum)
+            else:
+                style = groupStyles.get('Modifier')
+            texts.append({'Text': 'Modifier %s' % (modifierNum), 'Group': 'Modifier', 'Style': style})
+
+        # Next obtain unmodified bindings
+        for modifier, boundControls in physicalKey.binds.items():
+            if modifier == 'Unmodified':
+                for controlKey, control in boundControls.items():
+                    if isRedundantAmong(control, boundControls):
                         continue
 
                     if styling == 'Modifier':
-                        style = ModifierStyles.index(keyModifier.get('Number'))
+                        texts.append({'Text': '%s' % (control.get('Name')), 'Group': control.get('Group'), 'Style': ModifierStyles.index(0)})
+                    elif styling == 'Category':
+                        texts.append({'Text': '%s' % (control.get('Name')), 'Group': control.get('Group'), 'Style': categoryStyles.get(control.get('Category', 'General'))})
                     else:
-                        style = groupStyles.get('Modifier')
-                    modifierTexts.append({'Text': 'Modifier %s' % (keyModifier.get('Number')), 'Group': 'Modifier', 'Style': style})
-
-                if modifierTexts != []:
-                    # Obtain the layout of the modifier text and write it
-                    modifierTexts = layoutText(sourceImg, context, modifierTexts, hotasDetail, biggestFontSize)
-                    for text in modifierTexts:
-                        context.font_size = text['Size']
-                        context.font = text['Style']['Font']
-                        if styling != 'None':
-                            context.fill_color = text['Style']['Color']
-                        context.text(x=text['X'], y=text['Y'], body=text['Text'])
+                        texts.append({'Text': '%s' % (control.get('Name')), 'Group': control.get('Group'), 'Style': groupStyles.get(control.get('Group'))})
 
-            context.draw(sourceImg)
-            sourceImg.save(filename=str(filePath))
-    return True
+        # Next obtain bindings with modifiers, in the order of their modifiers
+        for (modifierNum, boundControls) in modifierIndex.modifiedBinds(physicalKey):
+            for controlKey, control in boundControls.items():
+                if isRedundantAmong(control, boundControls):
+                    continue
+                if styling == 'Modifier':
+                    texts.append({'Text': '%s' % control.get('Name'), control.get('Group'): 'Modifier', 'Style': ModifierStyles.index(modifierNum)})
+                elif styling == 'Category':
+                    texts.append({'Text': '%s[%s]' % (control.get('Name'), modifierNum), 'Group': control.get('Group'), 'Style': categoryStyles.get(control.get('Category', 'General'))})
+                else:
+                    texts.append({'Text': '%s[%s]' % (control.get('Name'), modifierNum), 'Group': control.get('Group'), 'Style': groupStyles.get(control.get('Group'))})
+    
+        # Obtain the layout of the texts and write them
+        texts = layoutText(sourceImg, context, texts, hotasDetail, biggestFontSize)
+        for text in texts:
+            context.font_size = text['Size']
+            context.font = text['Style']['Font']
+            if styling != 'None':
+                context.fill_color = text['Style']['Color']
+            context.text(x=text['X'], y=text['Y'], body=text['Text'])
+            boxes.append(textBox(context, sourceImg, text['Style']['Font'], text['Size'], text['X'], text['Y'], text['Text']))
+
+    # Also need to add standalone modifiers (those without other binds)
+    boundModifierIds = set(physicalKeys)
+    for physicalKey in physicalKeys.values():
+        boundModifierIds.update(physicalKey.axisAliases)
+    for modifierSpec, keyModifiers in modifiers.items():
+        modifierTexts = []
+        for keyModifier in keyModifiers:
+            if keyModifier.get('Device') not in imageDevices:
+                # We don't have an image for this device
+                continue
+            if int(keyModifier.get('DeviceIndex')) != deviceIndex:
+                # This is not four our current device
+                continue
+            if '/' in modifierSpec:
+                # This is a logical modifier so ignore it
+                continue
+            if modifierKeyId(keyModifier) in boundModifierIds:
+                # This has already been handled because it has other binds
+                continue
+
+            modifierKey = keyModifier.get('Key')
+            hotasDetail = hotasDetails.get(keyModifier.get('Device')).get(modifierKey)
+            if hotasDetail is None:
+                logError('%s: No location for %s\n' % (runId, modifierSpec))
+                continue
+
+            if styling == 'Modifier':
+                style = ModifierStyles.index(keyModifier.get('Number'))
+            else:
+                style = groupStyles.get('Modifier')
+            modifierTexts.append({'Text': 'Modifier %s' % (keyModifier.get('Number')), 'Group': 'Modifier', 'Style': style})
+
+        if modifierTexts != []:
+            # Obtain the layout of the modifier text and write it
+            modifierTexts = layoutText(sourceImg, context, modifierTexts, hotasDetail, biggestFontSize)
+            for text in modifierTexts:
+                context.font_size = text['Size']
+                context.font = text['Style']['Font']
+                if styling != 'None':
+                    context.fill_color = text['Style']['Color']
+                context.text(x=text['X'], y=text['Y'], body=text['Text'])
+                boxes.append(textBox(context, sourceImg, text['Style']['Font'], text['Size'], text['X'], text['Y'], text['Text']))
+
+    return boxes
 
 def layoutText(img, context, texts, hotasDetail, biggestFontSize):
     width = hotasDetail.get('width')
     height = hotasDetail.get('height', 54)
 
-    # Work out the best font size
-    fontSize = calculateBestFitFontSize(context, width, height, texts, biggestFontSize)
-
-    # Work out location of individual texts
-    currentX = hotasDetail.get('x')
-    currentY = hotasDetail.get('y')
-    maxX = hotasDetail.get('x') + hotasDetail.get('width')
-    metrics = None
-
-    for text in texts:
-        text['Size'] = fontSize
-        context.font = text['Style']['Font']
-        context.font_size = fontSize
-        metrics = context.get_font_metrics(img, text['Text'], multiline=False)
-        if currentX + int(metrics.text_width) > maxX:
-            # Newline
-            currentX = hotasDetail.get('x')
-            currentY = currentY + fontSize
-        text['X'] = currentX
-        text['Y'] = currentY + int(metrics.ascender)
-        currentX = currentX + int(metrics.text_width + metrics.character_width)
+    # Work out the best font size, along with the location of individual texts relative to the box at that size
+    (fontSize, positions, lastLineY) = calculateBestFitLayout(context, img, width, height, texts, biggestFontSize)
 
     # We want to centre the texts vertically, which we can now do as we know how much space the texts take up
-    textHeight = currentY + fontSize - hotasDetail.get('y')
+    textHeight = lastLineY + fontSize
     yOffset = int((height - textHeight) / 2) - int(fontSize / 6)
-    for text in texts:
-        text['Y'] = text['Y'] + yOffset
+    for text, (x, y) in zip(texts, positions):
+        text['Size'] = fontSize
+        text['X'] = hotasDetail.get('x') + x
+        text['Y'] = hotasDetail.get('y') + y + yOffset
 
     return texts
 
-# Calculate the best fit font size for our text given the dimensions of the box
-def calculateBestFitFontSize(context, width, height, texts, biggestFontSize):
-    fontSize = biggestFontSize
-    context.push()
-    with Image(width=width, height=height) as img:
-        # Step through the font size until we find one that fits
-        fits = False
-        while fits == False:
-            currentX = 0
-            currentY = 0
-            tooLong = False
-            for text in texts:
-                context.font = text['Style']['Font']
-                context.font_size = fontSize
-                metrics = context.get_font_metrics(img, text['Text'], multiline=False)
-                if currentX + int(metrics.text_width) > width:
-                    if currentX == 0:
-                        # This single entry is too long for the box; shrink it
-                        tooLong = True
-                        break
-                    else:
-                        # Newline
-                        currentX = 0
-                        currentY = currentY + fontSize
-                text['X'] = currentX
-                text['Y'] = currentY + int(metrics.ascender)
-                currentX = currentX + int(metrics.text_width + metrics.character_width)
-            if tooLong is False and currentY + metrics.text_height < height:
-                fits = True
+# Measure each text at the given font size, returning (width, character width, ascender, height) for each
+def measureTexts(context, img, texts, fontSize):
+    measurements = []
+    for text in texts:
+        metrics = fontMetricsCache.measure(text['Style']['Font'], fontSize, text['Text'], context, img)
+        measurements.append((metrics.text_width, metrics.character_width, metrics.ascender, metrics.text_height))
+    return measurements
+
+# Flow measured texts into a box, wrapping on to new lines as required.
+# Returns whether they fit, the position of each text relative to the top left of the box, and the top of the last line
+def flowTexts(measurements, width, height, fontSize):
+    currentX = 0
+    currentY = 0
+    fits = True
+    positions = []
+    for (textWidth, characterWidth, ascender, textHeight) in measurements:
+        if currentX + int(textWidth) > width:
+            if currentX == 0:
+                # This single entry is too long for the box
+                fits = False
             else:
-                fontSize = fontSize -1 
-    context.pop()
-    return fontSize
-    
-def calculateBestFontSize(context, text, hotasDetail, biggestFontSize):
-    width = hotasDetail.get('width')
-    height = hotasDetail.get('height', 54)
-    with Image(width=width, height=height) as img:
-
-        # Step through the font size until we find one that fits
-        fontSize = biggestFontSize
+                # Newline
+                currentX = 0
+                currentY = currentY + fontSize
+        positions.append((currentX, currentY + int(ascender)))
+        currentX = currentX + int(textWidth + characterWidth)
+    if measurements and currentY + measurements[-1][3] >= height:
         fits = False
-        while fits == False:
-            fitText = text
-            context.font_size = fontSize
-            # See if it fits on a single line
-            metrics = context.get_font_metrics(img, fitText, multiline=False)
-            if metrics.text_width <= hotasDetail.get('width'):
-                fits = True
+    return (fits, positions, currentY)
+
+# Estimate the largest font size below the reference size that fits, assuming metrics scale linearly with font size
+def estimateFitFontSize(referenceMeasurements, width, height, referenceFontSize):
+    for fontSize in range(referenceFontSize - 1, 0, -1):
+        scale = fontSize / referenceFontSize
+        measurements = [tuple(value * scale for value in measurement) for measurement in referenceMeasurements]
+        if flowTexts(measurements, width, height, fontSize)[0]:
+            return fontSize
+    return 1
+
+# Calculate the best fit font size for our text given the dimensions of the box, and the layout of the texts at that size.
+# The texts are measured once at the biggest size; if they don't fit there we estimate the size from those measurements and
+# confirm it against its neighbour, falling back to a binary search if the estimate was off
+def calculateBestFitLayout(context, img, width, height, texts, biggestFontSize):
+    layouts = {}
+
+    def probe(fontSize):
+        measurements = measureTexts(context, img, texts, fontSize)
+        layouts[fontSize] = flowTexts(measurements, width, height, fontSize)
+        return measurements
+
+    referenceMeasurements = probe(biggestFontSize)
+    fontSize = biggestFontSize
+    if not layouts[biggestFontSize][0]:
+        # Largest size known to fit (0 if none yet) and smallest size known not to fit
+        fitting = 0
+        failing = biggestFontSize
+        estimate = estimateFitFontSize(referenceMeasurements, width, height, biggestFontSize)
+        guess = estimate
+        while failing - fitting > 1:
+            probe(guess)
+            fits = layouts[guess][0]
+            if fits:
+                fitting = guess
             else:
-                # See if we can break out the text on to multiple lines
-                lines = max(int(height / metrics.text_height), 1)
-                if lines == 1:
-                    # Not enough room for more lines
-                    fontSize = fontSize - 1
-                else:
-                    fitText = ''
-                    minLineLength = int(len(text) / lines)
-                    regex = r'.{%s}[^,]*, |.+' % minLineLength
-                    matches = re.findall(regex, text)
-                    for match in matches:
-                        if fitText == '':
-                            fitText = match
-                        else:
-                            fitText = '%s\n%s' % (fitText, match)
-
-                    metrics = context.get_font_metrics(img, fitText, multiline=True)
-                    if metrics.text_width <= hotasDetail.get('width'):
-                        fits = True
-                    else:
-                        fontSize = fontSize - 1
+                failing = guess
+            if guess == estimate:
+                guess = guess + 1 if fits else guess - 1
+            if not fitting < guess < failing:
+                guess = (fitting + failing) // 2
+        # If nothing fits then use the smallest size we have
+        fontSize = max(fitting, 1)
 
-    return (fitText, fontSize, metrics)
+    (fits, positions, lastLineY) = layouts[fontSize]
+    return (fontSize, positions, lastLineY)
 
 # Returns a set of controller names used by the binding
 def controllerNames(configObj):
-    rawKeys = configObj['devices'].keys()
-    controllers = [fullKey.split('::')[0] for fullKey in rawKeys]
+    controllers = [fullKey.split('::')[0] for fullKey in configObj['devices']]
     silencedControllers = ['Mouse', 'Keyboard']
     def displayName(controller):
         try:
@@ -703,31 +1636,8 @@ def controllerNames(configObj):
     controllers = {displayName(controller) for controller in controllers if not controller in silencedControllers}
     return controllers
 
-def printListItem(configObj, searchOpts):
-    config = Config(configObj['runID'])
-    refcardURL = str(config.refcardURL())
-    dateStr = str(configObj['timestamp'].ctime())
-    name = str(configObj['description'])
-
-    controllers = controllerNames(configObj)
-    # Apply search filter if provided
-    searchControllers = searchOpts.get('controllers', set())
-    if searchControllers:
-        # Resolve device name from select list (from 'supportedDevices') into their 'handledDevices' (which are
-        # referenced in the bindings files)
-        requestedDevices = [supportedDevices.get(controller,{}).get('HandledDevices',{}) for controller in searchControllers]
-        requestedDevices = set([item for sublist in requestedDevices for item in sublist]) # Flatten into a set
-
-        # Compare against the list of devices supported in this binding config
-        devices = [fullKey.split('::')[0] for fullKey in configObj['devices'].keys()]
-        #print('<!-- Checking if any requested devices %s are in config\'s devices %s -->' % (requestedDevices, devices))
-        if not any(requestedDevice in devices for requestedDevice in requestedDevices):
-            return
-
-    controllersStr = ', '.join(sorted(controllers))
-    if name == '':
-        # if the uploader didn't bother to name their config, skip it
-        return
+def printListRow(runId, name, controllersStr, dateStr):
+    refcardURL = str(Config(runId).refcardURL())
     print('''
     <tr>
         <td class="description">
@@ -772,19 +1682,81 @@ def printSearchForm(searchOptions):
     print('</select></td>')
     print('</tr>')
     print('<tr>')
+    print('<td><label for="order">Order by</label></td>')
+    print('<td><select name="order" id="order">')
+    for order in listOrders:
+        selected = "selected" if order == searchOptions.get("order", "description") else ""
+        print('<option value="%s" %s>%s</option>' % (order, selected, order))
+    print('</select></td>')
+    print('</tr>')
+    print('<tr>')
     print('<td colspan=2><input type="submit" value="Search"></input></td>')
     print('</tr>')
     print('</table>')
     print('</form>')
     print('</div>')
 
+# Pages of the list have listPageSize configurations, unless up to listPageSizeMax are asked for. The page is sent on as
+# each listChunkSize of them are printed, rather than when it is finished
+listPageSize = 100
+listPageSizeMax = 500
+listChunkSize = 25
+
+# A list key as it is given in the links to other pages
+def encodeListKey(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii')
+
+# A list key from a link, or None if it isn't one
+def decodeListKey(value):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(value.encode('ascii')).decode('utf-8'))
+    except ValueError:
+        return None
+    if type(key) is not list or len(key) != 2 or not all(type(part) is str for part in key):
+        return None
+    return key
+
+# The URL of a page of the list with the same search, starting after or ending before a key
+def listURL(searchOpts, direction=None, key=None):
+    parameters = [('deviceFilter', controller) for controller in sorted(searchOpts.get('controllers', set()))]
+    for option in ['order', 'pageSize']:
+        if option in searchOpts:
+            parameters.append((option if option == 'order' else 'count', searchOpts[option]))
+    if direction is not None:
+        parameters.append((direction, encodeListKey(key)))
+    return 'list?%s' % urlencode(parameters)
+
+def printListLinks(searchOpts, firstKey, lastKey, morePrevious, moreNext):
+    links = []
+    if 'after' in searchOpts or 'before' in searchOpts:
+        links.append('<a href="%s">First</a>' % html.escape(listURL(searchOpts)))
+    if morePrevious and firstKey is not None:
+        links.append('<a href="%s">Previous</a>' % html.escape(listURL(searchOpts, 'before', firstKey)))
+    if moreNext and lastKey is not None:
+        links.append('<a href="%s">Next</a>' % html.escape(listURL(searchOpts, 'after', lastKey)))
+    if links:
+        print('<p>%s</p>' % ' | '.join(links))
+
 def printList(mode, searchOpts):
 
     print('<div id="list"><h1>%s</h1></div>' % modeTitle(mode))
 
     printSearchForm(searchOpts)
 
-    objs = Config.allConfigs(sortKey=lambda obj: str(obj['description']).casefold())
+    order = searchOpts.get('order', 'description')
+    after = searchOpts.get('after')
+    before = searchOpts.get('before')
+    pageSize = searchOpts.get('pageSize', listPageSize)
+    try:
+        configIndex = currentConfigIndex()
+    except sqlite3.Error as e:
+        # Such as another process taking too long to build an index that couldn't be read meanwhile. Building one in
+        # memory for every request would only add to the load
+        logError('Unable to use the configuration index: %s\n' % e)
+        print('<p>The list of configurations is being updated. Please try again in a minute.</p>')
+        return
+    if configIndex is None:
+        configIndex = memoryConfigIndex()
     print('<table>')
     print('''
         <tr>
@@ -794,17 +1766,89 @@ def printList(mode, searchOpts):
         </tr>
     ''')
 
-    print("<!--\nSearch options: \n%s\n-->\n" % str(searchOpts))
-    for obj in objs:
-        try:
-            printListItem(obj, searchOpts)
-        except Exception as e:
-            print('<tr><td>ERROR in item %s<td>%s</td></td></tr>' % (obj['runID'], str(e)))
-            #cgitb.handler() # only for use when needed
-            continue
+    print("<!--\nSearch options: \n%s\n-->\n" % html.escape(str(searchOpts)))
+    sys.stdout.flush()
+    # One more than a page is read, to tell whether there is another page past it
+    rows = indexedConfigs(configIndex, searchOpts, order, after, before, pageSize + 1)
+    if before is not None:
+        rows = list(rows)
+        morePrevious = len(rows) > pageSize
+        rows = rows[-pageSize:]
+        moreNext = True
+    else:
+        morePrevious = after is not None
+        moreNext = False
+    firstKey = None
+    lastKey = None
+    for (rowNumber, row) in enumerate(rows):
+        if rowNumber == pageSize:
+            moreNext = True
+            break
+        (runId, description, controllersStr, timestamp) = row
+        dateStr = parseTimestamp(timestamp).ctime() if timestamp else ''
+        printListRow(runId, description, controllersStr, dateStr)
+        if firstKey is None:
+            firstKey = listKey(order, row)
+        lastKey = listKey(order, row)
+        if (rowNumber + 1) % listChunkSize == 0:
+            sys.stdout.flush()
+    configIndex.close()
     print ('</table>')
-
-def printRefCard(config, public, createdImages, deviceForBlockImage, errors):
+    printListLinks(searchOpts, firstKey, lastKey, morePrevious, moreNext)
+
+templateSizes = {}
+
+# The width and height of a template, read from its JPEG header once per process
+def templateSize(templateName):
+    size = templateSizes.get(templateName)
+    if size is None:
+        size = jpegPatch.frameSize(Path('../res/%s.jpg' % templateName).read_bytes())
+        templateSizes[templateName] = size
+    return size
+
+# The supported device of a created image, and the index of the device it is for
+def createdImageDevice(createdImage):
+    if '::' in createdImage:
+        # Split the created image in to device and device index
+        m = re.search(r'(.*)\:\:([01])', createdImage)
+        return (m.group(1), int(m.group(2)))
+    return (createdImage, 0)
+
+# The template and card name of a created image
+def createdImageCard(createdImage):
+    (device, deviceIndex) = createdImageDevice(createdImage)
+    template = supportedDevices[device]['Template']
+    return (template, cardName(template, deviceIndex))
+
+# The files a page links to for a card, in every size and format that printCard offers
+def cardFiles(config, createdImage, cardFormat):
+    (template, name) = createdImageCard(createdImage)
+    filePath = config.pathWithNameAndSuffix(name, '.%s' % cardFormat)
+    if cardFormat == 'svg':
+        return [filePath]
+    (width, height) = templateSize(template)
+    return [filePath] + [cardVariantPath(filePath, variantWidth, variantFormat) for variantWidth in cardWidths() if variantWidth < width for variantFormat in cardFormats()]
+
+# Prints a device card at the width of the page. SVG cards refer to the template image and fonts so they are embedded as
+# objects, not images. JPEG cards offer their smaller copies, and every format they are saved in, for the browser to
+# choose from. Cards below the first are only loaded as they are scrolled to
+def printCard(path, cardFormat, size, lazy=False):
+    (width, height) = size
+    loading = ' loading="lazy"' if lazy else ''
+    if cardFormat == 'svg':
+        print('<object type="image/svg+xml" width="100%%" data="%s.svg"></object><br/>' % path)
+        return
+    widths = [variantWidth for variantWidth in cardWidths() if variantWidth < width]
+    print('<picture>')
+    for variantFormat in cardFormats()[1:]:
+        srcset = ', '.join('%s-%d.%s %dw' % (path, variantWidth, variantFormat, variantWidth) for variantWidth in reversed(widths))
+        if srcset:
+            print('<source type="image/%s" srcset="%s" sizes="100vw"/>' % (variantFormat, srcset))
+    srcset = ', '.join(['%s-%d.jpg %dw' % (path, variantWidth, variantWidth) for variantWidth in reversed(widths)] + ['%s.jpg %dw' % (path, width)])
+    print('<img width="%d" height="%d" style="width: 100%%; height: auto"%s decoding="async" src="%s.jpg" srcset="%s" sizes="100vw"/>' % (width, height, loading, path, srcset))
+    print('</picture><br/>')
+
+def printRefCard(config, public, createdImages, deviceForBlockImage, errors, cardFormat='jpg'):
     runId = config.name
     if errors.unhandledDevicesWarnings != '':
         print('%s<br/>' % errors.unhandledDevicesWarnings)
@@ -815,19 +1859,9 @@ def printRefCard(config, public, createdImages, deviceForBlockImage, errors):
     if errors.errors != '':
         print('%s<br/>' % errors.errors)
     else:
-        for createdImage in createdImages:
-            if '::' in createdImage:
-                # Split the created image in to device and device index
-                m = re.search(r'(.*)\:\:([01])', createdImage)
-                device = m.group(1)
-                deviceIndex = int(m.group(2))
-            else:
-                device = createdImage
-                deviceIndex = 0
-            if deviceIndex == 0:
-                print('<img width="100%%" src="../configs/%s/%s-%s.jpg"/><br/>' % (runId[:2], runId, supportedDevices[device]['Template']))
-            else:
-                print('<img width="100%%" src="../configs/%s/%s-%s-%s.jpg"/><br/>' % (runId[:2], runId, supportedDevices[device]['Template'], deviceIndex))
+        for (index, createdImage) in enumerate(createdImages):
+            (template, name) = createdImageCard(createdImage)
+            printCard('../configs/%s/%s-%s' % (runId[:2], runId, name), cardFormat, templateSize(template), index > 0)
         if deviceForBlockImage is not None:
             print('<img width="100%%" src="../configs/%s/%s.jpg"/><br/>' % (supportedDevices[deviceForBlockImage]['Template'][:2], supportedDevices[deviceForBlockImage]['Template']))
         if deviceForBlockImage is None and public is True:
@@ -843,7 +1877,7 @@ def printBodyMain(mode, options, config, public, createdImages, deviceForBlockIm
     elif mode == Mode.listDevices:
         printDeviceList(mode)
     else:
-        printRefCard(config, public, createdImages, deviceForBlockImage, errors)
+        printRefCard(config, public, createdImages, deviceForBlockImage, errors, options.get('cardFormat', 'jpg'))
 
 def printBody(mode, options, config, public, createdImages, deviceForBlockImage, errors):
     # guard against bad server configs
@@ -863,9 +1897,11 @@ def printSupportPara():
     print(supportPara)
 
 def printHTML(mode, options, config, public, createdImages, deviceForBlockImage, errors):
-    print('''Content-Type: text/html
+    print('Content-Type: text/html\n')
+    printPage(mode, options, config, public, createdImages, deviceForBlockImage, errors)
 
-<html>
+def printPage(mode, options, config, public, createdImages, deviceForBlockImage, errors):
+    print('''<html>
 <head>
     <meta charset="utf-8">
     <meta name="robots" content="all">
@@ -879,155 +1915,655 @@ def printHTML(mode, options, config, public, createdImages, deviceForBlockImage,
 </body>
 </html>''')
 
+# Config index section
+
+# Public configurations are indexed in a SQLite database in the cache directory, so that the list page is a single query
+# rather than reading every replay. Each configuration is added as it is published. The index is rebuilt from the
+# replays if it is new, or was built by another version of the index or of bindingsData, which gives the controller
+# names and bits; indexConfigs.py rebuilds it from the command line
+configIndexFormat = 4
+
+# How many seconds to wait for another process to finish writing to the index
+configIndexTimeout = 30
+
+# A configuration's controllerBits has a bit for each supported device that handles one of its devices, at the position
+# of the supported device in supportedDevices. A search for any of several controllers is then a test against the
+# bitwise or of theirs, made while reading the configurations in order from an index that covers it. There is an index
+# for each order the list page can be in
+configIndexTables = [
+    'CREATE TABLE configs (runId TEXT PRIMARY KEY, description TEXT NOT NULL, sortKey TEXT NOT NULL, timestamp TEXT NOT NULL, controllers TEXT NOT NULL, controllerBits INTEGER NOT NULL)',
+    "CREATE INDEX configsBySortKey ON configs (sortKey, runId, controllerBits) WHERE description != ''",
+    "CREATE INDEX configsByTimestamp ON configs (timestamp, runId, controllerBits) WHERE description != ''",
+]
+
+def configIndexVersion():
+    return '%d:%s' % (configIndexFormat, codeVersion(('bindingsData.py',)))
+
+# The bits for some supported devices in controllerBits. SQLite integers are signed 64 bit, so this allows for 63
+# supported devices; past that, another way of searching for controllers is needed
+controllerBitsLimit = 63
+
+def controllerBits(supportedDeviceKeys):
+    bits = 0
+    for supportedDeviceKey in supportedDeviceKeys:
+        if supportedDeviceKey in supportedDeviceOrder:
+            if supportedDeviceOrder[supportedDeviceKey] >= controllerBitsLimit:
+                raise ValueError('%s is past the %d supported devices that controllerBits allows for' % (supportedDeviceKey, controllerBitsLimit))
+            bits = bits | (1 << supportedDeviceOrder[supportedDeviceKey])
+    return bits
+
+# Open the index, or return None if there is no cache directory. Its tables are only made when it is rebuilt
+def openConfigIndex():
+    cachePath = Config.cachePath()
+    if cachePath is None:
+        return None
+    cachePath.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(str(cachePath / 'configs.sqlite'), timeout=configIndexTimeout)
+    connection.executescript('''
+        PRAGMA journal_mode = WAL;
+        CREATE TABLE IF NOT EXISTS configIndexInfo (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+    ''')
+    return connection
+
+# An index held in memory, built from the replays, for when there is no cache directory
+def memoryConfigIndex():
+    connection = sqlite3.connect(':memory:')
+    connection.execute('CREATE TABLE configIndexInfo (name TEXT PRIMARY KEY, value TEXT NOT NULL)')
+    updateConfigIndex(connection)
+    return connection
+
+# Read a timestamp written by datetime's isoformat, as fromisoformat does from Python 3.7
+def parseTimestamp(text):
+    match = re.fullmatch(r'(\d{4}-\d\d-\d\d[T ]\d\d:\d\d:\d\d)(\.\d{6})?(?:([+-])(\d\d):(\d\d))?', text)
+    if match is None:
+        raise ValueError('Invalid timestamp %r' % text)
+    (dateTime, fraction, sign, hours, minutes) = match.groups()
+    timestamp = datetime.datetime.strptime(dateTime.replace(' ', 'T') + (fraction or '.000000'), '%Y-%m-%dT%H:%M:%S.%f')
+    if sign is not None:
+        offset = datetime.timedelta(hours=int(hours), minutes=int(minutes))
+        timestamp = timestamp.replace(tzinfo=datetime.timezone(-offset if sign == '-' else offset))
+    return timestamp
+
+# Add or replace a configuration in the index, given its replay info with its runID
+def indexConfig(connection, configObj):
+    runId = configObj['runID']
+    description = str(configObj.get('description', ''))
+    timestamp = configObj.get('timestamp')
+    controllersStr = ', '.join(sorted(controllerNames(configObj)))
+    devices = {deviceKey.split('::')[0] for deviceKey in configObj['devices']}
+    bits = controllerBits(supportedDeviceKey for device in devices for supportedDeviceKey in supportedDevicesByHandledDevice.get(device, []))
+    connection.execute('INSERT OR REPLACE INTO configs VALUES (?, ?, ?, ?, ?, ?)',
+        (runId, description, description.casefold(), timestamp.isoformat() if timestamp is not None else '', controllersStr, bits))
+
+# Whether the index was built by this version of it, so that configurations can be added to it
+def configIndexIsCurrent(connection):
+    version = connection.execute("SELECT value FROM configIndexInfo WHERE name = 'version'").fetchone()
+    return version == (configIndexVersion(),)
+
+# Whether the index was built by this format of it, if perhaps from another bindingsData, so that it can still be read
+def configIndexIsReadable(connection):
+    version = connection.execute("SELECT value FROM configIndexInfo WHERE name = 'version'").fetchone()
+    return version is not None and version[0].split(':')[0] == str(configIndexFormat)
+
+# The generation of the index, which goes up whenever configurations are added to it or it is rebuilt, so that pages made
+# from it can be told apart from those made from an earlier one
+def configGeneration(connection):
+    generation = connection.execute("SELECT value FROM configIndexInfo WHERE name = 'generation'").fetchone()
+    return int(generation[0]) if generation is not None else 0
+
+def advanceConfigGeneration(connection):
+    connection.execute("INSERT OR REPLACE INTO configIndexInfo VALUES ('generation', ?)", (str(configGeneration(connection) + 1),))
+
+# Rebuild the index from the replays if it isn't current, or always if forced. Returns the number of configurations
+# indexed, or None if it wasn't rebuilt. Checking whether it is current takes no lock, so that requests only wait on each
+# other to rebuild it. An index that can still be read is read as it is while another process rebuilds it, rather than
+# waited for
+def updateConfigIndex(connection, force=False):
+    if not force and configIndexIsCurrent(connection):
+        return None
+    readable = not force and configIndexIsReadable(connection)
+    with connection:
+        try:
+            if readable:
+                connection.execute('PRAGMA busy_timeout = 0')
+            connection.execute('BEGIN IMMEDIATE')
+        except sqlite3.OperationalError:
+            if readable:
+                return None
+            raise
+        finally:
+            if readable:
+                connection.execute('PRAGMA busy_timeout = %d' % (configIndexTimeout * 1000))
+        # Another process may have rebuilt it while this one waited
+        if not force and configIndexIsCurrent(connection):
+            return None
+        # The tables are made again, as they may be from another version
+        connection.execute('DROP TABLE IF EXISTS configs')
+        # Indexes before format 4 also listed each configuration's devices in a table, which controllerBits replaced
+        connection.execute('DROP TABLE IF EXISTS configDevices')
+        for statement in configIndexTables:
+            connection.execute(statement)
+        indexed = 0
+        for path in Config.configsPath().glob('**/*.replay'):
+            try:
+                indexConfig(connection, Config.loadReplay(path))
+                indexed = indexed + 1
+            except Exception as e:
+                logError('Unable to index %s: %s\n' % (path, e))
+        connection.execute("INSERT OR REPLACE INTO configIndexInfo VALUES ('version', ?)", (configIndexVersion(),))
+        advanceConfigGeneration(connection)
+    return indexed
+
+# The index, rebuilt first if it isn't current, or None if there is no cache directory
+def currentConfigIndex():
+    connection = openConfigIndex()
+    if connection is not None:
+        updateConfigIndex(connection)
+    return connection
+
+# The orders the list page can be in, each as the indexed column it is read in order of and whether that is backwards
+listOrders = {
+    'description': ('sortKey', False),
+    'date': ('timestamp', True),
+}
+
+# The key of a configuration from the index in one of the list orders. Pages of the list start after or end before one
+def listKey(order, row):
+    (runId, description, controllersStr, timestamp) = row
+    return [description.casefold() if order == 'description' else timestamp, runId]
+
+# The named configurations in the index as (runId, description, controllers, timestamp), in one of the list orders. If
+# controllers are searched for, only those with a device handled by one of them. Given a key, only those after or before
+# it, still in order; with a limit, only that many of them nearest the key
+def indexedConfigs(connection, searchOpts, order='description', after=None, before=None, limit=None):
+    (column, descending) = listOrders[order]
+    query = "SELECT runId, description, controllers, timestamp FROM configs WHERE description != ''"
+    parameters = []
+    searchControllers = searchOpts.get('controllers', set())
+    if searchControllers:
+        query += ' AND controllerBits & ? != 0'
+        parameters.append(controllerBits(searchControllers))
+    # Configurations before a key are read backwards from it, and turned around
+    backwards = descending != (before is not None)
+    key = after if after is not None else before
+    if key is not None:
+        query += ' AND (%s, runId) %s (?, ?)' % (column, '<' if backwards else '>')
+        parameters.extend(key)
+    direction = ' DESC' if backwards else ''
+    query += ' ORDER BY %s%s, runId%s' % (column, direction, direction)
+    if limit is not None:
+        query += ' LIMIT ?'
+        parameters.append(limit)
+    rows = connection.execute(query, parameters)
+    if before is not None:
+        return reversed(rows.fetchall())
+    return rows
+
+# Page cache section
+
+# The list pages only change when a configuration is published or the code is updated, so with a cache directory they
+# are kept in it once made, keyed by their options and the generation of the config index, along with copies compressed
+# with gzip and, if the brotli module is installed, brotli. Each generation has a directory, and those of earlier ones
+# are removed. The device list only changes with the code, so it has a directory of its own that is kept. A page is sent
+# on as it is made, requests for a page that is being made wait for it rather than making it again, and browsers are
+# given validators for it so that they can check it is current without fetching it again
+pageCacheMaxPages = 2000
+
+pageCacheDevicesDir = 'devices'
+
+pageEncodings = [('br', '.br'), ('gzip', '.gz')]
+
+def compressPage(encoding, body):
+    if encoding == 'gzip':
+        # gzip.compress only takes an mtime from Python 3.8; a fixed one keeps the copies of a page the same
+        output = io.BytesIO()
+        with gzip.GzipFile(fileobj=output, mode='wb', compresslevel=9, mtime=0) as gzipFile:
+            gzipFile.write(body)
+        return output.getvalue()
+    return brotli.compress(body)
+
+# The key for a page, from everything it is made from. Sets of options are sorted, as their order varies between processes
+def pageCacheKey(mode, options, generation):
+    optionParts = sorted((name, sorted(value) if type(value) is set else value) for (name, value) in options.items())
+    return bindingsFingerprint((mode.name, optionParts, generation, codeVersion(('bindings.py', 'bindingsData.py'))))
+
+# The content encodings the browser accepts, from Accept-Encoding
+def acceptedEncodings():
+    accepted = set()
+    for part in os.environ.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        (encoding, separator, parameters) = part.partition(';')
+        quality = re.search(r'q\s*=\s*([0-9.]+)', parameters)
+        try:
+            if quality is not None and float(quality.group(1)) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(encoding.strip().lower())
+    return accepted
+
+# Whether the browser's copy of a page is current, from If-None-Match, or if that isn't given from If-Modified-Since
+def pageIsNotModified(etag, pagePath):
+    ifNoneMatch = os.environ.get('HTTP_IF_NONE_MATCH')
+    if ifNoneMatch is not None:
+        tags = [tag.strip() for tag in ifNoneMatch.split(',')]
+        return '*' in tags or any(tag.replace('W/', '', 1) == etag.replace('W/', '', 1) for tag in tags)
+    ifModifiedSince = os.environ.get('HTTP_IF_MODIFIED_SINCE')
+    if ifModifiedSince is None:
+        return False
+    try:
+        return int(pagePath.stat().st_mtime) <= email.utils.parsedate_to_datetime(ifModifiedSince).timestamp()
+    except (FileNotFoundError, TypeError, ValueError):
+        return False
+
+# Output that goes to the browser and to a copy, so that a page can be sent on while it is being made for the cache
+class PageOutput:
+    def __init__(self, stream, copy):
+        self.stream = stream
+        self.copy = copy
+        self.encoding = stream.encoding
+
+    def write(self, text):
+        self.copy.write(text)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+# Print a page with its headers, making it into the cache as it is printed, unless another process made it while waiting
+# for it. A page isn't cached if the generation is full. Returns whether the page was printed; if it wasn't, it's in the
+# cache
+def makeCachedPage(pagesPath, pagePath, printPage, headers):
+    pagesPath.mkdir(parents=True, exist_ok=True)
+    with pagePath.with_suffix('.lock').open('w') as lockFile:
+        if fcntl is not None:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+        if pagePath.exists():
+            return False
+        if len(list(pagesPath.glob('*.html'))) >= pageCacheMaxPages:
+            print('Content-Type: text/html\n')
+            printPage()
+            return True
+        # The cached page is given the modification time that is sent now
+        madeTime = int(time.time())
+        headers = headers + ['Last-Modified: %s' % email.utils.formatdate(madeTime, usegmt=True)]
+        print('\n'.join(['Content-Type: text/html'] + headers) + '\n')
+        copy = io.StringIO()
+        with contextlib.redirect_stdout(PageOutput(sys.stdout, copy)):
+            printPage()
+        body = copy.getvalue().encode('utf-8')
+        try:
+            for (encoding, suffix) in pageEncodings:
+                if encoding == 'br' and brotli is None:
+                    continue
+                tempPath = pagePath.with_name('%s%s.tmp' % (pagePath.name, suffix))
+                tempPath.write_bytes(compressPage(encoding, body))
+                tempPath.replace(pagePath.with_name(pagePath.name + suffix))
+            # The page itself goes last, as it being there means its copies are too
+            tempPath = pagePath.with_name(pagePath.name + '.tmp')
+            tempPath.write_bytes(body)
+            os.utime(str(tempPath), (madeTime, madeTime))
+            tempPath.replace(pagePath)
+            for otherPath in pagesPath.parent.iterdir():
+                if otherPath.name not in (pagesPath.name, pageCacheDevicesDir):
+                    shutil.rmtree(str(otherPath), ignore_errors=True)
+        except OSError as e:
+            # The page has been sent already
+            logError('Unable to cache page: %s\n' % e)
+    return True
+
+# Send a page from the cache, making it first if it isn't there, or just print it if it can't be cached. printPage prints
+# the page without its headers
+def serveCachedPage(mode, options, printPage):
+    cachePath = Config.cachePath()
+    configIndex = None
+    if cachePath is not None and mode is not Mode.listDevices:
+        try:
+            configIndex = currentConfigIndex()
+        except sqlite3.Error as e:
+            logError('Unable to use the configuration index: %s\n' % e)
+    # A cached page would miss the check on the encoding of the output
+    if cachePath is None or (configIndex is None and mode is not Mode.listDevices) or sys.stdout.encoding != 'utf-8':
+        print('Content-Type: text/html\n')
+        printPage()
+        return
+    if configIndex is None:
+        generation = None
+        pagesPath = cachePath / 'pages' / pageCacheDevicesDir
+    else:
+        generation = configGeneration(configIndex)
+        configIndex.close()
+        pagesPath = cachePath / 'pages' / str(generation)
+    key = pageCacheKey(mode, options, generation)
+    etag = 'W/"%s"' % key[:32]
+    pagePath = pagesPath / ('%s.html' % key)
+    headers = ['ETag: %s' % etag, 'Cache-Control: no-cache', 'Vary: Accept-Encoding']
+    if pageIsNotModified(etag, pagePath):
+        print('\n'.join(['Status: 304 Not Modified'] + headers) + '\n')
+        return
+    try:
+        if makeCachedPage(pagesPath, pagePath, printPage, headers):
+            return
+        accepted = acceptedEncodings()
+        bodyPath = pagePath
+        for (encoding, suffix) in pageEncodings:
+            encodedPath = pagePath.with_name(pagePath.name + suffix)
+            if encoding in accepted and encodedPath.exists():
+                headers.append('Content-Encoding: %s' % encoding)
+                bodyPath = encodedPath
+                break
+        body = bodyPath.read_bytes()
+        headers.append('Last-Modified: %s' % email.utils.formatdate(pagePath.stat().st_mtime, usegmt=True))
+    except OSError as e:
+        # Such as the generation being removed for a later one while it was read
+        logError('Unable to cache page: %s\n' % e)
+        print('Content-Type: text/html\n')
+        printPage()
+        return
+    print('\n'.join(['Content-Type: text/html'] + headers) + '\n')
+    sys.stdout.flush()
+    sys.stdout.buffer.write(body)
+    sys.stdout.flush()
+
 # Parser section
 
+# Limits on what a binds file may cost to read, each with its default and the environment variable that overrides it.
+# Real binds files are a small fraction of each of these
+parseLimitDefaults = {
+    'bytes': ('EDREFCARD_MAX_BINDS_BYTES', 1048576),
+    'elements': ('EDREFCARD_MAX_BINDS_ELEMENTS', 20000),
+    'modifiers': ('EDREFCARD_MAX_BINDING_MODIFIERS', 8),
+    'seconds': ('EDREFCARD_MAX_PARSE_SECONDS', 2.0),
+}
+
+parseLimitDescriptions = {
+    'bytes': 'It is larger than %s bytes',
+    'elements': 'It has more than %s elements',
+    'modifiers': 'It has a binding with more than %s modifiers',
+    'seconds': 'It took more than %s seconds to read',
+}
+
+# The value of a parse limit, or its default if the environment variable isn't set to a positive number
+def parseLimit(limit):
+    (variable, default) = parseLimitDefaults[limit]
+    try:
+        value = type(default)(os.environ.get(variable, default))
+    except ValueError:
+        return default
+    return value if value > 0 else default
+
+class ParseLimitExceeded(Exception):
+    def __init__(self, limit):
+        super().__init__(limit)
+        self.limit = limit
+
+# How many times each parse limit has been reached by this process
+parseLimitCounts = {}
+
+# Count a parse limit being reached, both for this process and in parseLimits.json in the cache directory if there is
+# one, and return the error to show for it
+def parseLimitError(runId, limit):
+    logError('%s: binds file refused, over the %s limit\n' % (runId, limit))
+    parseLimitCounts[limit] = parseLimitCounts.get(limit, 0) + 1
+    cachePath = Config.cachePath()
+    if cachePath is not None and fcntl is not None:
+        countsPath = cachePath / 'parseLimits.json'
+        try:
+            cachePath.mkdir(parents=True, exist_ok=True)
+            countsPath.touch()
+            with countsPath.open('r+') as countsFile:
+                fcntl.flock(countsFile, fcntl.LOCK_EX)
+                try:
+                    counts = json.loads(countsFile.read() or '{}')
+                except ValueError:
+                    counts = {}
+                counts[limit] = counts.get(limit, 0) + 1
+                countsFile.seek(0)
+                countsFile.truncate()
+                json.dump(counts, countsFile, sort_keys=True)
+        except OSError as e:
+            logError('%s: failed to count parse limit: %s\n' % (runId, e))
+    return '''<h3>The file you supplied is too large or complex to read.</h3>
+        <p>%s.</p>
+        <p>Possibly you submitted the wrong file.</p>''' % (parseLimitDescriptions[limit] % parseLimit(limit))
+
+# A binding as read from a binds file: (control name, device, device index, key, [(device, device index, key)] of its
+# modifiers). Attributes that are missing are None, other than device indexes which are 0
+bindingTags = ['Binding', 'Primary', 'Secondary']
+
+# Read the bindings from a binds file in a single pass over its bytes, dropping each control's elements once they have
+# been read, so the whole tree is never held. Returns the bindings in the order they are handled: every Binding, then
+# every Primary, then every Secondary. The stick of a T16000M is renamed once the whole file has been seen.
+# Raises ParseLimitExceeded as soon as the file is found to be over a parse limit; size and the number of elements are
+# checked before parsing starts, from the number of tags that aren't closing tags
+def readBindings(xml):
+    if isinstance(xml, str):
+        xml = xml.encode('utf-8')
+    if len(xml) > parseLimit('bytes'):
+        raise ParseLimitExceeded('bytes')
+    if xml.count(b'<') - xml.count(b'</') > parseLimit('elements'):
+        raise ParseLimitExceeded('elements')
+    maxModifiers = parseLimit('modifiers')
+    deadline = time.monotonic() + parseLimit('seconds')
+    readings = {tag: [] for tag in bindingTags}
+    hasT16000MThrottle = False
+    for (event, element) in etree.iterparse(io.BytesIO(xml), events=('end',), tag=bindingTags, encoding='utf-8', resolve_entities=False):
+        control = element.getparent()
+        if control is None:
+            continue
+        device = element.get('Device')
+        modifierReadings = [(modifier.get('Device'), modifier.get('DeviceIndex', 0), modifier.get('Key')) for modifier in element.iterchildren('Modifier')]
+        if len(modifierReadings) > maxModifiers:
+            raise ParseLimitExceeded('modifiers')
+        if time.monotonic() > deadline:
+            raise ParseLimitExceeded('seconds')
+        if device == 'T16000MTHROTTLE' or any(modifierReading[0] == 'T16000MTHROTTLE' for modifierReading in modifierReadings):
+            hasT16000MThrottle = True
+        readings[element.tag].append((control.tag, device, element.get('DeviceIndex', 0), element.get('Key'), modifierReadings))
+        # Drop the controls that have been read
+        root = control.getparent()
+        if root is not None:
+            while control.getprevious() is not None:
+                del root[0]
+    bindingReadings = readings['Binding'] + readings['Primary'] + readings['Secondary']
+    # Any element may name the throttle, not just a binding. That is rare enough to be looked for separately
+    if not hasT16000MThrottle and b'T16000MTHROTTLE' in xml:
+        hasT16000MThrottle = any(element.get('Device') == 'T16000MTHROTTLE' for (event, element) in etree.iterparse(io.BytesIO(xml), events=('start',), encoding='utf-8', resolve_entities=False))
+
+    # Show a T16000M stick as the FCS if there is a T16000M throttle
+    if hasT16000MThrottle:
+        def fcsDevice(device):
+            return 'T16000MFCS' if device == 'T16000M' else device
+        for (index, (controlName, device, deviceIndex, key, modifierReadings)) in enumerate(bindingReadings):
+            if device == 'T16000M' or any(modifierReading[0] == 'T16000M' for modifierReading in modifierReadings):
+                modifierReadings = [(fcsDevice(modifierDevice), modifierDeviceIndex, modifierKey) for (modifierDevice, modifierDeviceIndex, modifierKey) in modifierReadings]
+                bindingReadings[index] = (controlName, fcsDevice(device), deviceIndex, key, modifierReadings)
+    return bindingReadings
+
+# The identity of a physical key in physicalKeys: its (device, device index, key), with the device index as it would be
+# formatted
+def physicalKeyId(device, deviceIndex, key):
+    return (device, internName(str(deviceIndex)), key)
+
+# The identity of the physical key a modifier is on
+def modifierKeyId(keyModifier):
+    return physicalKeyId(keyModifier['Device'], keyModifier['DeviceIndex'], keyModifier['Key'])
+
+# The same few device names, keys and modifier combinations recur throughout a file, so are held once
+def internName(name):
+    return sys.intern(name) if isinstance(name, str) else name
+
+# A physical key and its binds: the controls (name: control) bound to it for each combination of modifiers, or for
+# 'Unmodified'. Joystick axes have aliases, the identities of their positive and negative directions, as modifiers may be
+# on either
+class PhysicalKey:
+    __slots__ = ('device', 'deviceIndex', 'baseKey', 'key', 'binds', 'axisAliases')
+
+    def __init__(self, device, deviceIndex, baseKey, key):
+        self.device = device
+        self.deviceIndex = deviceIndex
+        # The unaltered key (might be prefixed with Neg_ or Pos_) and the mapped key
+        self.baseKey = baseKey
+        self.key = key
+        self.binds = {}
+        if key is not None and key.startswith('Joy'):
+            self.axisAliases = (physicalKeyId(device, deviceIndex, internName('Pos_' + key)), physicalKeyId(device, deviceIndex, internName('Neg_' + key)))
+        else:
+            self.axisAliases = ()
+
+    # Identifies the key to the render cache, which hashes its repr
+    def __repr__(self):
+        return 'PhysicalKey(%r, %r, %r, %r, %r)' % (self.device, self.deviceIndex, self.baseKey, self.key, self.binds)
+
+    # The key as the dictionary parseBindings used to produce
+    def legacy(self):
+        binds = {modifiersKey: {'Controls': OrderedDict(boundControls)} for modifiersKey, boundControls in self.binds.items()}
+        return {'Device': self.device, 'DeviceIndex': self.deviceIndex, 'BaseKey': self.baseKey, 'Key': self.key, 'Binds': binds}
+
+# The physical keys of a configuration, keyed by physicalKeyId in the order they were added. They are also grouped by
+# (device, device index) as they are added, so each card takes the keys of its own devices rather than filtering them all
+class PhysicalKeys(dict):
+    __slots__ = ('partitions',)
+
+    def __init__(self, items=()):
+        super().__init__()
+        # Each a list of (position, physical key id, physical key)
+        self.partitions = {}
+        for (keyId, physicalKey) in items:
+            self.add(keyId, physicalKey)
+
+    def add(self, keyId, physicalKey):
+        partition = self.partitions.get(keyId[:2])
+        if partition is None:
+            partition = []
+            self.partitions[keyId[:2]] = partition
+        partition.append((len(self), keyId, physicalKey))
+        self[keyId] = physicalKey
+
+    # The physical keys shown on a card: those of its devices, at the given device index or at any if it is None, in the
+    # order they were added
+    def cardKeys(self, imageDevices, deviceIndex=None):
+        if deviceIndex is None:
+            cardPartitions = [partition for ((device, index), partition) in self.partitions.items() if device in imageDevices]
+        else:
+            deviceIndex = str(deviceIndex)
+            cardPartitions = [self.partitions[(device, deviceIndex)] for device in imageDevices if (device, deviceIndex) in self.partitions]
+        if len(cardPartitions) == 1:
+            return {keyId: physicalKey for (position, keyId, physicalKey) in cardPartitions[0]}
+        return {keyId: physicalKey for (position, keyId, physicalKey) in heapq.merge(*cardPartitions)}
+
+# The result of parseBindings with its physical keys as dictionaries keyed by 'device::index::key', as they used to be
+def legacyBindings(physicalKeys, modifiers, devices):
+    legacyPhysicalKeys = {'%s::%s::%s' % keyId: physicalKey.legacy() for keyId, physicalKey in physicalKeys.items()}
+    return (legacyPhysicalKeys, modifiers, devices)
+
+# A control for a name that isn't in bindingsData
+def unknownControl(controlName):
+    control = {}
+    control['Group'] = 'General'
+    control['Name'] = controlName
+    control['Order'] = 999
+    control['HideIfSameAs'] = []
+    control['Type'] = 'Digital'
+    return control
+
+# Parse the bindings in a binds file, returning (physicalKeys, modifiers, devices): the PhysicalKeys with binds; for
+# each modifier, and each combination of them, a list of the modifiers involved; and for each 'device::index' used, its
+# supported device, if any
 def parseBindings(runId, xml, displayGroups, errors):
-    parser = etree.XMLParser(encoding='utf-8', resolve_entities=False)
     try:
-        tree = etree.fromstring(bytes(xml, 'utf-8'), parser=parser)
+        bindingReadings = readBindings(xml)
     except SyntaxError as e:
         errors.errors = '''<h3>There was a problem parsing the file you supplied.</h3>
         <p>%s.</p>
         <p>Possibly you submitted the wrong file, or hand-edited it and made a mistake.</p>''' % html.escape(str(e), quote=True)
-        xml = '<root></root>'
-        tree = etree.fromstring(bytes(xml, 'utf-8'), parser=parser)
+        bindingReadings = []
+    except ParseLimitExceeded as e:
+        errors.errors = parseLimitError(runId, e.limit)
+        bindingReadings = []
     
-    physicalKeys = {}
+    physicalKeys = PhysicalKeys()
     modifiers = {}
+    modifierCombinations = set()
     hotasModifierNum = 1
     keyboardModifierNum = 101
     devices = {}
 
-    if len(tree.findall(".//*[@Device='T16000MTHROTTLE']")) > 0:
-        hasT16000MThrottle = True
-    else:
-        hasT16000MThrottle = False
-
-    xmlBindings = tree.findall(".//Binding") + tree.findall(".//Primary") + tree.findall(".//Secondary")
-    for xmlBinding in xmlBindings:
-        controlName = xmlBinding.getparent().tag
-
-        device = xmlBinding.get('Device')
+    for (controlName, device, deviceIndex, baseKey, modifierReadings) in bindingReadings:
         if device == '{NoDevice}':
             continue
 
-        # Rewrite the device if this is a T16000M stick and we have a T16000M throttle
-        if device == 'T16000M' and hasT16000MThrottle == True:
-            device = 'T16000MFCS'
-
-        deviceIndex = xmlBinding.get('DeviceIndex', 0)
-
-        key = xmlBinding.get('Key')
+        device = internName(device)
+        deviceIndex = internName(deviceIndex)
+        baseKey = internName(baseKey)
+        key = baseKey
         # Remove the Neg_ and Pos_ headers to put digital buttons on analogue devices
         if key is not None:
             if key.startswith('Neg_'):
                 key = key.replace('Neg_', '', 1)
             if key.startswith('Pos_'):
                 key = key.replace('Pos_', '', 1)
+            key = internName(key)
 
-        def modifierSortKey(modifierInfo):
-            modifierDevice = modifierInfo.get('Device')
-            # Rewrite the device if this is a T16000M stick and we have a T16000M throttle
-            if modifierDevice == 'T16000M' and hasT16000MThrottle == True:
-                modifierDevice = 'T16000MFCS'
-            modifierKey = '%s::%s::%s' % (modifierDevice, modifierInfo.get('DeviceIndex', 0), modifierInfo.get('Key'))
-            return modifierKey
+        def modifierSortKey(modifierReading):
+            (modifierDevice, modifierDeviceIndex, modifierKey) = modifierReading
+            return '%s::%s::%s' % (modifierDevice, modifierDeviceIndex, modifierKey)
             
-        modifiersInfo = xmlBinding.findall('Modifier')
-        modifiersInfo = sorted(modifiersInfo, key=modifierSortKey)
+        modifierReadings = sorted(modifierReadings, key=modifierSortKey)
         modifiersKey = 'Unmodified'
-        if modifiersInfo:
-            modifiersKey = ''
-            for modifierInfo in modifiersInfo:
-                modifierKey = modifierSortKey(modifierInfo)
-                if modifiersKey == '':
-                    modifiersKey = modifierKey
-                else:
-                    modifiersKey = '%s/%s' % (modifiersKey, modifierKey)
-            # See if we already have the modifier
-            foundKeyModifier = False
+        if modifierReadings:
+            modifiersKey = internName('/'.join(modifierSortKey(modifierReading) for modifierReading in modifierReadings))
             keyModifiers = modifiers.get(modifiersKey, [])
             # Store it in case it didn't exist prior to the above call
             modifiers[modifiersKey] = keyModifiers
-            for keyModifier in keyModifiers:
-                if keyModifier.get('ModifierKey') == modifiersKey:
-                    foundKeyModifier = True
-                    break
-            if not foundKeyModifier:
+            # See if we already have the modifier
+            if modifiersKey not in modifierCombinations:
+                modifierCombinations.add(modifiersKey)
                 # Create individual modifiers
-                for modifierInfo in modifiersInfo:
+                for modifierReading in modifierReadings:
+                    (modifierDevice, modifierDeviceIndex, modifierKey) = modifierReading
                     modifier = {}
                     modifier['ModifierKey'] = modifiersKey
-                    modifierDevice = modifierInfo.get('Device')
-                    # Rewrite the device if this is a T16000M stick and we have a T16000M throttle
-                    if modifierDevice == 'T16000M' and hasT16000MThrottle == True:
-                        modifierDevice = 'T16000MFCS'
                     if modifierDevice == 'Keyboard':
                         modifier['Number'] = keyboardModifierNum
                     else:
                         modifier['Number'] = hotasModifierNum
-                    modifier['Device'] = modifierDevice
-                    modifier['DeviceIndex'] = modifierInfo.get('DeviceIndex', 0)
-                    modifier['Key'] = modifierInfo.get('Key')
-                    modifierKey = '%s::%s::%s' % (modifierDevice, modifierInfo.get('DeviceIndex', 0), modifierInfo.get('Key'))
-                    updatedModifiers = modifiers.get(modifierKey, [])
+                    modifier['Device'] = internName(modifierDevice)
+                    modifier['DeviceIndex'] = internName(modifierDeviceIndex)
+                    modifier['Key'] = internName(modifierKey)
+                    updatedModifiers = modifiers.get(modifierSortKey(modifierReading), [])
                     updatedModifiers.append(modifier)
-                    modifiers[modifierKey] = updatedModifiers
+                    modifiers[modifierSortKey(modifierReading)] = updatedModifiers
                 if '/' in modifiersKey:
                     # Also need to add composite modifier
                     modifier = {}
                     modifier['ModifierKey'] = modifiersKey
-                    modifierDevice = modifierInfo.get('Device')
-                    # Rewrite the device if this is a T16000M stick and we have a T16000M throttle
-                    if modifierDevice == 'T16000M' and hasT16000MThrottle == True:
-                        modifierDevice = 'T16000MFCS'
                     if modifierDevice == 'Keyboard':
                         modifier['Number'] = keyboardModifierNum
                     else:
                         modifier['Number'] = hotasModifierNum
                     keyModifiers.append(modifier)
-                if modifierInfo.get('Device') == 'Keyboard':
+                if modifierDevice == 'Keyboard':
                     keyboardModifierNum = keyboardModifierNum + 1
                 else:
                     hotasModifierNum = hotasModifierNum + 1
-        control = controls.get(controlName)
-        if control is None:
-            logError('%s: No control for %s\n' % (runId, controlName))
-            control = {}
-            control['Group'] = 'General'
-            control['Name'] = controlName
-            control['Order'] = 999
-            control['HideIfSameAs'] = []
-            control['Type'] = 'Digital'
+        control = controls.get(controlName) or unknownControl(controlName)
         if control['Group'] not in displayGroups:
             # The user isn't interested in this control group so drop it
             continue
 
-        itemKey = '%s::%s::%s' % (device, deviceIndex, key)
+        itemKey = physicalKeyId(device, deviceIndex, key)
         deviceKey = '%s::%s' % (device, deviceIndex)
         # Obtain the relevant supported device
-        thisDevice = None
-        for supportedDevice in supportedDevices.values():
-            if device in supportedDevice['HandledDevices']:
-                thisDevice = supportedDevice
-                break
-        devices[deviceKey] = thisDevice
+        devices[deviceKey] = supportedDeviceFor(device)
         physicalKey = physicalKeys.get(itemKey)
         if physicalKey is None:
-            physicalKey = {}
-            physicalKey['Device'] = device
-            physicalKey['DeviceIndex'] = deviceIndex
-            # Get the unaltered key (might be prefixed with Neg_ or Pos_) and the mapped key
-            physicalKey['BaseKey'] = xmlBinding.get('Key')
-            physicalKey['Key'] = key
-            physicalKey['Binds'] = {}
-            physicalKeys[itemKey] = physicalKey
-        bind = physicalKey['Binds'].get(modifiersKey)
-        if bind is None:
-            bind = {}
-            bind['Controls'] = OrderedDict()
-            physicalKey['Binds'][modifiersKey] = bind
-        bind['Controls'][controlName] = control
+            physicalKey = PhysicalKey(device, deviceIndex, baseKey, key)
+            physicalKeys.add(itemKey, physicalKey)
+        boundControls = physicalKey.binds.get(modifiersKey)
+        if boundControls is None:
+            boundControls = {}
+            physicalKey.binds[modifiersKey] = boundControls
+        boundControls[controlName] = control
 
     return (physicalKeys, modifiers, devices)
 
@@ -1070,11 +2606,18 @@ def parseForm(form):
         description = ''
     return (displayGroups, styling, description)
     
+# Format for the device cards: 'jpg' images drawn on the server by default, or 'svg' cards laid out over the templates
+def parseCardFormat(form):
+    if form.getvalue('format') == 'svg':
+        return 'svg'
+    return 'jpg'
+
 def determineMode(form):
     deviceForBlockImage = form.getvalue('blocks')
     wantList = form.getvalue('list')
     wantDeviceList = form.getvalue('devicelist')
     runIdToReplay = form.getvalue('replay')
+    cardToRender = form.getvalue('render')
     description = form.getvalue('description')
     if description is None:
         description = ''
@@ -1087,13 +2630,80 @@ def determineMode(form):
         mode = Mode.list
     elif wantDeviceList is not None:
         mode = Mode.listDevices
+    elif cardToRender is not None:
+        mode = Mode.render
     elif runIdToReplay is not None:
         mode = Mode.replay
     else:
         mode = Mode.generate
     return mode
 
-def saveReplayInfo(config, description, styling, displayGroups, devices, errors):
+# The record of a public configuration is kept beside its binds file as JSON, with a format number. Along with its
+# settings and warnings it lists the cards that were created, so that replays can be shown from it alone while those
+# cards are still there, and the keys of its devices, whose entries in bindingsData are looked up again when needed.
+# Configurations published before these records have their replay info pickled instead, with the whole entry for each
+# device; these are still read, and migrateReplays.py turns them into records
+replayRecordFormat = 1
+
+# The fields of a replay record, with their defaults. A record leaves out those that have their default, as most of the
+# warnings do, and these are also the defaults for replay info from earlier versions
+replayRecordDefaults = {
+    'description': '',
+    'timestamp': None,
+    'styling': 'None',
+    'displayGroups': ['Galaxy map', 'General', 'Head look', 'SRV', 'Ship', 'UI'],
+    'devices': [],
+    'createdImages': None,
+    'misconfigurationWarnings': '',
+    'unhandledDevicesWarnings': '',
+    'deviceWarnings': '',
+}
+
+# Pickled replay info only holds plain data and datetimes, so nothing else is loaded from it
+class ReplayUnpickler(pickle.Unpickler):
+    allowedGlobals = {('datetime', 'datetime'), ('datetime', 'timezone'), ('datetime', 'timedelta'), ('collections', 'OrderedDict')}
+
+    def find_class(self, module, name):
+        if (module, name) in ReplayUnpickler.allowedGlobals:
+            return super().find_class(module, name)
+        raise pickle.UnpicklingError('%s.%s is not allowed in replay info' % (module, name))
+
+# The record of some replay info, which may be from an earlier version, as plain data
+def replayRecord(replayInfo):
+    fields = dict(replayInfo)
+    if 'misconfigurationWarnings' not in fields:
+        fields['misconfigurationWarnings'] = fields.get('warnings', '')
+    fields['devices'] = list(fields.get('devices', []))
+    if fields.get('timestamp') is not None:
+        fields['timestamp'] = fields['timestamp'].isoformat()
+    record = {'format': replayRecordFormat}
+    for (field, default) in replayRecordDefaults.items():
+        if fields.get(field, default) != default:
+            record[field] = fields[field]
+    return record
+
+# Replay info from a record, with the defaults of any fields it doesn't have
+def replayInfoFromRecord(record):
+    if record.get('format') != replayRecordFormat:
+        raise ValueError('Unknown replay record format %r' % record.get('format'))
+    replayInfo = dict(replayRecordDefaults)
+    replayInfo.update(record)
+    del replayInfo['format']
+    for (field, default) in replayRecordDefaults.items():
+        # Each gets its own copy of a default list
+        if replayInfo[field] is default and type(default) is list:
+            replayInfo[field] = list(default)
+    if replayInfo['timestamp'] is not None:
+        replayInfo['timestamp'] = parseTimestamp(replayInfo['timestamp'])
+    return replayInfo
+
+# Write a record in place of whatever was there, all at once, as replays are read while they are published and migrated
+def writeReplayRecord(path, record):
+    tempPath = path.with_name(path.name + '.tmp')
+    tempPath.write_text(json.dumps(record, ensure_ascii=False, separators=(',', ':')), encoding='utf-8')
+    tempPath.replace(path)
+
+def saveReplayInfo(config, description, styling, displayGroups, devices, errors, createdImages=None):
     replayInfo = {}
     replayInfo['displayGroups'] = displayGroups
     replayInfo['misconfigurationWarnings'] = errors.misconfigurationWarnings
@@ -1102,20 +2712,90 @@ def saveReplayInfo(config, description, styling, displayGroups, devices, errors)
     replayInfo['styling'] = styling
     replayInfo['description'] = description
     replayInfo['timestamp'] = datetime.datetime.now(datetime.timezone.utc)
-    replayInfo['devices'] = devices
-    replayPath = config.pathWithSuffix('.replay')
-    with replayPath.open('wb') as pickleFile:
-        pickle.dump(replayInfo, pickleFile)
+    replayInfo['devices'] = list(devices)
+    replayInfo['createdImages'] = createdImages
+    writeReplayRecord(config.pathWithSuffix('.replay'), replayRecord(replayInfo))
+    try:
+        configIndex = openConfigIndex()
+        if configIndex is not None:
+            # An index that isn't current is left for the rebuild, which reads this replay
+            with configIndex:
+                configIndex.execute('BEGIN IMMEDIATE')
+                if configIndexIsCurrent(configIndex):
+                    indexConfig(configIndex, dict(replayInfo, runID=config.name))
+                    advanceConfigGeneration(configIndex)
+            configIndex.close()
+    except (sqlite3.Error, ValueError) as e:
+        logError('%s: Unable to index configuration: %s\n' % (config.name, e))
+
+# Whether a replay can be shown from the cards listed in its record, without its bindings. They must all still be there,
+# unless cards are rendered when they are first requested
+def replayCardsExist(config, createdImages, cardFormat):
+    if not createdImages or any(createdImageDevice(createdImage)[0] not in supportedDevices for createdImage in createdImages):
+        return False
+    if renderOnDemand():
+        return True
+    return all(path.exists() for createdImage in createdImages for path in cardFiles(config, createdImage, cardFormat))
 
+# Parse a binds file with every display group, in the form of legacyBindings
 def parseLocalFile(filePath):
     displayGroups = groupStyles.keys()
     styling = 'None'  # Yes we do mean a string 'None'
     config = Config('000000')
     errors = Errors()
-    with filePath.open() as f:
-        xml = f.read()
-        (physicalKeys, modifiers, devices) = parseBindings(config.name, xml, displayGroups, errors)
-        return ((physicalKeys, modifiers, devices), errors)
+    xml = filePath.read_bytes()
+    (physicalKeys, modifiers, devices) = parseBindings(config.name, xml, displayGroups, errors)
+    return (legacyBindings(physicalKeys, modifiers, devices), errors)
+
+# Lint section
+
+# Devices used for head tracking rather than for controls, which aren't reported as unsupported: Arduino Leonardo, vJoy
+# (Tobii Eyex) and 16D00AEA (EDTracker), along with the mouse
+lintIgnoredDevices = {'Mouse::0', 'ArduinoLeonardo::0', 'vJoy::0', 'vJoy::1', '16D00AEA::0'}
+
+# Check parsed bindings for problems, without rendering anything. Returns the problems as a list of (check, name) in the
+# order they are reported, where check is one of:
+#   'misconfigured': the name of a digital control on an analogue axis of a card's device
+#   'mappingSoftware': a 'device::index' that is mapped through the ThrustMaster TARGET software
+#   'unsupportedDevice': a 'device::index' that isn't supported
+#   'unknownControl': a control in the binds file that isn't in bindingsData
+def lintBindings(physicalKeys, modifiers, devices):
+    if not isinstance(physicalKeys, PhysicalKeys):
+        physicalKeys = PhysicalKeys(physicalKeys.items())
+    lint = []
+    for (supportedDeviceKey, deviceIndex) in cardDevices(devices):
+        imageDevices = supportedDevices[supportedDeviceKey]['HandledDevices']
+        for controlName in findMisconfiguredControls(physicalKeys.cardKeys(imageDevices, deviceIndex), imageDevices, deviceIndex):
+            lint.append(('misconfigured', controlName))
+    for deviceKey, device in devices.items():
+        if device is None and deviceKey not in lintIgnoredDevices:
+            lint.append(('unsupportedDevice', deviceKey))
+        if device is not None and 'ThrustMasterWarthogCombined' in device['HandledDevices']:
+            lint.append(('mappingSoftware', deviceKey))
+    unknownControls = set()
+    for physicalKey in physicalKeys.values():
+        for boundControls in physicalKey.binds.values():
+            for controlName in boundControls:
+                if controlName not in controls and controlName not in unknownControls:
+                    unknownControls.add(controlName)
+                    lint.append(('unknownControl', controlName))
+    return lint
+
+# Show the problems found by lintBindings as warnings, in place of any already there, and log those that are only logged
+def applyLint(runId, lint, errors):
+    errors.misconfigurationWarnings = ''
+    errors.deviceWarnings = ''
+    errors.unhandledDevicesWarnings = ''
+    for (check, name) in lint:
+        if check == 'misconfigured':
+            errors.misconfigurationWarnings = addMisconfigurationWarning(errors.misconfigurationWarnings, name)
+        elif check == 'mappingSoftware':
+            errors.deviceWarnings = '<h2>Mapping Software Detected</h2>You are using the ThrustMaster TARGET software. As a result it is possible that not all of the controls will show up. If you have missing controls then you should remove the mapping from TARGET and map them using Elite\'s own configuration UI.'
+        elif check == 'unsupportedDevice':
+            logError('%s: found unsupported device %s\n' % (runId, name))
+            errors.unhandledDevicesWarnings = '<h1>Unknown controller detected</h1>You have a device that is not supported at this time. Please report details of your device by following the link at the bottom of this page supplying the reference "%s" and we will attempt to add support for it.' % runId
+        elif check == 'unknownControl':
+            logError('%s: No control for %s\n' % (runId, name))
 
 # API section
 
@@ -1130,46 +2810,49 @@ def processForm(form):
     
     deviceForBlockImage = form.getvalue('blocks')
     mode = determineMode(form)
+    if mode is Mode.render:
+        serveCard(form.getvalue('render'))
+        return
     if mode is Mode.invalid:
         errors.errors = 'That is not a valid description. Leading punctuation is not allowed.</h1>'
-        xml = '<root></root>'        
+        xml = b'<root></root>'        
     elif mode is Mode.blocks:
         try:
             deviceForBlockImage = form.getvalue('blocks')
             createBlockImage(deviceForBlockImage)
         except KeyError:
             errors.errors = '<h1>%s is not a supported controller.</h1>' % deviceForBlockImage
-            xml = '<root></root>'
+            xml = b'<root></root>'
         createdImages = []
     elif mode is Mode.replay:
         fileitem = {}
         runId = form.getvalue('replay')
         public = True
+        replayCards = None
         try:
             config = Config(runId)
             bindsPath = config.pathWithSuffix('.binds')
             replayPath = config.pathWithSuffix('.replay')
             if not (bindsPath.exists() and replayPath.exists):
                 raise FileNotFoundError
-            with codecs.open(str(bindsPath), 'r', 'utf-8') as fileInput:
-                xml = fileInput.read()
+            # Parsed below, from the parse saved with the configuration if there is one
+            xml = None
             try:
-                with replayPath.open("rb") as pickleFile:
-                    replayInfo = pickle.load(pickleFile)
-                    displayGroups =  replayInfo.get('displayGroups', ['Galaxy map', 'General', 'Head look', 'SRV', 'Ship', 'UI'])
-                    errors.misconfigurationWarnings = replayInfo.get('misconfigurationWarnings', replayInfo.get('warnings', ''))
-                    errors.deviceWarnings = replayInfo.get('deviceWarnings', '')
-                    errors.unhandledDevicesWarnings = ''
-                    styling = replayInfo.get('styling', 'None')
-                    description = replayInfo.get('description', '')
-                    timestamp = replayInfo.get('timestamp')
-                    # devices = replayInfo['devices']
+                replayInfo = Config.loadReplay(replayPath)
+                displayGroups = replayInfo['displayGroups']
+                errors.misconfigurationWarnings = replayInfo['misconfigurationWarnings']
+                errors.deviceWarnings = replayInfo['deviceWarnings']
+                errors.unhandledDevicesWarnings = ''
+                styling = replayInfo['styling']
+                description = replayInfo['description']
+                timestamp = replayInfo['timestamp']
+                replayCards = replayInfo['createdImages']
             except FileNotFoundError:
                 displayGroups = ['Galaxy map', 'General', 'Head look', 'SRV', 'Ship', 'UI']
-        except (ValueError, FileNotFoundError):
+        except (ValueError, FileNotFoundError, pickle.UnpicklingError):
             errors.errors = '<h1>Configuration "%s" not found</h1>' % runId
             displayGroups = ['Galaxy map', 'General', 'Head look', 'SRV', 'Ship', 'UI']
-            xml = '<root></root>'
+            xml = b'<root></root>'
     elif mode is Mode.generate:
         config = Config.newRandom()
         config.makeDir()
@@ -1179,12 +2862,14 @@ def processForm(form):
         xml = form.getvalue('bindings')
         if xml is None or xml == b'':
             errors.errors = '<h1>No bindings file supplied; please go back and select your binds file as per the instructions.</h1>'
-            xml = '<root></root>'
+            xml = b'<root></root>'
+        elif len(xml) > parseLimit('bytes'):
+            # Refused before it is kept
+            errors.errors = parseLimitError(runId, 'bytes')
+            xml = b'<root></root>'
         else:
-            xml = xml.decode(encoding='utf-8')
-            bindsPath = config.pathWithSuffix('.binds')
-            with codecs.open(str(bindsPath), 'w', 'utf-8') as xmlOutput:
-                xmlOutput.write(xml)
+            # Kept as uploaded, and parsed from the bytes
+            config.pathWithSuffix('.binds').write_bytes(xml)
         
         public = len(description) > 0
     elif mode is Mode.list:
@@ -1193,67 +2878,81 @@ def processForm(form):
             if type(deviceFilters) is not type([]):
                 deviceFilters = [ deviceFilters ]
             options['controllers'] = set(deviceFilters)
+        order = form.getfirst('order')
+        if order in listOrders:
+            options['order'] = order
+        for direction in ['after', 'before']:
+            key = decodeListKey(form.getfirst(direction, ''))
+            if key is not None:
+                options[direction] = key
+                break
+        try:
+            options['pageSize'] = min(max(int(form.getfirst('count')), 1), listPageSizeMax)
+        except (TypeError, ValueError):
+            pass
 
     if mode is Mode.replay or mode is Mode.generate:
-        (physicalKeys, modifiers, devices) = parseBindings(runId, xml, displayGroups, errors)
-        
-        alreadyHandledDevices = []
-        createdImages = []
-        for supportedDeviceKey, supportedDevice in supportedDevices.items():
-            if supportedDeviceKey == 'Keyboard':
-                # We handle the keyboard separately below
-                continue
-
-            for deviceIndex in [0, 1]:
-                # See if we handle this device
-                handled = False
-                for handledDevice in supportedDevice.get('KeyDevices', supportedDevice.get('HandledDevices')):
-                    if devices.get('%s::%s' % (handledDevice, deviceIndex)) is not None:
-                        handled = True
-                        break
-
-                if handled is True:
-                    # See if we have any new bindings for this device
-                    hasNewBindings = False
-                    for device in supportedDevice.get('KeyDevices', supportedDevice.get('HandledDevices')):
-                        deviceKey = '%s::%s' % (device, deviceIndex)
-                        if deviceKey not in alreadyHandledDevices:
-                            hasNewBindings = True
-                            break
-                    if hasNewBindings is True:
-                        createHOTASImage(physicalKeys, modifiers, supportedDevice['Template'], supportedDevice['HandledDevices'], 40, config, public, styling, deviceIndex, errors.misconfigurationWarnings)
-                        createdImages.append('%s::%s' % (supportedDeviceKey, deviceIndex))
-                        for handledDevice in supportedDevice['HandledDevices']:
-                            alreadyHandledDevices.append('%s::%s' % (handledDevice, deviceIndex))
-        
-        if devices.get('Keyboard::0') is not None:
-            appendKeyboardImage(createdImages, physicalKeys, modifiers, displayGroups, runId, public)
+        cardFormat = parseCardFormat(form)
+        options['cardFormat'] = cardFormat
+
+    if mode is Mode.replay and xml is None and replayCardsExist(config, replayCards, cardFormat):
+        # All of the cards are there, so the page comes from the replay record without looking at the bindings
+        createdImages = replayCards
+        errors.unhandledDevicesWarnings = replayInfo.get('unhandledDevicesWarnings', '')
+    elif mode is Mode.replay or mode is Mode.generate:
+        if xml is None:
+            ((physicalKeys, modifiers, devices), lint) = parseConfigBindings(config, displayGroups, errors)
+        else:
+            (physicalKeys, modifiers, devices) = parseBindings(runId, xml, displayGroups, errors)
+            lint = lintBindings(physicalKeys, modifiers, devices)
+            if mode is Mode.generate and not errors.errors:
+                saveParsedBindings(config, displayGroups, (physicalKeys, modifiers, devices), lint)
+        applyLint(runId, lint, errors)
         
-        for deviceKey, device in devices.items():
-            # Arduino Leonardo is used for head tracking so ignore it, along with vJoy (Tobii Eyex) and 16D00AEA (EDTracker)
-            if device is None and deviceKey != 'Mouse::0' and deviceKey != 'ArduinoLeonardo::0' and deviceKey != 'vJoy::0' and deviceKey != 'vJoy::1' and deviceKey != '16D00AEA::0':
-                logError('%s: found unsupported device %s\n' % (runId, deviceKey))
-                if errors.unhandledDevicesWarnings  == '':
-                    errors.unhandledDevicesWarnings = '<h1>Unknown controller detected</h1>You have a device that is not supported at this time. Please report details of your device by following the link at the bottom of this page supplying the reference "%s" and we will attempt to add support for it.' % runId
-            if device is not None and 'ThrustMasterWarthogCombined' in device['HandledDevices'] and errors.deviceWarnings == '':
-                errors.deviceWarnings = '<h2>Mapping Software Detected</h2>You are using the ThrustMaster TARGET software. As a result it is possible that not all of the controls will show up. If you have missing controls then you should remove the mapping from TARGET and map them using Elite\'s own configuration UI.'
+        cards = cardJobs(physicalKeys, modifiers, devices, displayGroups, config, public, styling, cardFormat)
+        createdImages = [createdImage for (createdImage, name, job) in cards]
+        if not renderOnDemand():
+            # Otherwise cards are rendered when they are first requested
+            renderImages([job for (createdImage, name, job) in cards])
         
         if len(createdImages) == 0 and errors.misconfigurationWarnings == '' and errors.unhandledDevicesWarnings == '' and errors.errors == '':
             errors.errors = '<h1>The file supplied does not have any bindings for a supported controller or keyboard.</h1>'
     
     # Save variables for later replays
     if (mode is Mode.generate and public):
-        saveReplayInfo(config, description, styling, displayGroups, devices, errors)
+        saveReplayInfo(config, description, styling, displayGroups, devices, errors, createdImages)
+    if mode is Mode.generate and renderOnDemand():
+        saveRenderSettings(config, displayGroups, styling, public)
 
-    printHTML(mode, options, config, public, createdImages, deviceForBlockImage, errors)
+    if mode is Mode.list or mode is Mode.listDevices:
+        serveCachedPage(mode, options, lambda: printPage(mode, options, config, public, createdImages, deviceForBlockImage, errors))
+    else:
+        printHTML(mode, options, config, public, createdImages, deviceForBlockImage, errors)
 
 def logError(message):
-    sys.stderr.write("EDRefCard: %s", message)
+    sys.stderr.write("EDRefCard: %s" % message)
+
+# Whether a request is too large to hold a binds file within the byte limit, judged from its length before it is read.
+# The rest of the form is allowed for with some headroom
+def requestTooLarge():
+    try:
+        return int(os.environ.get('CONTENT_LENGTH', 0)) > parseLimit('bytes') + 65536
+    except ValueError:
+        return False
 
 def main():
     cgitb.enable()
+    if requestTooLarge():
+        config = Config.newRandom()
+        printHTML(Mode.generate, {}, config, False, [], None, Errors(errors=parseLimitError(config.name, 'bytes')))
+        return
+    metricsCachePath = fontMetricsCachePath()
+    if metricsCachePath is not None:
+        fontMetricsCache.load(metricsCachePath)
     form = cgi.FieldStorage()
     processForm(form)
+    if metricsCachePath is not None and len(fontMetricsCache.measured) > 0:
+        fontMetricsCache.save(metricsCachePath)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+'''
+Text measurement straight from the tables of the OpenType fonts in www/fonts.
+
+Each font is read once per process; after that measuring a piece of text is arithmetic on glyph advances, with no call
+in to ImageMagick. The numbers follow what ImageMagick's FreeType renderer reports for a single line of text at the
+default 72dpi: advances are grid-fitted to whole pixels, the line height is rounded, and the ascender and descender are
+rounded out to whole pixels, as FreeType does for the size metrics.
+
+Kerning isn't applied. ImageMagick only kerns with the legacy 'kern' table, which the Exo2 fonts don't have; their
+kerning is in GPOS, which it doesn't read unless it is built with libraqm. The bounds (x1, y1, x2, y2) are those of the
+line rather than of the glyph outlines, which aren't read; nothing in the cards uses them.
+'''
+
+import struct
+from collections import namedtuple
+
+# Same fields, in the same order, as wand's FontMetrics
+TextMetrics = namedtuple('TextMetrics', (
+    'character_width', 'character_height', 'ascender', 'descender', 'text_width', 'text_height',
+    'maximum_horizontal_advance', 'x1', 'y1', 'x2', 'y2', 'x', 'y'
+))
+
+
+class FontTables:
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fontFile:
+            self.data = fontFile.read()
+        self.tables = self.readTableDirectory()
+        self.readHead()
+        self.readHhea()
+        self.advances = self.readHmtx()
+        self.cmap = self.readCmap()
+        # The font data is only needed while reading the tables
+        self.data = None
+
+    def __repr__(self):
+        return "FontTables('%s')" % self.path
+
+    def readTableDirectory(self):
+        (sfntVersion, numTables) = struct.unpack_from('>4sH', self.data, 0)
+        if sfntVersion not in (b'OTTO', b'\x00\x01\x00\x00', b'true'):
+            raise ValueError('%s is not an OpenType font' % self.path)
+        tables = {}
+        for i in range(numTables):
+            (tag, checksum, offset, length) = struct.unpack_from('>4sIII', self.data, 12 + 16 * i)
+            tables[tag.decode('latin-1')] = offset
+        return tables
+
+    def readHead(self):
+        self.unitsPerEm = struct.unpack_from('>H', self.data, self.tables['head'] + 18)[0]
+
+    def readHhea(self):
+        offset = self.tables['hhea']
+        (self.ascender, self.descender, self.lineGap, self.advanceWidthMax) = struct.unpack_from('>hhhH', self.data, offset + 4)
+        self.numberOfHMetrics = struct.unpack_from('>H', self.data, offset + 34)[0]
+        # As FreeType: fall back to the typographic metrics if hhea doesn't supply any
+        if self.ascender == 0 and self.descender == 0 and 'OS/2' in self.tables:
+            (self.ascender, self.descender, self.lineGap) = struct.unpack_from('>hhh', self.data, self.tables['OS/2'] + 68)
+        self.height = self.ascender - self.descender + self.lineGap
+
+    def readHmtx(self):
+        offset = self.tables['hmtx']
+        numGlyphs = struct.unpack_from('>H', self.data, self.tables['maxp'] + 4)[0]
+        advances = [struct.unpack_from('>H', self.data, offset + 4 * i)[0] for i in range(self.numberOfHMetrics)]
+        # Glyphs past the end of the long metrics share the last advance
+        advances.extend([advances[-1]] * (numGlyphs - self.numberOfHMetrics))
+        return advances
+
+    def readCmap(self):
+        offset = self.tables['cmap']
+        numSubtables = struct.unpack_from('>H', self.data, offset + 2)[0]
+        subtables = {}
+        for i in range(numSubtables):
+            (platformID, encodingID, subtableOffset) = struct.unpack_from('>HHI', self.data, offset + 4 + 8 * i)
+            subtables[(platformID, encodingID)] = offset + subtableOffset
+        # Prefer full Unicode, then the Unicode BMP
+        for encoding in [(3, 10), (0, 4), (0, 6), (3, 1), (0, 3), (0, 2), (0, 1), (0, 0)]:
+            if encoding in subtables:
+                subtableOffset = subtables[encoding]
+                format = struct.unpack_from('>H', self.data, subtableOffset)[0]
+                if format == 4:
+                    return self.readCmapFormat4(subtableOffset)
+                if format == 12:
+                    return self.readCmapFormat12(subtableOffset)
+        raise ValueError('%s has no usable Unicode character map' % self.path)
+
+    def readCmapFormat4(self, offset):
+        segCountX2 = struct.unpack_from('>H', self.data, offset + 6)[0]
+        segCount = segCountX2 // 2
+        endCodes = struct.unpack_from('>%dH' % segCount, self.data, offset + 14)
+        startCodes = struct.unpack_from('>%dH' % segCount, self.data, offset + 16 + segCountX2)
+        idDeltas = struct.unpack_from('>%dh' % segCount, self.data, offset + 16 + 2 * segCountX2)
+        idRangeOffsetsOffset = offset + 16 + 3 * segCountX2
+        idRangeOffsets = struct.unpack_from('>%dH' % segCount, self.data, idRangeOffsetsOffset)
+        cmap = {}
+        for i in range(segCount):
+            for code in range(startCodes[i], endCodes[i] + 1):
+                if code == 0xFFFF:
+                    continue
+                if idRangeOffsets[i] == 0:
+                    glyph = (code + idDeltas[i]) & 0xFFFF
+                else:
+                    glyphOffset = idRangeOffsetsOffset + 2 * i + idRangeOffsets[i] + 2 * (code - startCodes[i])
+                    glyph = struct.unpack_from('>H', self.data, glyphOffset)[0]
+                    if glyph != 0:
+                        glyph = (glyph + idDeltas[i]) & 0xFFFF
+                if glyph != 0:
+                    cmap[code] = glyph
+        return cmap
+
+    def readCmapFormat12(self, offset):
+        numGroups = struct.unpack_from('>I', self.data, offset + 12)[0]
+        cmap = {}
+        for i in range(numGroups):
+            (startCode, endCode, startGlyph) = struct.unpack_from('>III', self.data, offset + 16 + 12 * i)
+            for code in range(startCode, endCode + 1):
+                cmap[code] = startGlyph + code - startCode
+        return cmap
+
+    def glyphIndex(self, character):
+        return self.cmap.get(ord(character), 0)
+
+    # FreeType's 16.16 scale from font units to 26.6 fixed point pixels for a (72dpi) font size
+    def scale(self, fontSize):
+        return (int(fontSize * 64) * 65536 + self.unitsPerEm // 2) // self.unitsPerEm
+
+    def metrics(self, text, fontSize):
+        scale = self.scale(fontSize)
+        # FT_MulFix: scale a value in font units to 26.6 fixed point, rounding to the nearest 1/64th
+        mulFix = lambda value: (abs(value) * scale + 0x8000) >> 16 if value >= 0 else -((abs(value) * scale + 0x8000) >> 16)
+        # Round 26.6 fixed point to whole pixels
+        pixelRound = lambda value: (value + 32) >> 6
+        penX = 0
+        for character in text:
+            glyph = self.glyphIndex(character)
+            # Advances are grid-fitted whenever hinting is on, which it always is for us
+            penX = penX + pixelRound(mulFix(self.advances[glyph]))
+        ppem = pixelRound(int(fontSize * 64))
+        # FT_PIX_CEIL and FT_PIX_FLOOR
+        ascender = ((mulFix(self.ascender) + 63) & -64) / 64.0
+        descender = (mulFix(self.descender) & -64) / 64.0
+        height = pixelRound(mulFix(self.height))
+        maximumAdvance = pixelRound(mulFix(self.advanceWidthMax))
+        # Bounds come from the glyph outlines, which we don't read; approximate them with the line box
+        return TextMetrics(ppem, ppem, ascender, descender, penX, height, maximumAdvance, 0, descender, penX, ascender, penX, 0)
+
+
+loadedFonts = {}
+
+# Obtain the (shared) tables for a font, or None if it can't be read
+def fontTables(path):
+    if path not in loadedFonts:
+        try:
+            loadedFonts[path] = FontTables(path)
+        except (OSError, ValueError, KeyError, struct.error):
+            loadedFonts[path] = None
+    return loadedFonts[path]
+
+# Measure a single line of text, or return None if the font can't be measured this way
+def textMetrics(fontPath, fontSize, text):
+    tables = fontTables(fontPath)
+    if tables is None:
+        return None
+    return tables.metrics(text, fontSize)
@@ -0,0 +1,509 @@
+#!/usr/bin/env python3
+
+'''
+Patching of baseline JPEGs at the level of their compressed data.
+
+A template is transcoded once, losslessly, in to a stream whose restart intervals are "tiles": fixed runs of MCUs along
+an MCU row. Each tile is then a self-contained piece of entropy-coded data that can be copied verbatim, so a finished card
+only needs the tiles that have something drawn on them to be encoded again. Those tiles are encoded separately (by
+ImageMagick, using the template's quantisation tables and the standard Huffman tables) and spliced in to the template's
+stream in place of the original tiles.
+'''
+
+import struct
+
+SOI = 0xD8
+EOI = 0xD9
+SOS = 0xDA
+DQT = 0xDB
+DHT = 0xC4
+DRI = 0xDD
+SOF0 = 0xC0
+SOF1 = 0xC1
+RST0 = 0xD0
+
+# Order in which the coefficients of a block are stored in DQT segments
+zigzag = [
+    0, 1, 8, 16, 9, 2, 3, 10, 17, 24, 32, 25, 18, 11, 4, 5,
+    12, 19, 26, 33, 40, 48, 41, 34, 27, 20, 13, 6, 7, 14, 21, 28,
+    35, 42, 49, 56, 57, 50, 43, 36, 29, 22, 15, 23, 30, 37, 44, 51,
+    58, 59, 52, 45, 38, 31, 39, 46, 53, 60, 61, 54, 47, 55, 62, 63,
+]
+
+# The typical Huffman tables from Annex K of the JPEG standard, as (code length counts, symbols).
+# These are what libjpeg uses when it isn't optimising, and they can code every symbol
+standardDCLuminance = (
+    (0, 1, 5, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0),
+    (0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11),
+)
+standardDCChrominance = (
+    (0, 3, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0),
+    (0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11),
+)
+standardACLuminance = (
+    (0, 2, 1, 3, 3, 2, 4, 3, 5, 5, 4, 4, 0, 0, 1, 0x7d),
+    (
+        0x01, 0x02, 0x03, 0x00, 0x04, 0x11, 0x05, 0x12, 0x21, 0x31, 0x41, 0x06, 0x13, 0x51, 0x61, 0x07,
+        0x22, 0x71, 0x14, 0x32, 0x81, 0x91, 0xa1, 0x08, 0x23, 0x42, 0xb1, 0xc1, 0x15, 0x52, 0xd1, 0xf0,
+        0x24, 0x33, 0x62, 0x72, 0x82, 0x09, 0x0a, 0x16, 0x17, 0x18, 0x19, 0x1a, 0x25, 0x26, 0x27, 0x28,
+        0x29, 0x2a, 0x34, 0x35, 0x36, 0x37, 0x38, 0x39, 0x3a, 0x43, 0x44, 0x45, 0x46, 0x47, 0x48, 0x49,
+        0x4a, 0x53, 0x54, 0x55, 0x56, 0x57, 0x58, 0x59, 0x5a, 0x63, 0x64, 0x65, 0x66, 0x67, 0x68, 0x69,
+        0x6a, 0x73, 0x74, 0x75, 0x76, 0x77, 0x78, 0x79, 0x7a, 0x83, 0x84, 0x85, 0x86, 0x87, 0x88, 0x89,
+        0x8a, 0x92, 0x93, 0x94, 0x95, 0x96, 0x97, 0x98, 0x99, 0x9a, 0xa2, 0xa3, 0xa4, 0xa5, 0xa6, 0xa7,
+        0xa8, 0xa9, 0xaa, 0xb2, 0xb3, 0xb4, 0xb5, 0xb6, 0xb7, 0xb8, 0xb9, 0xba, 0xc2, 0xc3, 0xc4, 0xc5,
+        0xc6, 0xc7, 0xc8, 0xc9, 0xca, 0xd2, 0xd3, 0xd4, 0xd5, 0xd6, 0xd7, 0xd8, 0xd9, 0xda, 0xe1, 0xe2,
+        0xe3, 0xe4, 0xe5, 0xe6, 0xe7, 0xe8, 0xe9, 0xea, 0xf1, 0xf2, 0xf3, 0xf4, 0xf5, 0xf6, 0xf7, 0xf8,
+        0xf9, 0xfa,
+    ),
+)
+standardACChrominance = (
+    (0, 2, 1, 2, 4, 4, 3, 4, 7, 5, 4, 4, 0, 1, 2, 0x77),
+    (
+        0x00, 0x01, 0x02, 0x03, 0x11, 0x04, 0x05, 0x21, 0x31, 0x06, 0x12, 0x41, 0x51, 0x07, 0x61, 0x71,
+        0x13, 0x22, 0x32, 0x81, 0x08, 0x14, 0x42, 0x91, 0xa1, 0xb1, 0xc1, 0x09, 0x23, 0x33, 0x52, 0xf0,
+        0x15, 0x62, 0x72, 0xd1, 0x0a, 0x16, 0x24, 0x34, 0xe1, 0x25, 0xf1, 0x17, 0x18, 0x19, 0x1a, 0x26,
+        0x27, 0x28, 0x29, 0x2a, 0x35, 0x36, 0x37, 0x38, 0x39, 0x3a, 0x43, 0x44, 0x45, 0x46, 0x47, 0x48,
+        0x49, 0x4a, 0x53, 0x54, 0x55, 0x56, 0x57, 0x58, 0x59, 0x5a, 0x63, 0x64, 0x65, 0x66, 0x67, 0x68,
+        0x69, 0x6a, 0x73, 0x74, 0x75, 0x76, 0x77, 0x78, 0x79, 0x7a, 0x82, 0x83, 0x84, 0x85, 0x86, 0x87,
+        0x88, 0x89, 0x8a, 0x92, 0x93, 0x94, 0x95, 0x96, 0x97, 0x98, 0x99, 0x9a, 0xa2, 0xa3, 0xa4, 0xa5,
+        0xa6, 0xa7, 0xa8, 0xa9, 0xaa, 0xb2, 0xb3, 0xb4, 0xb5, 0xb6, 0xb7, 0xb8, 0xb9, 0xba, 0xc2, 0xc3,
+        0xc4, 0xc5, 0xc6, 0xc7, 0xc8, 0xc9, 0xca, 0xd2, 0xd3, 0xd4, 0xd5, 0xd6, 0xd7, 0xd8, 0xd9, 0xda,
+        0xe2, 0xe3, 0xe4, 0xe5, 0xe6, 0xe7, 0xe8, 0xe9, 0xea, 0xf2, 0xf3, 0xf4, 0xf5, 0xf6, 0xf7, 0xf8,
+        0xf9, 0xfa,
+    ),
+)
+
+
+class UnsupportedJpeg(ValueError):
+    pass
+
+
+# Width and height of any JPEG, from its frame header
+def frameSize(data):
+    if data[:2] != b'\xff\xd8':
+        raise UnsupportedJpeg('Not a JPEG')
+    offset = 2
+    while offset + 9 <= len(data):
+        if data[offset] != 0xFF:
+            raise UnsupportedJpeg('Corrupt marker at %d' % offset)
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            offset = offset + 1
+            continue
+        if 0xC0 <= marker <= 0xCF and marker not in (DHT, 0xC8, 0xCC):
+            (height, width) = struct.unpack_from('>HH', data, offset + 5)
+            return (width, height)
+        offset = offset + 2 + struct.unpack_from('>H', data, offset + 2)[0]
+    raise UnsupportedJpeg('No frame header')
+
+def segment(marker, payload):
+    return struct.pack('>BBH', 0xFF, marker, len(payload) + 2) + payload
+
+# Canonical Huffman codes for a table: {symbol: (code, length)}
+def huffmanCodes(table):
+    (counts, symbols) = table
+    codes = {}
+    code = 0
+    index = 0
+    for length in range(1, 17):
+        for i in range(counts[length - 1]):
+            codes[symbols[index]] = (code, length)
+            code = code + 1
+            index = index + 1
+        code = code << 1
+    return codes
+
+# A lookup table for decoding: indexed by the next 16 bits of the stream, giving (code length, symbol)
+def huffmanLookup(table):
+    lookup = [(0, None)] * 65536
+    for symbol, (code, length) in huffmanCodes(table).items():
+        start = code << (16 - length)
+        lookup[start:start + (1 << (16 - length))] = [(length, symbol)] * (1 << (16 - length))
+    return lookup
+
+
+class Frame:
+    def __init__(self, payload):
+        (self.precision, self.height, self.width, componentCount) = struct.unpack_from('>BHHB', payload, 0)
+        self.components = []
+        for i in range(componentCount):
+            (componentId, sampling, quantTable) = struct.unpack_from('>BBB', payload, 6 + 3 * i)
+            self.components.append((componentId, sampling >> 4, sampling & 0x0F, quantTable))
+        self.maxH = max(component[1] for component in self.components)
+        self.maxV = max(component[2] for component in self.components)
+        self.mcuWidth = 8 * self.maxH
+        self.mcuHeight = 8 * self.maxV
+        self.mcusPerRow = (self.width + self.mcuWidth - 1) // self.mcuWidth
+        self.mcuRows = (self.height + self.mcuHeight - 1) // self.mcuHeight
+
+    def samplingFactors(self):
+        return ','.join('%dx%d' % (h, v) for (componentId, h, v, quantTable) in self.components)
+
+
+# The markers of a JPEG up to its (single) scan, and the entropy-coded data of that scan
+class JpegStream:
+
+    def __init__(self, data):
+        if data[:2] != b'\xff\xd8':
+            raise UnsupportedJpeg('Not a JPEG')
+        self.segments = []
+        self.quantTables = {}
+        self.huffmanTables = {}
+        self.restartInterval = 0
+        self.frame = None
+        offset = 2
+        while True:
+            # Skip any fill bytes before the marker
+            while data[offset] == 0xFF and data[offset + 1] == 0xFF:
+                offset = offset + 1
+            if data[offset] != 0xFF:
+                raise UnsupportedJpeg('Corrupt marker at %d' % offset)
+            marker = data[offset + 1]
+            length = struct.unpack_from('>H', data, offset + 2)[0]
+            payload = data[offset + 4:offset + 2 + length]
+            offset = offset + 2 + length
+            if marker == SOS:
+                self.readScanHeader(payload)
+                break
+            self.segments.append((marker, payload))
+            if marker == DQT:
+                self.readQuantTables(payload)
+            elif marker == DHT:
+                self.readHuffmanTables(payload)
+            elif marker == DRI:
+                self.restartInterval = struct.unpack_from('>H', payload, 0)[0]
+            elif marker in (SOF0, SOF1):
+                self.frame = Frame(payload)
+            elif 0xC1 < marker <= 0xCF and marker not in (DHT, 0xC8, 0xCC):
+                raise UnsupportedJpeg('Only baseline Huffman-coded JPEGs are supported')
+        if self.frame is None or self.frame.precision != 8:
+            raise UnsupportedJpeg('Only 8 bit baseline JPEGs are supported')
+        end = data.rfind(b'\xff\xd9')
+        if end < offset:
+            raise UnsupportedJpeg('No end of image marker')
+        self.scanOffset = offset
+        self.entropyCodedData = data[offset:end]
+
+    def readQuantTables(self, payload):
+        offset = 0
+        while offset < len(payload):
+            precision = payload[offset] >> 4
+            tableId = payload[offset] & 0x0F
+            if precision == 0:
+                values = tuple(payload[offset + 1:offset + 65])
+                offset = offset + 65
+            else:
+                values = struct.unpack_from('>64H', payload, offset + 1)
+                offset = offset + 129
+            self.quantTables[tableId] = values
+
+    def readHuffmanTables(self, payload):
+        offset = 0
+        while offset < len(payload):
+            tableClass = payload[offset] >> 4
+            tableId = payload[offset] & 0x0F
+            counts = tuple(payload[offset + 1:offset + 17])
+            symbols = tuple(payload[offset + 17:offset + 17 + sum(counts)])
+            self.huffmanTables[(tableClass, tableId)] = (counts, symbols)
+            offset = offset + 17 + sum(counts)
+
+    def readScanHeader(self, payload):
+        componentCount = payload[0]
+        self.scanComponents = []
+        for i in range(componentCount):
+            (componentId, tables) = struct.unpack_from('>BB', payload, 1 + 2 * i)
+            self.scanComponents.append((componentId, tables >> 4, tables & 0x0F))
+        (spectralStart, spectralEnd, approximation) = struct.unpack_from('>BBB', payload, 1 + 2 * componentCount)
+        if spectralStart != 0 or spectralEnd != 63 or approximation != 0:
+            raise UnsupportedJpeg('Only sequential JPEGs are supported')
+
+    # Quantisation tables used by each component, in natural (row by row) order
+    def componentQuantTables(self):
+        tables = []
+        for (componentId, h, v, quantTable) in self.frame.components:
+            zigzagValues = self.quantTables[quantTable]
+            natural = [0] * 64
+            for i, position in enumerate(zigzag):
+                natural[position] = zigzagValues[i]
+            tables.append(tuple(natural))
+        return tables
+
+    # Huffman tables used by each component as (DC table, AC table)
+    def componentHuffmanTables(self):
+        selectors = {componentId: (dcTable, acTable) for (componentId, dcTable, acTable) in self.scanComponents}
+        tables = []
+        for (componentId, h, v, quantTable) in self.frame.components:
+            (dcTable, acTable) = selectors[componentId]
+            tables.append((self.huffmanTables[(0, dcTable)], self.huffmanTables[(1, acTable)]))
+        return tables
+
+    # Split the entropy-coded data at its restart markers
+    def restartIntervals(self):
+        data = self.entropyCodedData
+        intervals = []
+        start = 0
+        position = data.find(b'\xff', start)
+        while position != -1 and position + 1 < len(data):
+            following = data[position + 1]
+            if RST0 <= following <= RST0 + 7:
+                intervals.append(data[start:position])
+                start = position + 2
+                position = data.find(b'\xff', start)
+            else:
+                # Stuffed zero or fill byte
+                position = data.find(b'\xff', position + 2)
+        intervals.append(data[start:])
+        return intervals
+
+
+# Standard tables for each component of a frame: the luminance tables for the first component, chrominance for the rest
+def standardTables(frame):
+    tables = []
+    for index in range(len(frame.components)):
+        if index == 0:
+            tables.append((standardDCLuminance, standardACLuminance))
+        else:
+            tables.append((standardDCChrominance, standardACChrominance))
+    return tables
+
+
+class BitReader:
+    def __init__(self, data):
+        # Remove byte stuffing, and pad with ones as the encoder would
+        self.data = data.replace(b'\xff\x00', b'\xff') + b'\xff\xff\xff\xff'
+        self.position = 0
+
+    def peek16(self):
+        data = self.data
+        byte = self.position >> 3
+        window = (data[byte] << 16) | (data[byte + 1] << 8) | data[byte + 2]
+        return (window >> (8 - (self.position & 7))) & 0xFFFF
+
+    def read(self, count):
+        if count == 0:
+            return 0
+        value = self.peek16() >> (16 - count)
+        self.position = self.position + count
+        return value
+
+
+class BitWriter:
+    def __init__(self):
+        self.output = bytearray()
+        self.accumulator = 0
+        self.bitCount = 0
+
+    def write(self, value, count):
+        self.accumulator = (self.accumulator << count) | value
+        self.bitCount = self.bitCount + count
+        if self.bitCount >= 32:
+            self.bitCount = self.bitCount - 32
+            self.output += (self.accumulator >> self.bitCount).to_bytes(4, 'big')
+            self.accumulator = self.accumulator & ((1 << self.bitCount) - 1)
+
+    # Pad to a byte boundary with ones and return the stuffed data
+    def finish(self):
+        padding = (8 - self.bitCount % 8) % 8
+        self.write((1 << padding) - 1, padding)
+        self.output += self.accumulator.to_bytes(self.bitCount // 8, 'big')
+        self.accumulator = 0
+        self.bitCount = 0
+        data = bytes(self.output).replace(b'\xff', b'\xff\x00')
+        self.output = bytearray()
+        return data
+
+
+def extend(bits, size):
+    if size == 0:
+        return 0
+    if bits < (1 << (size - 1)):
+        return bits - (1 << size) + 1
+    return bits
+
+def magnitude(value):
+    if value >= 0:
+        return (value, value.bit_length())
+    size = (-value).bit_length()
+    return (value + (1 << size) - 1, size)
+
+# Losslessly re-code a baseline JPEG with the standard Huffman tables and restart intervals of the given number of MCUs.
+# Only the entropy coding changes: the quantised coefficients, and so the decoded pixels, are exactly those of the source
+def transcode(data, restartInterval):
+    stream = JpegStream(data)
+    frame = stream.frame
+    if len(stream.scanComponents) != len(frame.components):
+        raise UnsupportedJpeg('Only single scan, interleaved JPEGs are supported')
+
+    sourceTables = stream.componentHuffmanTables()
+    targetTables = standardTables(frame)
+    # Per component: (blocks per MCU, DC lookup, AC lookup, DC codes, AC codes)
+    components = []
+    for index, (componentId, h, v, quantTable) in enumerate(frame.components):
+        (sourceDC, sourceAC) = sourceTables[index]
+        (targetDC, targetAC) = targetTables[index]
+        components.append((h * v, huffmanLookup(sourceDC), huffmanLookup(sourceAC), huffmanCodes(targetDC), huffmanCodes(targetAC)))
+
+    sourceIntervals = stream.restartIntervals()
+    sourceInterval = 0
+    reader = BitReader(sourceIntervals[0])
+    writer = BitWriter()
+    sourcePredictors = [0] * len(components)
+    targetPredictors = [0] * len(components)
+    intervals = []
+    mcuCount = frame.mcusPerRow * frame.mcuRows
+    for mcu in range(mcuCount):
+        if stream.restartInterval and mcu > 0 and mcu % stream.restartInterval == 0:
+            sourceInterval = sourceInterval + 1
+            reader = BitReader(sourceIntervals[sourceInterval])
+            sourcePredictors = [0] * len(components)
+        if mcu > 0 and mcu % restartInterval == 0:
+            intervals.append(writer.finish())
+            targetPredictors = [0] * len(components)
+        for index, (blockCount, dcLookup, acLookup, dcCodes, acCodes) in enumerate(components):
+            for block in range(blockCount):
+                # DC: the difference from the previous block must be recalculated as the restart points have moved
+                (length, size) = dcLookup[reader.peek16()]
+                if size is None:
+                    raise UnsupportedJpeg('Corrupt entropy-coded data in MCU %d' % mcu)
+                reader.position = reader.position + length
+                dc = sourcePredictors[index] + extend(reader.read(size), size)
+                sourcePredictors[index] = dc
+                (bits, size) = magnitude(dc - targetPredictors[index])
+                targetPredictors[index] = dc
+                (code, length) = dcCodes[size]
+                writer.write((code << size) | bits, length + size)
+
+                # AC: symbols are re-coded, their extra bits copied as they are
+                k = 1
+                while k < 64:
+                    (length, symbol) = acLookup[reader.peek16()]
+                    if symbol is None:
+                        raise UnsupportedJpeg('Corrupt entropy-coded data in MCU %d' % mcu)
+                    reader.position = reader.position + length
+                    size = symbol & 0x0F
+                    (code, length) = acCodes[symbol]
+                    if size == 0:
+                        writer.write(code, length)
+                        if symbol == 0xF0:
+                            k = k + 16
+                            continue
+                        break
+                    writer.write((code << size) | reader.read(size), length + size)
+                    k = k + (symbol >> 4) + 1
+    intervals.append(writer.finish())
+    return assemble(header(stream, restartInterval), intervals)
+
+# The markers for a restart-coded version of a stream: everything up to the frame from the source, then the standard
+# Huffman tables, the restart interval and the scan header
+def header(stream, restartInterval):
+    output = bytearray(b'\xff\xd8')
+    for (marker, payload) in stream.segments:
+        if marker not in (DHT, DRI):
+            output += segment(marker, payload)
+    tables = bytearray()
+    for (tableClass, tableId, (counts, symbols)) in [
+            (0, 0, standardDCLuminance), (1, 0, standardACLuminance),
+            (0, 1, standardDCChrominance), (1, 1, standardACChrominance)]:
+        tables += bytes([(tableClass << 4) | tableId]) + bytes(counts) + bytes(symbols)
+    output += segment(DHT, bytes(tables))
+    output += segment(DRI, struct.pack('>H', restartInterval))
+    scan = bytearray([len(stream.frame.components)])
+    for index, (componentId, h, v, quantTable) in enumerate(stream.frame.components):
+        table = 0 if index == 0 else 1
+        scan += bytes([componentId, (table << 4) | table])
+    scan += bytes([0, 63, 0])
+    output += segment(SOS, bytes(scan))
+    return bytes(output)
+
+def assemble(headerData, intervals):
+    output = bytearray(headerData)
+    for index, interval in enumerate(intervals):
+        if index > 0:
+            output += bytes([0xFF, RST0 + (index - 1) % 8])
+        output += interval
+    output += b'\xff\xd9'
+    return bytes(output)
+
+# The largest number of MCUs no more than the target that evenly divides an MCU row
+def tileMCUs(frame, target):
+    for count in range(min(target, frame.mcusPerRow), 0, -1):
+        if frame.mcusPerRow % count == 0:
+            return count
+    return 1
+
+
+# A restart-coded JPEG, split in to its tiles
+class PatchableJpeg:
+
+    def __init__(self, data):
+        self.stream = JpegStream(data)
+        self.frame = self.stream.frame
+        self.tileMCUs = self.stream.restartInterval
+        if self.tileMCUs == 0 or self.frame.mcusPerRow % self.tileMCUs != 0:
+            raise UnsupportedJpeg('Restart intervals are not tiles')
+        self.tilesPerRow = self.frame.mcusPerRow // self.tileMCUs
+        self.header = data[:self.stream.scanOffset]
+        self.tiles = self.stream.restartIntervals()
+        if len(self.tiles) != self.tilesPerRow * self.frame.mcuRows:
+            raise UnsupportedJpeg('Unexpected number of restart intervals')
+
+    # Pixel rectangle (left, top, width, height) covered by a tile
+    def tileRect(self, index):
+        frame = self.frame
+        left = (index % self.tilesPerRow) * self.tileMCUs * frame.mcuWidth
+        top = (index // self.tilesPerRow) * frame.mcuHeight
+        return (left, top, min(self.tileMCUs * frame.mcuWidth, frame.width - left), min(frame.mcuHeight, frame.height - top))
+
+    # Indices of the tiles touched by any of a list of (left, top, width, height) boxes
+    def tilesTouching(self, boxes):
+        frame = self.frame
+        tileWidth = self.tileMCUs * frame.mcuWidth
+        touched = set()
+        for (left, top, width, height) in boxes:
+            left = max(left, 0)
+            top = max(top, 0)
+            right = min(left + width, frame.width) - 1
+            bottom = min(top + height, frame.height) - 1
+            if right < left or bottom < top:
+                continue
+            for row in range(top // frame.mcuHeight, bottom // frame.mcuHeight + 1):
+                for column in range(left // tileWidth, right // tileWidth + 1):
+                    touched.add(row * self.tilesPerRow + column)
+        return sorted(touched)
+
+    # Sampling factors in the form ImageMagick's jpeg:sampling-factor option takes
+    def samplingFactors(self):
+        return self.frame.samplingFactors()
+
+    # Quantisation tables in ImageMagick's jpeg:q-table format, so that tiles are encoded exactly as the template was
+    def quantTableXml(self):
+        tables = self.stream.componentQuantTables()
+        if len(tables) > 2 and any(table != tables[1] for table in tables[2:]):
+            raise UnsupportedJpeg('Chrominance components use different quantisation tables')
+        xml = '<?xml version="1.0"?>\n<quantization-tables>\n'
+        for slot, table in enumerate(tables[:2]):
+            levels = ',\n'.join(', '.join('%d' % value for value in table[row * 8:row * 8 + 8]) for row in range(8))
+            xml = xml + '  <table slot="%d">\n    <levels width="8" height="8" divisor="1">\n%s\n    </levels>\n  </table>\n' % (slot, levels)
+        return xml + '</quantization-tables>\n'
+
+    # Extract the entropy-coded data from a separately encoded tile, checking it was encoded compatibly with us
+    def tileData(self, tileJpeg):
+        tile = JpegStream(tileJpeg)
+        if tile.restartInterval != 0:
+            raise UnsupportedJpeg('Tile has restart intervals')
+        ours = [(componentId, h, v) for (componentId, h, v, quantTable) in self.frame.components]
+        theirs = [(componentId, h, v) for (componentId, h, v, quantTable) in tile.frame.components]
+        if ours != theirs:
+            raise UnsupportedJpeg('Tile has different components')
+        if [componentId for (componentId, dcTable, acTable) in tile.scanComponents] != [component[0] for component in ours]:
+            raise UnsupportedJpeg('Tile has a different scan')
+        if tile.componentQuantTables() != self.stream.componentQuantTables():
+            raise UnsupportedJpeg('Tile has different quantisation tables')
+        if tile.componentHuffmanTables() != standardTables(self.frame):
+            raise UnsupportedJpeg('Tile has different Huffman tables')
+        return tile.entropyCodedData
+
+    # The JPEG with some tiles replaced by new entropy-coded data
+    def patched(self, replacements):
+        tiles = [replacements.get(index, tile) for index, tile in enumerate(self.tiles)]
+        return assemble(self.header, tiles)